@@ -0,0 +1,235 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import as_completed
+import forecast
+import lead_store
+import profiling
+
+# Months ahead forecast from every cutoff
+BACKTEST_HORIZON = int(os.getenv('TERRECE_BACKTEST_HORIZON', '3'))
+
+# Cutoffs between full refits; in between the fitted model is only extended with the new months
+REFIT_EVERY = int(os.getenv('TERRECE_BACKTEST_REFIT_EVERY', '6'))
+
+# Months of history the first cutoff is trained on
+MIN_TRAINING_MONTHS = 12
+
+# Interval coverage is reported for these bands of forecast_location's results
+INTERVALS = {'50': ('Lower_Bound_50', 'Upper_Bound_50'), '95': ('Lower_Bound_95', 'Upper_Bound_95')}
+
+def location_series(df_monthly, location, end_month):
+    """
+    Monthly lead counts of one location through end_month
+
+    Months without leads are missing from prepare_data's output; here they are
+    filled with zero so the series has no gaps and the state-space model can
+    be extended one month at a time.
+    """
+    location_data = df_monthly[(df_monthly['Media_Location_Text__c'] == location) &
+                               (df_monthly['month'] <= end_month)]
+    ts = location_data.set_index('month')['Leads']
+    if ts.empty:
+        return ts
+    months = pd.period_range(start=ts.index.min(), end=end_month, freq='M')
+    return ts.groupby(level=0).sum().reindex(months, fill_value=0).astype(int)
+
+def _fit(ts_log, start_params=None):
+    """Fit ARIMA within forecast.py's budget, or return None if it fails or doesn't converge"""
+    from statsmodels.tsa.arima.model import ARIMA
+    try:
+        model = ARIMA(ts_log, order=forecast.MODEL_ORDER, freq='M')
+        model_fit = forecast.fit_within_budget(model, start_params)
+        if not model_fit.mle_retvals.get('converged', True):
+            return None
+        return model_fit
+    except Exception:
+        return None
+
+def backtest_location(location, ts, first_cutoff, horizon=BACKTEST_HORIZON, refit_every=REFIT_EVERY):
+    """
+    Forecast a location from every cutoff month and compare with what happened
+
+    The cutoff walks forward one month at a time from first_cutoff to the
+    month before the last one in ts. The model is fitted at the first cutoff
+    and refitted every refit_every cutoffs (starting from the previous
+    parameters); at the cutoffs in between the fitted model is extended with
+    the month just observed, keeping its parameters, so only the Kalman
+    filter runs over that one month. When a fit fails the cutoffs up to the
+    next refit are forecast with forecast.fallback_forecast.
+
+    Forecasts are back-transformed, rounded and floored at zero the same way
+    forecast_location does, without any adjustment.
+
+    Returns:
+    - List of result dicts, one per cutoff and forecast month with an actual value
+    """
+    ts_log = np.log1p(ts.astype('float64'))
+    last_month = ts.index[-1]
+    results = []
+    model_fit = params = None
+    since_refit = None
+    for cutoff in pd.period_range(start=first_cutoff, end=last_month - 1, freq='M'):
+        refit = since_refit is None or since_refit >= refit_every
+        if refit:
+            with profiling.span('backtest.fit', location=location, cutoff=str(cutoff)):
+                model_fit = _fit(ts_log[:cutoff], params)
+            params = model_fit.params if model_fit is not None else None
+            since_refit = 0
+        elif model_fit is not None:
+            model_fit = model_fit.extend(ts_log[cutoff:cutoff])
+        since_refit += 1
+
+        steps = min(horizon, (last_month - cutoff).n)
+        if model_fit is not None:
+            forecast_result = model_fit.get_forecast(steps=steps)
+            forecast_log = forecast_result.predicted_mean
+            conf_int_log_95 = forecast_result.conf_int(alpha=0.05)
+            conf_int_log_50 = forecast_result.conf_int(alpha=0.50)
+            engine = 'statsmodels'
+        else:
+            forecast_log, conf_int_log_95, conf_int_log_50 = forecast.fallback_forecast(ts_log[:cutoff], steps)
+            engine = forecast.FALLBACK_ENGINE
+
+        predicted = np.maximum(np.round(np.expm1(forecast_log.to_numpy())), 0).astype(int)
+        conf_int_95 = np.maximum(np.round(np.expm1(conf_int_log_95.to_numpy())), 0).astype(int)
+        conf_int_50 = np.maximum(np.round(np.expm1(conf_int_log_50.to_numpy())), 0).astype(int)
+        for step in range(steps):
+            month = cutoff + step + 1
+            results.append({
+                'Location': location,
+                'Cutoff': str(cutoff),
+                'Month': str(month),
+                'Horizon': step + 1,
+                'Actual': int(ts[month]),
+                'Predicted_Monthly_Leads': int(predicted[step]),
+                'Lower_Bound_95': int(conf_int_95[step, 0]),
+                'Upper_Bound_95': int(conf_int_95[step, 1]),
+                'Lower_Bound_50': int(conf_int_50[step, 0]),
+                'Upper_Bound_50': int(conf_int_50[step, 1]),
+                'Engine': engine,
+                'Refit': refit
+            })
+    return results
+
+def summarize(results_df):
+    """
+    Accuracy per location and horizon, plus an 'All Locations' row per horizon
+
+    MAPE is the mean absolute percentage error over the months with leads
+    (a month with no leads has no percentage error). Coverage_50 and
+    Coverage_95 are the shares of actual values inside the 50% and 95%
+    intervals, which should come out near 0.50 and 0.95.
+    """
+    df = results_df.copy()
+    df['APE'] = np.where(df['Actual'] > 0,
+                         (df['Predicted_Monthly_Leads'] - df['Actual']).abs() / df['Actual'].where(df['Actual'] > 0),
+                         np.nan)
+    for band, (lower, upper) in INTERVALS.items():
+        df[f'Coverage_{band}'] = (df['Actual'] >= df[lower]) & (df['Actual'] <= df[upper])
+    overall = df.assign(Location='All Locations')
+
+    summary = pd.concat([df, overall]).groupby(['Location', 'Horizon'], sort=False).agg(
+        Forecasts=('Actual', 'size'),
+        MAPE=('APE', 'mean'),
+        Coverage_50=('Coverage_50', 'mean'),
+        Coverage_95=('Coverage_95', 'mean'),
+        Refits=('Refit', 'sum')
+    ).reset_index()
+    summary['MAPE'] = summary['MAPE'] * 100
+    return summary
+
+def run_backtest(df_monthly, start=None, end=None, horizon=BACKTEST_HORIZON, refit_every=REFIT_EVERY,
+                 selected_location=None, workers=1):
+    """
+    Backtest every location over the monthly lead counts produced by prepare_data
+
+    Parameters:
+    - df_monthly: Monthly lead counts (see forecast.load_monthly_data)
+    - start: First cutoff month, defaults to MIN_TRAINING_MONTHS after each location's first month
+    - end: Last month with actual values, defaults to the last complete month
+    - horizon: Months forecast from every cutoff
+    - refit_every: Cutoffs between full refits (1 refits at every cutoff)
+    - selected_location: Backtest only this location
+    - workers: Processes used to backtest locations in parallel (forecast.py's pool)
+
+    Returns:
+    - tuple: (DataFrame of every forecast and its actual value, summary DataFrame), both empty if nothing could be backtested
+    """
+    end = pd.Timestamp.now().to_period('M') - 1 if end is None else pd.Period(end, freq='M')
+    if selected_location and selected_location != 'All Locations':
+        locations = [selected_location]
+    else:
+        locations = [location for location in df_monthly['Media_Location_Text__c'].unique() if location is not None]
+
+    tasks = []
+    for location in locations:
+        ts = location_series(df_monthly, location, end)
+        first_cutoff = pd.Period(start, freq='M') if start else (ts.index[0] + MIN_TRAINING_MONTHS - 1 if len(ts) else None)
+        if len(ts) == 0 or first_cutoff < ts.index[0] + 2 or first_cutoff >= end:
+            # Need at least 3 months of training data, as forecast_monthly_data does
+            print(f"Skipping {location} - insufficient monthly data")
+            continue
+        tasks.append((location, ts, first_cutoff, horizon, refit_every))
+
+    results = []
+    with profiling.span('backtest', locations=len(tasks), workers=workers):
+        if workers is None or workers <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                results.extend(backtest_location(*task))
+        else:
+            pool = forecast.get_process_pool(workers)
+            futures = {pool.submit(backtest_location, *task): task[0] for task in tasks}
+            for future in as_completed(futures):
+                try:
+                    results.extend(future.result())
+                except Exception as e:
+                    print(f"Error backtesting {futures[future]}: {str(e)}")
+
+    if not results:
+        return pd.DataFrame(), pd.DataFrame()
+    results_df = pd.DataFrame(results).sort_values(['Location', 'Cutoff', 'Horizon'], ignore_index=True)
+    return results_df, summarize(results_df)
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest Terrece forecasts over past months with a rolling origin")
+    parser.add_argument("--input", default=lead_store.COUNTS_STORE_DIR,
+                        help=f"Lead store directory or CSV file (default: {lead_store.COUNTS_STORE_DIR}, synced by batch_forecast.py)")
+    parser.add_argument("--start", help=f"First cutoff month as YYYY-MM (default: {MIN_TRAINING_MONTHS} months into each location's history)")
+    parser.add_argument("--end", help="Last month to compare with as YYYY-MM (default: last complete month)")
+    parser.add_argument("--horizon", type=int, default=BACKTEST_HORIZON, help=f"Months forecast from every cutoff (default: {BACKTEST_HORIZON})")
+    parser.add_argument("--refit-every", type=int, default=REFIT_EVERY, help=f"Cutoffs between full refits (default: {REFIT_EVERY})")
+    parser.add_argument("--location", help="Backtest only this location")
+    parser.add_argument("--workers", type=int, default=1, help="Processes used to backtest locations in parallel")
+    parser.add_argument("--output", default="backtest_results", help="Directory for the forecasts and summary CSV files (default: backtest_results)")
+    args = parser.parse_args()
+    if args.horizon < 1 or args.refit_every < 1:
+        print("--horizon and --refit-every must be at least 1")
+        return 1
+    if not os.path.exists(args.input):
+        print(f"No lead data at {args.input}: run batch_forecast.py first or pass --input")
+        return 1
+
+    started = time.perf_counter()
+    df_monthly = forecast.load_monthly_data(args.input)
+    results_df, summary = run_backtest(df_monthly, start=args.start, end=args.end, horizon=args.horizon,
+                                       refit_every=args.refit_every, selected_location=args.location,
+                                       workers=args.workers)
+    if results_df.empty:
+        print("Nothing to backtest")
+        return 1
+
+    os.makedirs(args.output, exist_ok=True)
+    results_df.to_csv(os.path.join(args.output, "backtest_forecasts.csv"), index=False)
+    summary.to_csv(os.path.join(args.output, "backtest_summary.csv"), index=False)
+    with pd.option_context('display.max_rows', None, 'display.width', 120, 'display.float_format', '{:.2f}'.format):
+        print(summary.to_string(index=False))
+    print(f"\nBacktested {len(results_df)} forecasts from {results_df['Cutoff'].nunique()} cutoffs "
+          f"in {time.perf_counter() - started:.1f}s; results saved to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
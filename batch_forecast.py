@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Nightly batch forecasting for Terrece
+
+Syncs lead data from Salesforce, forecasts every location for every month
+offered in the app and saves the results in the results store
+(results_store.py), from which the app serves them without recomputing. The
+charts of the unadjusted results are drawn into the shared chart cache
+(charts.py) so the app only draws charts for other adjustments.
+
+Run from cron or a systemd timer in the app's directory, e.g.:
+
+    python batch_forecast.py --workers 4
+
+Credentials come from credentials.ini or the SF_USERNAME, SF_PASSWORD and
+SF_SECURITY_TOKEN environment variables.
+"""
+
+import argparse
+import configparser
+import os
+import sys
+import time
+import pandas as pd
+from query import get_salesforce_data
+from forecast import ENGINES, forecast_leads, get_process_pool, load_monthly_data
+import charts
+import metrics
+import results_store
+import workspace
+
+# Prediction months offered in the app's month selector
+PREDICTION_MONTHS_START = '2025-01'
+PREDICTION_MONTH_COUNT = 12
+
+def prediction_months():
+    """Return the months offered in the app as YYYY-MM strings"""
+    return list(pd.period_range(start=PREDICTION_MONTHS_START, periods=PREDICTION_MONTH_COUNT, freq='M').strftime('%Y-%m'))
+
+def load_credentials():
+    """Read Salesforce credentials from credentials.ini, falling back to environment variables"""
+    username = os.getenv('SF_USERNAME', '')
+    password = os.getenv('SF_PASSWORD', '')
+    security_token = os.getenv('SF_SECURITY_TOKEN', '')
+
+    if os.path.isfile('credentials.ini'):
+        config = configparser.ConfigParser()
+        config.read('credentials.ini')
+        if 'salesforce' in config:
+            sf_config = config['salesforce']
+            username = sf_config.get('username', username)
+            password = sf_config.get('password', password)
+            security_token = sf_config.get('security_token', security_token)
+
+    return username, password, security_token
+
+def run_batch(username, password, security_token, months=None, engine='statsmodels', workers=1,
+              db_path=results_store.RESULTS_DB, store_dir=None, sf=None):
+    """
+    Sync lead data and store forecasts for every location and month
+
+    Months after the current one are forecast directly from the current month
+    (the app's default "direct" method), matching what the app computes live.
+
+    Returns:
+    - tuple: (number of months stored, error message or None)
+    """
+    months = months or prediction_months()
+    output_file, error = get_salesforce_data(username, password, security_token, store_dir=store_dir,
+                                             aggregate=True, sf=sf)
+    if error:
+        return 0, error
+
+    monthly_data = load_monthly_data(output_file)
+    current_month = pd.Timestamp.now().to_period('M')
+    stored = 0
+    with workspace.temporary() as work_dir:
+        output_dir = workspace.results_dir(work_dir)
+        for month in months:
+            started = time.perf_counter()
+            forecast_start = current_month if pd.Period(month, freq='M') > current_month else None
+            results = forecast_leads(output_file, month, 'All Locations', workers=workers, forecast_start=forecast_start,
+                                     monthly_data=monthly_data, engine=engine, output_dir=output_dir)
+            if results is None:
+                print(f"No forecasts for {month}")
+                continue
+            locations = results_store.save_forecasts(results, month, engine, current_month, db_path=db_path)
+            charts.render_charts(charts.chart_specs(results), pool=get_process_pool(workers) if workers > 1 else None)
+            stored += 1
+            metrics.observe('terrece_forecast_seconds', time.perf_counter() - started,
+                            location='All Locations', engine=engine, source='batch')
+            print(f"Stored {month}: {locations} locations in {time.perf_counter() - started:.1f}s")
+
+    return stored, None
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute Terrece forecasts for every location and month")
+    parser.add_argument("--months", nargs="+", help="Prediction months as YYYY-MM (default: every month offered in the app)")
+    parser.add_argument("--engine", choices=ENGINES, default="statsmodels", help="Model engine (default: statsmodels)")
+    parser.add_argument("--workers", type=int, default=1, help="Processes used to fit locations in parallel")
+    parser.add_argument("--db", default=results_store.RESULTS_DB, help=f"Results store file (default: {results_store.RESULTS_DB})")
+    args = parser.parse_args()
+
+    username, password, security_token = load_credentials()
+    if not all([username, password, security_token]):
+        print("Salesforce credentials not found in credentials.ini or environment variables.")
+        return 1
+
+    metrics.start_exporter()
+    started = time.perf_counter()
+    stored, error = run_batch(username, password, security_token, months=args.months, engine=args.engine,
+                              workers=args.workers, db_path=args.db)
+    # The last write, with everything the run recorded, before the process exits
+    metrics.write_textfile()
+    if error:
+        print(f"Batch forecast failed: {error}")
+        return 1
+    print(f"\nStored forecasts for {stored} month(s) in {args.db} ({time.perf_counter() - started:.1f}s)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
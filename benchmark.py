@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the forecasting pipeline
+
+Generates a synthetic lead history at a chosen scale, serves it from the
+local stand-in for the Salesforce query API (fake_salesforce.py) and times
+every stage of the pipeline, from a cold import of the app to building the
+download ZIP. Each stage reports wall time, peak traced memory and
+throughput. Results can be saved as a named baseline and later runs
+compared against it:
+
+    python benchmark.py --save before
+    python benchmark.py --compare before
+
+No Salesforce credentials are needed, and everything the pipeline writes
+goes to a temporary directory.
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+import numpy as np
+import pandas as pd
+import batch_arima
+import charts
+import fake_salesforce
+import forecast
+import lead_store
+import locations
+import query
+import streamlit.config
+import streamlit.logger
+import terrece
+
+# Where named baselines are saved
+BASELINE_DIR = "benchmark_baselines"
+
+# A stage counts as a regression when it is this much slower than the baseline...
+DEFAULT_THRESHOLD = 0.10
+# ...and at least this many seconds slower, so tiny stages don't flag on noise
+NOISE_FLOOR_SECONDS = 0.05
+
+STAGES = ['import', 'sync', 'sync_counts', 'load', 'prepare', 'fit_statsmodels', 'fit_batch', 'plot',
+          'chain_direct', 'chain_recursive', 'zip']
+
+# Entry points timed by the import stage, each in a fresh interpreter
+IMPORT_MODULES = ['terrece', 'batch_forecast', 'start_app']
+# Seconds a cold import of each of them may take before the benchmark fails
+IMPORT_BUDGET_SECONDS = float(os.getenv('TERRECE_IMPORT_BUDGET_SECONDS', '0.75'))
+# Loaded on first fit, chart or connection; importing an entry point must not pull them in
+DEFERRED_MODULES = ['statsmodels', 'matplotlib', 'altair', 'simple_salesforce']
+
+# Share of generated leads in each status (the last one is not counted as a lead)
+STATUS_WEIGHTS = {
+    'Future Prospect': 0.35,
+    'Converted': 0.25,
+    'Client Registration': 0.15,
+    'TOF Waitlist': 0.05,
+    'Unqualified Lead': 0.20
+}
+
+def location_names(count):
+    """Real location names first, then numbered synthetic ones"""
+    names = locations.canonical_locations()
+    names += [f"Synthetic {i:03d}" for i in range(1, count - len(names) + 1)]
+    return names[:count]
+
+def synthetic_leads(locations, months, leads_per_day, seed=0):
+    """
+    Generate a realistic Lead history for the last `months` months
+
+    Each location has its own volume, trend and opening date (about one in
+    five opens partway through the history). Volumes follow a yearly cycle,
+    a month-to-month random walk and fewer leads at weekends. Leads get a
+    mix of statuses, and some are modified after they were created.
+
+    Returns:
+    - DataFrame with one row per Lead and Salesforce field names as columns
+    """
+    rng = np.random.default_rng(seed)
+    now = pd.Timestamp.now(tz='UTC')
+    days = pd.date_range(now.floor('D') - pd.DateOffset(months=months), now.floor('D'), freq='D')
+    n_locations = len(locations)
+
+    # Daily rate per location: base volume x trend x season x monthly drift x weekday
+    base = leads_per_day * rng.lognormal(0, 0.5, n_locations)
+    years = np.arange(len(days)) / 365.25
+    trend = np.exp(np.outer(rng.normal(0, 0.15, n_locations), years))
+    season = np.exp(0.2 * np.sin(2 * np.pi * (days.month.to_numpy() - 3) / 12))
+    month_codes = (days.year - days.year[0]) * 12 + days.month - days.month[0]
+    drift = np.exp(np.cumsum(rng.normal(0, 0.08, (n_locations, month_codes.max() + 1)), axis=1))[:, month_codes]
+    weekday = np.where(days.dayofweek >= 5, 0.6, 1.0)
+    rate = base[:, None] * trend * season * drift * weekday
+
+    # Some locations only open partway through the history
+    opening = np.where(rng.random(n_locations) < 0.2, rng.integers(0, max(1, len(days) - 120), n_locations), 0)
+    rate[np.arange(len(days))[None, :] < opening[:, None]] = 0
+
+    counts = rng.poisson(rate)
+    location_index, day_index = np.nonzero(counts)
+    repeats = counts[location_index, day_index]
+    total = repeats.sum()
+    created = days[np.repeat(day_index, repeats)] + pd.to_timedelta(rng.integers(0, 86400, total), unit='s')
+    # Status changes after creation move SystemModstamp on, but never past now
+    modified = created + pd.to_timedelta(np.where(rng.random(total) < 0.3, rng.exponential(5, total), 0), unit='D')
+    modified = modified.where(modified <= now, now)
+
+    return pd.DataFrame({
+        'Id': [f"00Q{i:015d}" for i in range(total)],
+        'CreatedDate': created.strftime('%Y-%m-%dT%H:%M:%S.000+0000'),
+        'SystemModstamp': modified.strftime('%Y-%m-%dT%H:%M:%S.000+0000'),
+        'IsDeleted': False,
+        'Media_Location_Text__c': np.asarray(locations, dtype=object)[np.repeat(location_index, repeats)],
+        'Status': rng.choice(list(STATUS_WEIGHTS), size=total, p=list(STATUS_WEIGHTS.values()))
+    })
+
+def measure(run, repeat=1, trace_memory=True):
+    """
+    Time a stage and record its peak memory
+
+    run is called repeat times and the fastest wall time is kept. Peak
+    memory comes from one further run under tracemalloc, which is kept out
+    of the timings because tracing slows Python code down.
+
+    Returns:
+    - tuple: (seconds, peak MB or None, result of the last run)
+    """
+    seconds = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - started
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    peak_mb = None
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            result = run()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        finally:
+            tracemalloc.stop()
+    return seconds, peak_mb, result
+
+@contextlib.contextmanager
+def quiet():
+    """Silence pipeline output: progress prints for every month and location and statsmodels warnings"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        yield
+
+def cold_import(module, repeat=1):
+    """
+    Time the import of a module in a fresh interpreter, as at app or CLI startup
+
+    Returns:
+    - tuple: (fastest seconds, list of DEFERRED_MODULES the import loaded)
+    """
+    probe = (f"import sys, time\n"
+             f"started = time.perf_counter()\n"
+             f"import {module}\n"
+             f"print(time.perf_counter() - started)\n"
+             f"print(' '.join(name for name in {DEFERRED_MODULES!r} if name in sys.modules))\n")
+    seconds = None
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.splitlines()
+        elapsed = float(output[-2])
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    return seconds, output[-1].split()
+
+def check_imports(repeat=1):
+    """
+    Time a cold import of every entry point against IMPORT_BUDGET_SECONDS
+
+    Returns:
+    - tuple: (stage result as recorded by run_benchmarks, list of failures)
+    """
+    total = 0.0
+    failures = []
+    for module in IMPORT_MODULES:
+        seconds, loaded = cold_import(module, repeat)
+        total += seconds
+        problems = []
+        if seconds > IMPORT_BUDGET_SECONDS:
+            problems.append(f"over the {IMPORT_BUDGET_SECONDS:.2f}s budget")
+        if loaded:
+            problems.append(f"loads {', '.join(loaded)}")
+        print(f"    {module:<14} {seconds:8.3f}s  {'; '.join(problems) or 'ok'}")
+        failures += [f"{module} {problem}" for problem in problems]
+    result = {
+        'seconds': total,
+        'peak_mb': None,
+        'items': len(IMPORT_MODULES),
+        'unit': 'modules',
+        'throughput': len(IMPORT_MODULES) / total if total else None
+    }
+    return result, failures
+
+def git_commit():
+    """Short hash of the checked out commit, or None outside a git checkout"""
+    try:
+        output = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        return output.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(args, stages):
+    """
+    Run the selected stages in pipeline order
+
+    Returns:
+    - dict of stage name -> {seconds, peak_mb, items, unit, throughput}; the
+      import stage adds 'failures', the entry points over budget
+    """
+    results = {}
+    if 'import' in stages:
+        print("Cold imports:")
+        results['import'], failures = check_imports(args.repeat)
+        results['import']['failures'] = failures
+        print(f"  {'import':<16} {results['import']['seconds']:8.3f}s  {len(IMPORT_MODULES)} modules")
+
+    names = location_names(args.locations)
+    leads = synthetic_leads(names, args.months, args.leads_per_day, args.seed)
+    print(f"Generated {len(leads)} leads for {len(names)} locations over {args.months} months")
+
+    def record(stage, run, items_of, unit):
+        if stage not in stages:
+            return None
+        with quiet():
+            seconds, peak_mb, result = measure(run, args.repeat, not args.no_memory)
+        items = items_of(result)
+        results[stage] = {
+            'seconds': seconds,
+            'peak_mb': peak_mb,
+            'items': items,
+            'unit': unit,
+            'throughput': items / seconds if seconds else None
+        }
+        memory = f", peak {peak_mb:.1f} MB" if peak_mb is not None else ""
+        print(f"  {stage:<16} {seconds:8.3f}s  {items} {unit}{memory}")
+        return result
+
+    current_month = pd.Timestamp.now().to_period('M')
+    store_dir = os.path.join(os.getcwd(), "store")
+
+    # Names beyond the real ones must pass the server-side location filter too
+    locations.set_registry({'locations': names})
+    try:
+        with fake_salesforce.FakeSalesforce(leads, page_size=args.page_size, latency=args.latency) as fake:
+            sf = fake.connect(query.create_pooled_session(args.workers))
+
+            def sync(aggregate):
+                target = store_dir + ("_counts" if aggregate else "")
+                shutil.rmtree(target, ignore_errors=True)
+                months_fetched, error = query.sync_lead_store(sf, target, aggregate=aggregate, max_workers=args.workers)
+                if error:
+                    raise RuntimeError(error)
+                return target
+
+            def synced_rows(target):
+                manifest = lead_store.load_manifest(target)
+                return sum(entry.get('records', 0) for entry in manifest['months'].values()) or \
+                    sum(entry.get('leads', 0) for entry in manifest['months'].values())
+
+            record('sync', lambda: sync(False), synced_rows, 'leads')
+            record('sync_counts', lambda: sync(True), synced_rows, 'leads')
+            if not os.path.isdir(store_dir):
+                with quiet():
+                    sync(False)
+    finally:
+        locations.set_registry(None)
+
+    daily = record('load', lambda: lead_store.read_leads(store_dir), len, 'rows')
+    if daily is None:
+        daily = lead_store.read_leads(store_dir)
+    monthly = record('prepare', lambda: forecast.prepare_data(daily.copy()), len, 'location-months')
+    if monthly is None:
+        monthly = forecast.prepare_data(daily.copy())
+    n_locations = monthly['Media_Location_Text__c'].nunique()
+
+    fit = lambda engine: forecast.forecast_monthly_data(monthly, workers=args.forecast_workers, cache_dir=None,
+                                                         render=False, engine=engine)
+    record('fit_statsmodels', lambda: fit('statsmodels'), lambda r: 0 if r is None else len(r), 'locations')
+    record('fit_batch', lambda: fit('batch'), lambda r: 0 if r is None else len(r), 'locations')
+
+    # Charts only: fits are computed up front and every chart is drawn (no chart cache)
+    if 'plot' in stages:
+        series = []
+        for location in monthly['Media_Location_Text__c'].unique():
+            location_data = monthly[(monthly['Media_Location_Text__c'] == location) & (monthly['month'] < current_month)]
+            if len(location_data) >= 3:
+                series.append((location, location_data.set_index('month')['Leads']))
+        fitted = batch_arima.fit_and_forecast_batch([np.log1p(ts) for _, ts in series], 1)
+
+        plot_results = pd.DataFrame([row for (location, ts), fit_result in zip(series, fitted)
+                                     for row in forecast.forecast_location(location, ts, current_month, current_month,
+                                                                           cache_dir=None, fitted=fit_result)])
+        charts.attach_chart_data(plot_results, dict(series), current_month, current_month, current_month)
+
+        def plot():
+            specs = charts.chart_specs(plot_results)
+            for spec in specs.values():
+                charts.render_chart(spec)
+            return len(specs)
+        record('plot', plot, lambda count: count, 'charts')
+
+    target_month = (current_month + 2).strftime('%Y-%m')
+    chain = lambda method: terrece.generate_chain_forecast(store_dir, target_month, 'All Locations',
+                                                           workers=args.forecast_workers, method=method,
+                                                           monthly_data=monthly)
+    results_df = record('chain_direct', lambda: chain('direct'), lambda r: 0 if r is None else len(r), 'forecasts')
+    record('chain_recursive', lambda: chain('recursive'), lambda r: 0 if r is None else len(r), 'forecasts')
+
+    if 'zip' in stages:
+        if results_df is None:
+            with quiet():
+                results_df = chain('direct')
+        # Charts come from the chart cache, so only the archive itself is timed
+        with quiet():
+            charts.render_charts(charts.chart_specs(results_df))
+        download_dir = os.path.join(os.getcwd(), "downloads")
+
+        def build_zip():
+            # Built from scratch every time, not served from the previous run
+            shutil.rmtree(download_dir, ignore_errors=True)
+            return terrece.create_download_zip(results_df, download_dir)
+        record('zip', build_zip, lambda path: results_df['Location'].nunique() + 1, 'files')
+
+    return results
+
+def compare(results, baseline, threshold):
+    """
+    Print each stage against a saved baseline
+
+    Returns:
+    - List of stages that regressed by more than threshold
+    """
+    regressions = []
+    print(f"\nCompared with baseline from commit {baseline.get('commit') or 'unknown'} ({baseline.get('created')})")
+    print(f"  {'stage':<16} {'baseline':>9} {'current':>9} {'change':>8}")
+    for stage, result in results.items():
+        previous = baseline['stages'].get(stage)
+        if previous is None:
+            print(f"  {stage:<16} {'-':>9} {result['seconds']:8.3f}s")
+            continue
+        change = result['seconds'] / previous['seconds'] - 1 if previous['seconds'] else 0.0
+        regressed = change > threshold and result['seconds'] - previous['seconds'] > NOISE_FLOOR_SECONDS
+        flag = "  REGRESSION" if regressed else ""
+        print(f"  {stage:<16} {previous['seconds']:8.3f}s {result['seconds']:8.3f}s {change:+8.1%}{flag}")
+        if regressed:
+            regressions.append(stage)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the forecasting pipeline against a local fake Salesforce server")
+    parser.add_argument("--locations", type=int, default=26, help="Number of locations (default: 26)")
+    parser.add_argument("--months", type=int, default=36, help="Months of lead history (default: 36)")
+    parser.add_argument("--leads-per-day", type=float, default=5.0, help="Average leads per location per day (default: 5)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the generated history")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated round-trip seconds per Salesforce request")
+    parser.add_argument("--page-size", type=int, default=fake_salesforce.DEFAULT_PAGE_SIZE, help="Records per query page")
+    parser.add_argument("--workers", type=int, default=query.DEFAULT_FETCH_WORKERS, help="Concurrent fetch workers")
+    parser.add_argument("--forecast-workers", type=int, default=1, help="Processes used to fit locations")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per stage; the fastest is reported")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Comma-separated stages to run (default: all of {','.join(STAGES)})")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the extra traced run that measures peak memory")
+    parser.add_argument("--save", metavar="NAME", help=f"Save the results as baseline NAME in {BASELINE_DIR}/")
+    parser.add_argument("--compare", metavar="NAME", help="Compare the results with saved baseline NAME")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Slowdown that counts as a regression (default: 0.10)")
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(unknown)}")
+
+    baseline_dir = os.path.abspath(BASELINE_DIR)
+    baseline = None
+    if args.compare:
+        with open(os.path.join(baseline_dir, f"{args.compare}.json")) as f:
+            baseline = json.load(f)
+
+    # Streamlit warns on every st.* call made outside `streamlit run`. Its
+    # config is loaded on first use and sets the log level, so load it first.
+    streamlit.config.get_option('logger.level')
+    streamlit.logger.set_log_level(logging.ERROR)
+
+    workdir = tempfile.mkdtemp(prefix="terrace_benchmark_")
+    original_dir = os.getcwd()
+    os.chdir(workdir)
+    try:
+        results = run_benchmarks(args, stages)
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    params = {key: getattr(args, key) for key in ('locations', 'months', 'leads_per_day', 'seed', 'latency',
+                                                 'page_size', 'workers', 'forecast_workers', 'repeat')}
+    report = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'params': params,
+        'stages': results
+    }
+
+    if args.save:
+        os.makedirs(baseline_dir, exist_ok=True)
+        path = os.path.join(baseline_dir, f"{args.save}.json")
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved baseline to {path}")
+
+    if baseline is not None:
+        if baseline.get('params') != params:
+            print("Warning: the baseline was recorded with different parameters")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            raise SystemExit(f"Regressed stages: {', '.join(regressions)}")
+
+    import_failures = results.get('import', {}).get('failures')
+    if import_failures:
+        raise SystemExit(f"Import budget exceeded: {'; '.join(import_failures)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import pandas as pd
+import metrics
+import model_cache
+import profiling
+
+# Rendered charts by content hash, shared by every user (identical inputs give identical charts)
+CHART_CACHE_DIR = "chart_cache"
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+
+def attach_chart_data(results_df, histories, prediction_month, forecast_start, current_month):
+    """
+    Record what the charts of a results frame need beyond the results themselves
+
+    Stored in results_df.attrs['charts']: the training series of each location
+    and the months that decide the chart titles. The forecast values and
+    intervals are read from the results when the charts are drawn, so charts
+    always match the (possibly adjusted) numbers shown next to them.
+    """
+    results_df.attrs['charts'] = {
+        'prediction_month': str(prediction_month),
+        'forecast_start': str(forecast_start),
+        'current_month': str(current_month),
+        'history': {location: [[str(month), int(value)] for month, value in ts.items()]
+                    for location, ts in histories.items()}
+    }
+    return results_df
+
+def chart_specs(results_df):
+    """
+    Build the chart of every location in a results frame as plain data
+
+    Returns:
+    - dict of location -> spec (JSON-serializable); empty if the frame carries
+      no chart data (see attach_chart_data)
+    """
+    chart_data = results_df.attrs.get('charts')
+    if not chart_data:
+        return {}
+
+    prediction_month = pd.Period(chart_data['prediction_month'], freq='M')
+    forecast_start = pd.Period(chart_data['forecast_start'], freq='M')
+    current_month = pd.Period(chart_data['current_month'], freq='M')
+    last_actual_month = forecast_start - 1
+    steps = len(pd.period_range(start=forecast_start, end=prediction_month))
+    is_future_month = prediction_month > current_month
+
+    if steps == 1:
+        forecast_label = f'Forecast ({prediction_month.strftime("%B %Y")})'
+    else:
+        forecast_label = f'Forecast ({forecast_start.strftime("%B %Y")} - {prediction_month.strftime("%B %Y")})'
+
+    specs = {}
+    for location, rows in results_df.groupby('Location', sort=False):
+        history = chart_data['history'].get(location)
+        if not history:
+            continue
+
+        # Add a note if we're using predicted data for forecasting
+        if steps == 1:
+            title_text = f'Monthly Lead Forecast for {location}\nPrediction for {prediction_month.strftime("%B %Y")}'
+            if is_future_month:
+                title_text += f'\n(Using predicted data for months after {current_month.strftime("%B %Y")})'
+        else:
+            title_text = (f'Monthly Lead Forecast for {location}\n'
+                          f'Predictions for {forecast_start.strftime("%B %Y")} - {prediction_month.strftime("%B %Y")}\n'
+                          f'({steps}-month forecast from data through {last_actual_month.strftime("%B %Y")})')
+
+        specs[location] = {
+            'location': location,
+            'prediction_month': str(prediction_month),
+            'history': [point for point in history if pd.Period(point[0], freq='M') <= last_actual_month],
+            'forecast': rows[['Month', 'Predicted_Monthly_Leads', 'Lower_Bound_95', 'Upper_Bound_95',
+                              'Lower_Bound_50', 'Upper_Bound_50']].astype({'Month': str}).values.tolist(),
+            'forecast_label': forecast_label,
+            'title': title_text
+        }
+    return specs
+
+def chart_key(spec):
+    """Hash of everything drawn in a chart (series, forecast, intervals and titles)"""
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, default=int).encode('utf-8')).hexdigest()
+
+def _pyplot():
+    """Import pyplot with the non-interactive backend, on the first chart drawn rather than at startup"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+def render_chart(spec):
+    """Draw a chart spec (see chart_specs) and return it as PNG bytes"""
+    plt = _pyplot()
+    with profiling.span('plot', location=spec['location']), \
+            metrics.timer('terrece_chart_render_seconds', location=spec['location']):
+        history_months = [pd.Period(month, freq='M') for month, _ in spec['history']]
+        history_values = [value for _, value in spec['history']]
+        forecast_months = [pd.Period(row[0], freq='M') for row in spec['forecast']]
+        forecast = [row[1] for row in spec['forecast']]
+
+        # Create visualization
+        plt.figure(figsize=(16, 6))
+
+        # Get the full date range for proper x-axis labeling
+        all_dates = pd.period_range(start=min(history_months), end=pd.Period(spec['prediction_month'], freq='M'))
+
+        # Create a mapping of dates to x-positions
+        date_to_position = {}
+        for i, date in enumerate(all_dates):
+            date_to_position[date] = i
+
+        # Plot historical data with correct x-positions
+        historical_x = [date_to_position[date] for date in history_months]
+        plt.plot(historical_x, history_values, 'b-', label='Historical')
+        plt.plot(historical_x, history_values, 'bo')  # Add blue dots
+
+        # Plot forecast points at the correct x-positions
+        forecast_xs = [date_to_position[month] for month in forecast_months]
+        plt.plot(forecast_xs, forecast, 'ro', label=spec['forecast_label'])
+
+        for step, forecast_x in enumerate(forecast_xs):
+            _, value, lower_95, upper_95, lower_50, upper_50 = spec['forecast'][step]
+
+            # Plot confidence intervals at the correct x-position (legend entry once)
+            plt.fill_between([forecast_x-0.2, forecast_x+0.2],
+                             [lower_95, lower_95],
+                             [upper_95, upper_95],
+                             color='#9932CC',
+                             alpha=0.3,
+                             label='95% Confidence Interval' if step == 0 else None)
+
+            # Add confidence interval values
+            plt.text(forecast_x, upper_95,
+                     f'{int(upper_95)}',
+                     horizontalalignment='center',
+                     verticalalignment='bottom')
+            plt.text(forecast_x, lower_95,
+                     f'{int(lower_95)}',
+                     horizontalalignment='center',
+                     verticalalignment='top')
+
+            plt.fill_between([forecast_x-0.2, forecast_x+0.2],
+                             [lower_50, lower_50],
+                             [upper_50, upper_50],
+                             color='red',
+                             alpha=0.3,
+                             label='50% Confidence Interval' if step == 0 else None)
+
+            # Add forecast value directly above the dot
+            plt.text(forecast_x, value + 0.5,
+                     f'{int(value)}',
+                     horizontalalignment='center',
+                     verticalalignment='bottom')
+
+        # Add values for last 3 months of historical data
+        for i in range(min(3, len(history_months))):
+            idx = len(history_months) - 3 + i
+            if idx >= 0:
+                x_pos = date_to_position[history_months[idx]]
+                value = history_values[idx]
+                plt.text(x_pos, value + 0.5,
+                         f'{int(value)}',
+                         horizontalalignment='center',
+                         verticalalignment='bottom')
+
+        # Set x-axis labels for all months
+        x_ticks = list(range(len(all_dates)))
+        x_labels = [d.strftime('%b %y') for d in all_dates]
+        plt.xticks(x_ticks, x_labels, rotation=45, ha='right')
+
+        # Remove grid
+        plt.grid(False)
+
+        plt.title(spec['title'])
+        plt.xlabel('Month')
+        plt.ylabel('Number of Leads')
+
+        # Adjust layout to prevent label cutoff
+        plt.tight_layout(rect=[0, 0.03, 1, 0.95])
+        plt.legend(loc='upper left')
+        with profiling.span('plot.savefig', location=spec['location']):
+            buffer = io.BytesIO()
+            plt.savefig(buffer, format='png', bbox_inches='tight')
+        plt.close()
+        return buffer.getvalue()
+
+def interactive_chart(spec):
+    """
+    Build a chart spec (see chart_specs) as an Altair chart for st.altair_chart
+
+    The page shows these instead of the PNGs: the browser draws them from the
+    spec's few numbers, so changing the forecast adjustment does no
+    matplotlib work on the server. The PNGs (render_chart) are only drawn for
+    the download.
+    """
+    # Imported on the first chart shown, like pyplot
+    import altair as alt
+
+    history = pd.DataFrame(spec['history'], columns=['Month', 'Leads'])
+    forecast = pd.DataFrame(spec['forecast'], columns=['Month', 'Leads', 'Lower_95', 'Upper_95', 'Lower_50', 'Upper_50'])
+    first_month = min(history['Month'].tolist() + forecast['Month'].tolist())
+    all_dates = pd.period_range(start=pd.Period(first_month, freq='M'), end=pd.Period(spec['prediction_month'], freq='M'))
+    labels = [d.strftime('%b %y') for d in all_dates]
+    for frame in (history, forecast):
+        frame['Label'] = [pd.Period(month, freq='M').strftime('%b %y') for month in frame['Month']]
+
+    x = alt.X('Label:N', sort=labels, scale=alt.Scale(domain=labels), title='Month', axis=alt.Axis(labelAngle=-45))
+    y = alt.Y('Leads:Q', title='Number of Leads')
+    historical = alt.Chart(history).mark_line(point=True, color='blue').encode(x=x, y=y, tooltip=['Month', 'Leads'])
+    band_95 = alt.Chart(forecast).mark_bar(color='#9932CC', opacity=0.3).encode(
+        x=x, y='Lower_95:Q', y2='Upper_95:Q', tooltip=['Month', 'Lower_95', 'Upper_95'])
+    band_50 = alt.Chart(forecast).mark_bar(color='red', opacity=0.3).encode(
+        x=x, y='Lower_50:Q', y2='Upper_50:Q', tooltip=['Month', 'Lower_50', 'Upper_50'])
+    points = alt.Chart(forecast).mark_point(color='red', filled=True, size=60).encode(
+        x=x, y=y, tooltip=['Month', 'Leads', 'Lower_95', 'Upper_95', 'Lower_50', 'Upper_50'])
+    values = alt.Chart(forecast).mark_text(dy=-10).encode(x=x, y=y, text='Leads:Q')
+    title = alt.TitleParams(spec['title'].split('\n'), subtitle=spec['forecast_label'])
+    return alt.layer(band_95, band_50, historical, points, values).properties(title=title, height=400)
+
+def _write_file(path, data):
+    """Write bytes through a temporary path so readers never see a partial file"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def _pooled_render_chart(spec):
+    """Draw a chart in a worker process, returning the metrics recorded there along with it"""
+    return render_chart(spec), metrics.drain()
+
+def chart_images(specs, pool=None, cache_dir=CHART_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Return the charts of a set of specs as PNG bytes, drawing only the missing ones
+
+    Charts are looked up in cache_dir by chart_key; the rest are drawn (in the
+    worker processes of pool, if given) and added to the cache, evicting the
+    least recently used charts beyond max_bytes. With cache_dir None every
+    chart is drawn.
+
+    Parameters:
+    - specs: dict of location -> spec, as returned by chart_specs
+
+    Returns:
+    - dict of location -> PNG bytes (a chart that fails to draw is left out)
+    """
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    images = {}
+    missing = []
+    for location, spec in specs.items():
+        key = chart_key(spec)
+        cached = model_cache.load_file(os.path.join(cache_dir, f"{key}.png")) if cache_dir is not None else None
+        if cache_dir is not None:
+            metrics.inc('terrece_cache_requests_total', cache='chart', location=location,
+                        result='miss' if cached is None else 'hit')
+        if cached is None:
+            missing.append((location, key, spec))
+        else:
+            images[location] = cached
+
+    with profiling.span('render_charts', charts=len(specs), cached=len(images)):
+        if pool is not None and len(missing) > 1:
+            futures = [pool.submit(_pooled_render_chart, spec) for _, _, spec in missing]
+        else:
+            futures = None
+        for position, (location, key, spec) in enumerate(missing):
+            try:
+                if futures:
+                    images[location], child_metrics = futures[position].result()
+                    metrics.merge(child_metrics)
+                else:
+                    images[location] = render_chart(spec)
+            except Exception as e:
+                print(f"Error drawing chart for {location}: {str(e)}")
+                continue
+            if cache_dir is not None:
+                _write_file(os.path.join(cache_dir, f"{key}.png"), images[location])
+        if cache_dir is not None and missing:
+            model_cache.evict(cache_dir, max_bytes, suffix='.png')
+
+    return {location: images[location] for location in specs if location in images}
+
+def render_charts(specs, visuals_dir=None, pool=None, cache_dir=CHART_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Make sure the charts of a set of specs exist (see chart_images)
+
+    Parameters:
+    - specs: dict of location -> spec, as returned by chart_specs
+    - visuals_dir: Directory to write {location}_forecast.png files to (None only fills the cache)
+
+    Returns:
+    - dict of location -> chart file path (in visuals_dir) for the charts written
+    """
+    images = chart_images(specs, pool, cache_dir, max_bytes)
+    paths = {}
+    if visuals_dir is not None:
+        os.makedirs(visuals_dir, exist_ok=True)
+        for location, image in images.items():
+            paths[location] = os.path.join(visuals_dir, f"{location}_forecast.png")
+            _write_file(paths[location], image)
+    return paths
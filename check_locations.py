@@ -1,8 +1,9 @@
-from simple_salesforce import Salesforce
 import pandas as pd
-from query import get_salesforce_auth, get_valid_locations
+from query import get_salesforce_auth
+import argparse
 import configparser
 import os
+import locations
 
 def load_credentials():
     """Load Salesforce credentials from credentials.ini file"""
@@ -24,8 +25,16 @@ def load_credentials():
     
     return creds
 
-def check_locations():
-    """Check locations in Salesforce against valid locations list"""
+def check_locations(refresh=False, full=False, add_new=False):
+    """
+    Check locations in Salesforce against the location registry
+
+    With refresh=True the registry file (locations.REGISTRY_FILE) is updated
+    instead of re-reading every lead: only leads modified since the last
+    refresh are scanned, unless full=True (see locations.refresh_registry).
+    New spellings of known locations become aliases; other new names are
+    listed as unknown, or registered as new locations with add_new=True.
+    """
     # Load credentials
     credentials = load_credentials()
     
@@ -40,12 +49,32 @@ def check_locations():
         print(f"Authentication failed: {error}")
         return
     
-    # Get valid locations
-    valid_locations = get_valid_locations()
-    print("\nValid locations from code:")
+    if refresh:
+        report, error = locations.refresh_registry(sf, full=full, add_new=add_new)
+        if error:
+            print(f"Error refreshing the location registry: {error}")
+            return
+        print(f"\nFound {len(report['seen'])} location names in the leads scanned")
+        for name, canonical in report['aliased'].items():
+            print(f"- {name}: added as an alias of {canonical}")
+        for name in report['added']:
+            print(f"- {name}: added as a new location")
+        if report['aliased'] or report['added']:
+            print("\nThe lead stores will fetch every synced month again on their next sync to count these names")
+        if report['unknown']:
+            print("\nLocations in Salesforce that aren't in the registry (rerun with --add-new to add them):")
+            for loc in report['unknown']:
+                print(f"- {loc}")
+        elif not report['aliased'] and not report['added']:
+            print("\nNo new locations found")
+        return
+
+    # Get valid locations: canonical names and the aliases they are stored under
+    valid_locations = locations.salesforce_names()
+    print("\nValid locations from the registry:")
     for loc in sorted(valid_locations):
         print(f"- {loc}")
-    
+
     # Query all unique locations from Salesforce
     query = """
     SELECT Media_Location_Text__c
@@ -93,4 +122,9 @@ def check_locations():
         print(f"Error querying Salesforce: {str(e)}")
 
 if __name__ == "__main__":
-    check_locations() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Check Salesforce lead locations against the location registry")
+    parser.add_argument("--refresh", action="store_true", help=f"Update {locations.REGISTRY_FILE} from leads changed since the last refresh")
+    parser.add_argument("--full", action="store_true", help="With --refresh, scan every lead rather than recent changes")
+    parser.add_argument("--add-new", action="store_true", help="With --refresh, register unknown names as new locations")
+    args = parser.parse_args()
+    check_locations(refresh=args.refresh, full=args.full, add_new=args.add_new)
@@ -67,6 +67,10 @@ echo "📦 Installing Python dependencies..."
 sudo -u terrece "$APP_DIR/venv/bin/pip" install --upgrade pip
 sudo -u terrece "$APP_DIR/venv/bin/pip" install -r "$APP_DIR/requirements.txt"
 
+# Resolve the version from git once, so the app doesn't run git at startup
+echo "🏷️  Recording application version..."
+(cd "$APP_DIR" && sudo -u terrece "$APP_DIR/venv/bin/python" version.py --write)
+
 # Create systemd service file
 echo "⚙️  Creating systemd service..."
 cat > /etc/systemd/system/terrece.service << EOF
@@ -81,6 +85,8 @@ User=terrece
 Group=terrece
 WorkingDirectory=$APP_DIR
 Environment=PATH=$APP_DIR/venv/bin:/usr/local/bin:/usr/bin:/bin
+# Prometheus metrics on localhost only (not opened in the firewall)
+Environment=TERRECE_METRICS_PORT=9464
 ExecStart=$APP_DIR/venv/bin/python start_app.py --port 8503 --host 0.0.0.0
 Restart=always
 RestartSec=3
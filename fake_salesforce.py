@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Salesforce REST query endpoint
+
+Serves Lead records from a DataFrame over HTTPS (simple_salesforce always
+talks https) with queryMore paging, so the real query code paths can be
+exercised and timed without Salesforce credentials. Only the SOQL used by
+this project is understood: AND-ed WHERE comparisons and IN lists,
+DAY_ONLY/COUNT aggregates with GROUP BY, ORDER BY and LIMIT.
+
+Run directly to check that the concurrent month fetch returns exactly what
+the sequential fetch does:
+
+    python fake_salesforce.py --months 30 --latency 0.05
+"""
+
+import argparse
+import datetime
+import ipaddress
+import json
+import os
+import re
+import ssl
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+
+API_VERSION = "59.0"
+SESSION_ID = "fake-session-id"
+
+# Salesforce returns at most 2,000 records per query page
+DEFAULT_PAGE_SIZE = 2000
+
+DATETIME_FIELDS = {'CreatedDate', 'SystemModstamp', 'LastModifiedDate', 'ConvertedDate'}
+
+def _split_top_level(text, separator=','):
+    """Split on a separator that is not inside parentheses or quotes"""
+    parts, depth, quoted, current = [], 0, False, ''
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == '\\' and quoted:
+            current += text[i:i + 2]
+            i += 2
+            continue
+        if char == "'":
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        if not quoted and depth == 0 and text.startswith(separator, i):
+            parts.append(current.strip())
+            current = ''
+            i += len(separator)
+            continue
+        current += char
+        i += 1
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+def _parse_literal(text):
+    """Convert a SOQL literal to a Python value"""
+    text = text.strip()
+    if text.lower() == 'null':
+        return None
+    if text.lower() in ('true', 'false'):
+        return text.lower() == 'true'
+    if text.startswith("'"):
+        return text[1:-1].replace("\\'", "'")
+    if re.match(r'^\d{4}-\d{2}-\d{2}T', text):
+        return pd.Timestamp(text)
+    return float(text)
+
+def _condition_mask(df, condition):
+    """Evaluate one WHERE condition against the lead frame"""
+    match = re.match(r'^(\w+)\s+(NOT\s+)?IN\s*\((.*)\)$', condition, re.IGNORECASE | re.DOTALL)
+    if match:
+        field, negate, values = match.groups()
+        values = [_parse_literal(v) for v in _split_top_level(values)]
+        mask = df[field].isin(values)
+        return ~mask if negate else mask
+
+    match = re.match(r'^(\w+)\s*(>=|<=|!=|=|<|>)\s*(.+)$', condition, re.DOTALL)
+    if not match:
+        raise ValueError(f"unsupported condition: {condition}")
+    field, operator, literal = match.groups()
+    value = _parse_literal(literal)
+    column = df[field]
+    if value is None:
+        return column.notna() if operator == '!=' else column.isna()
+    if field in DATETIME_FIELDS:
+        parsed = f"_parsed_{field}"
+        column = df[parsed] if parsed in df.columns else pd.to_datetime(column, utc=True)
+    return {
+        '>=': column >= value, '<=': column <= value, '>': column > value,
+        '<': column < value, '=': column == value, '!=': column != value
+    }[operator]
+
+def run_soql(leads, query, include_deleted=False):
+    """
+    Evaluate a SOQL query against a DataFrame of Lead records
+
+    Parameters:
+    - leads: DataFrame with one row per Lead (datetime fields as Salesforce strings)
+    - query: SOQL query text
+    - include_deleted: Whether rows with IsDeleted set are visible (queryAll)
+
+    Returns:
+    - tuple: (list of record dicts, whether the query was an aggregate query)
+    """
+    soql = ' '.join(query.split())
+    match = re.match(
+        r'^SELECT (?P<select>.+?) FROM (?P<object>\w+)'
+        r'(?: WHERE (?P<where>.+?))?'
+        r'(?: GROUP BY (?P<group>.+?))?'
+        r'(?: ORDER BY (?P<order>.+?))?'
+        r'(?: LIMIT (?P<limit>\d+))?$',
+        soql, re.IGNORECASE
+    )
+    if not match:
+        raise ValueError("MALFORMED_QUERY")
+
+    df = leads
+    if not include_deleted and 'IsDeleted' in df.columns:
+        df = df[~df['IsDeleted'].astype(bool)]
+    if match['where']:
+        for condition in _split_top_level(match['where'], ' AND '):
+            df = df[_condition_mask(df, condition)]
+
+    # Parse the select list into (expression, output name) pairs
+    selected = []
+    for index, item in enumerate(_split_top_level(match['select'])):
+        parts = item.rsplit(' ', 1)
+        expression, alias = (parts[0], parts[1]) if len(parts) == 2 else (item, None)
+        function = re.match(r'^(\w+)\((\w+)\)$', expression)
+        if function and not alias:
+            alias = f"expr{index}"
+        selected.append((expression, alias or expression, function))
+
+    aggregate = match['group'] is not None or any(
+        f and f.group(1).upper() == 'COUNT' for _, _, f in selected)
+
+    if aggregate:
+        df = df.copy()
+        group_columns = []
+        for expression in _split_top_level(match['group'] or ''):
+            function = re.match(r'^DAY_ONLY\((\w+)\)$', expression, re.IGNORECASE)
+            if function:
+                df[expression] = pd.to_datetime(df[function.group(1)], utc=True).dt.strftime('%Y-%m-%d')
+            group_columns.append(expression)
+        grouped = df.groupby(group_columns, sort=True) if group_columns else None
+        out = grouped.size().reset_index(name='__count') if grouped is not None else \
+            pd.DataFrame({'__count': [len(df)]})
+        records = []
+        for _, row in out.iterrows():
+            record = {'attributes': {'type': 'AggregateResult'}}
+            for expression, name, function in selected:
+                if function and function.group(1).upper() == 'COUNT':
+                    record[name] = int(row['__count'])
+                else:
+                    record[name] = row[expression]
+            records.append(record)
+    else:
+        names = [name for _, name, _ in selected]
+        if match['order']:
+            field, *direction = match['order'].split()
+            df = df.sort_values([field, 'Id'] if field != 'Id' else ['Id'],
+                                ascending=not (direction and direction[0].upper() == 'DESC'), kind='stable')
+        records = [
+            dict({'attributes': {'type': match['object'],
+                                 'url': f"/services/data/v{API_VERSION}/sobjects/{match['object']}/{row['Id']}"}},
+                 **{name: row[name] for name in names})
+            for row in df.to_dict('records')
+        ]
+
+    if match['limit']:
+        records = records[:int(match['limit'])]
+    return records, aggregate
+
+def _create_certificate(directory):
+    """Create a self-signed certificate for 127.0.0.1 and return (cert_file, key_file)"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([
+            x509.DNSName("localhost"),
+            x509.IPAddress(ipaddress.ip_address("127.0.0.1"))
+        ]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+
+    cert_file = os.path.join(directory, "cert.pem")
+    key_file = os.path.join(directory, "key.pem")
+    with open(cert_file, 'wb') as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_file, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM,
+                                  serialization.PrivateFormat.TraditionalOpenSSL,
+                                  serialization.NoEncryption()))
+    return cert_file, key_file
+
+class _QueryHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        fake = self.server.fake
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        if self.headers.get("Authorization") != f"Bearer {SESSION_ID}":
+            self._send_json(401, [{"message": "Session expired or invalid", "errorCode": "INVALID_SESSION_ID"}])
+            return
+
+        url = urlparse(self.path)
+        match = re.match(r'^/services/data/v[\d.]+/(query|queryAll)/?(?P<cursor>[^/]*)$', url.path)
+        if not match:
+            self._send_json(404, [{"message": "The requested resource does not exist", "errorCode": "NOT_FOUND"}])
+            return
+
+        if match['cursor']:
+            page = fake.next_page(match['cursor'])
+            if page is None:
+                self._send_json(400, [{"message": "invalid query locator", "errorCode": "INVALID_QUERY_LOCATOR"}])
+            else:
+                self._send_json(200, page)
+            return
+
+        query = parse_qs(url.query).get('q', [''])[0]
+        try:
+            records, aggregate = run_soql(fake.leads, query, include_deleted=match.group(1) == 'queryAll')
+        except (ValueError, KeyError) as e:
+            self._send_json(400, [{"message": str(e), "errorCode": "MALFORMED_QUERY"}])
+            return
+        self._send_json(200, fake.first_page(records, paged=not aggregate))
+
+class FakeSalesforce:
+    """
+    HTTPS server answering Salesforce REST query calls from a Lead DataFrame
+
+    Parameters:
+    - leads: DataFrame with one row per Lead and Salesforce field names as columns
+    - page_size: Records per query page before queryMore paging kicks in
+    - latency: Seconds of simulated round-trip time added to every request
+
+    Use as a context manager; connect() returns a simple_salesforce client.
+    """
+
+    def __init__(self, leads, page_size=DEFAULT_PAGE_SIZE, latency=0.0):
+        # Parse datetime fields once instead of on every query
+        self.leads = leads.copy()
+        for field in DATETIME_FIELDS.intersection(leads.columns):
+            self.leads[f"_parsed_{field}"] = pd.to_datetime(leads[field], utc=True)
+        self.page_size = page_size
+        self.latency = latency
+        self.requests = 0
+        self._cursors = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self._cert_dir = None
+
+    def first_page(self, records, paged=True):
+        with self._lock:
+            self.requests += 1
+            if not paged or len(records) <= self.page_size:
+                return {"totalSize": len(records), "done": True, "records": records}
+            cursor = uuid.uuid4().hex[:15]
+            self._cursors[cursor] = records
+        return self._page(cursor, records, 0)
+
+    def next_page(self, locator):
+        cursor, _, offset = locator.partition('-')
+        with self._lock:
+            self.requests += 1
+            records = self._cursors.get(cursor)
+        if records is None or not offset.isdigit():
+            return None
+        return self._page(cursor, records, int(offset))
+
+    def _page(self, cursor, records, offset):
+        end = offset + self.page_size
+        page = {"totalSize": len(records), "done": end >= len(records), "records": records[offset:end]}
+        if end < len(records):
+            page["nextRecordsUrl"] = f"/services/data/v{API_VERSION}/query/{cursor}-{end}"
+        else:
+            with self._lock:
+                self._cursors.pop(cursor, None)
+        return page
+
+    @property
+    def instance_url(self):
+        return f"https://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def cert_file(self):
+        return os.path.join(self._cert_dir.name, "cert.pem")
+
+    def start(self):
+        self._cert_dir = tempfile.TemporaryDirectory(prefix="fake_salesforce_")
+        cert_file, key_file = _create_certificate(self._cert_dir.name)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_file, key_file)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _QueryHandler)
+        self._server.daemon_threads = True
+        self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._cert_dir is not None:
+            self._cert_dir.cleanup()
+            self._cert_dir = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def connect(self, session=None):
+        """Return a simple_salesforce client pointed at this server"""
+        from simple_salesforce import Salesforce
+        import query
+
+        session = session or query.create_pooled_session()
+        # REQUESTS_CA_BUNDLE and proxy variables would override the local cert
+        session.trust_env = False
+        session.verify = self.cert_file
+        return Salesforce(session_id=SESSION_ID, instance_url=self.instance_url,
+                          version=API_VERSION, session=session)
+
+def sample_leads(locations, months, leads_per_day, seed=0):
+    """Build a simple Lead frame covering the last `months` months for a quick check"""
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp.now(tz='UTC').floor('D')
+    days = pd.date_range(end - pd.DateOffset(months=months), end, freq='D')
+    counts = rng.poisson(leads_per_day, size=(len(locations), len(days)))
+    location_index, day_index = np.nonzero(counts)
+    repeats = counts[location_index, day_index]
+    created = days[np.repeat(day_index, repeats)] + pd.to_timedelta(rng.integers(0, 86400, repeats.sum()), unit='s')
+    created_text = created.strftime('%Y-%m-%dT%H:%M:%S.000+0000')
+    statuses = ['Future Prospect', 'Converted', 'Client Registration', 'TOF Waitlist', 'Unqualified Lead']
+    return pd.DataFrame({
+        'Id': [f"00Q{i:015d}" for i in range(repeats.sum())],
+        'CreatedDate': created_text,
+        'SystemModstamp': created_text,
+        'IsDeleted': False,
+        'Media_Location_Text__c': np.asarray(locations, dtype=object)[np.repeat(location_index, repeats)],
+        'Status': rng.choice(statuses, size=repeats.sum())
+    })
+
+def main():
+    import locations
+    import query
+
+    parser = argparse.ArgumentParser(description="Check concurrent vs sequential Salesforce fetching against a local fake server")
+    parser.add_argument("--months", type=int, default=30, help="Months of history to serve (default: 30)")
+    parser.add_argument("--leads-per-day", type=float, default=5.0, help="Average leads per location per day (default: 5)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated round-trip seconds per request (default: 0.05)")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE, help="Records per query page (default: 2000)")
+    parser.add_argument("--workers", type=int, default=query.DEFAULT_FETCH_WORKERS, help="Concurrent fetch workers")
+    args = parser.parse_args()
+
+    leads = sample_leads(locations.salesforce_names(), args.months, args.leads_per_day)
+    with FakeSalesforce(leads, page_size=args.page_size, latency=args.latency) as fake:
+        sf = fake.connect(query.create_pooled_session(args.workers))
+        ranges = query.get_date_ranges()
+
+        timings = {}
+        results = {}
+        for label, workers in (("sequential", 1), ("concurrent", args.workers)):
+            start = time.perf_counter()
+            frames = query.fetch_ranges(lambda s, e: query.get_leads_for_month(sf, s, e), ranges, workers)
+            timings[label] = time.perf_counter() - start
+            results[label] = pd.concat(frames, ignore_index=True)
+
+        pd.testing.assert_frame_equal(results["sequential"], results["concurrent"])
+        print(f"Served {len(leads)} leads over {len(ranges)} months, {fake.requests} requests")
+        print(f"Sequential: {timings['sequential']:.2f}s")
+        print(f"Concurrent ({args.workers} workers): {timings['concurrent']:.2f}s")
+        print("Results identical")
+
+if __name__ == "__main__":
+    main()
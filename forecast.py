@@ -1,49 +1,555 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from statsmodels.tsa.arima.model import ARIMA
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import multiprocessing
 import os
+import threading
+import time
 from datetime import datetime
+import lead_store
+import model_cache
+import batch_arima
+import charts
+import metrics
+import profiling
+
+logger = logging.getLogger(__name__)
+
+# ARIMA order used for every location
+MODEL_ORDER = (1, 1, 1)
+
+# Model fitting engines: statsmodels per location, or batch_arima for all locations at once
+ENGINES = ['statsmodels', 'batch']
+
+# Budget of one location's ARIMA fit; beyond it the location falls back to FALLBACK_ENGINE.
+# statsmodels stops at 50 iterations on its own; on 36 months of benchmark leads (26 locations,
+# cut at 12, 24 and 35 months) 99% of the fits that converge need 41 or fewer, so 40 only
+# gives up earlier on series that were not going to converge
+FIT_MAXITER = int(os.getenv('TERRECE_FIT_MAXITER', '40'))
+# Checked between optimizer iterations only (see _fit_deadline), so a fit can overrun it by one iteration
+FIT_TIME_BUDGET_SECONDS = float(os.getenv('TERRECE_FIT_SECONDS', '5'))
+
+# Engine column value of forecasts made by fallback_forecast
+FALLBACK_ENGINE = 'exponential smoothing'
+
+# Smoothing weights fallback_forecast chooses from (1.0 is the naive last-value forecast)
+FALLBACK_ALPHAS = np.linspace(0.05, 1.0, 20)
+
+# Result columns scaled by the forecast adjustment factor
+ADJUSTED_COLUMNS = ['Predicted_Monthly_Leads', 'Lower_Bound_95', 'Upper_Bound_95', 'Lower_Bound_50', 'Upper_Bound_50']
+
+# Process pool shared by forecast_leads calls (created on first parallel run)
+_process_pool = None
+_process_pool_workers = None
+_process_pool_lock = threading.Lock()
+
+def apply_adjustment(results_df, adjustment_factor):
+    """
+    Scale unadjusted forecast results by an adjustment factor
+
+    Floors the prediction and bounds the same way forecast_location does, so
+    results computed with a factor of 1.0 can be adjusted afterwards.
+    Original_Predicted_Monthly_Leads is left as is.
+    """
+    if adjustment_factor == 1.0:
+        return results_df
+    adjusted = results_df.copy()
+    adjusted[ADJUSTED_COLUMNS] = _adjust(adjusted[ADJUSTED_COLUMNS].to_numpy(dtype='float64'), adjustment_factor)
+    return adjusted
+
+def adjustment_sweep(results_df, factors, column='Predicted_Monthly_Leads'):
+    """
+    Compare one column of unadjusted forecast results under several adjustment factors
+
+    Every factor is applied in a single broadcast, the same way as apply_adjustment.
+
+    Returns:
+    - DataFrame with Location, Month and one column per factor, named as a percentage
+    """
+    adjusted = _adjust(results_df[column].to_numpy(dtype='float64')[:, None], np.asarray(factors, dtype='float64'))
+    sweep = results_df[['Location', 'Month']].reset_index(drop=True)
+    for position, factor in enumerate(factors):
+        sweep[f"{factor:.0%}"] = adjusted[:, position]
+    return sweep
+
+def _adjust(values, factor):
+    """Scale values by factor (arrays broadcast), flooring and clipping at zero like forecast_location"""
+    return np.maximum(np.floor(values * factor), 0).astype(int)
 
 def prepare_data(df):
     """Prepare the data for forecasting"""
-    # Convert day_created to datetime and extract month
-    df['day_created'] = pd.to_datetime(df['day_created'])
-    df['month'] = df['day_created'].dt.to_period('ME')
+    with profiling.span('prepare_data', rows=len(df)):
+        # Convert day_created to datetime and extract month
+        df['day_created'] = pd.to_datetime(df['day_created'])
+        df['month'] = df['day_created'].dt.to_period('M')
+        
+        # Group by location and month and ensure integer counts
+        monthly_data = df.groupby(['Media_Location_Text__c', 'month'], observed=True)['Leads'].sum().round().astype(int).reset_index()
+        
+        # Ensure all values are positive integers
+        monthly_data['Leads'] = monthly_data['Leads'].clip(lower=0)
+        
+        # Sort by month
+        monthly_data.sort_values(['Media_Location_Text__c', 'month'], inplace=True)
     
-    # Group by location and month and ensure integer counts
-    monthly_data = df.groupby(['Media_Location_Text__c', 'month'])['Leads'].sum().round().astype(int).reset_index()
+    return monthly_data
+
+def load_lead_data(input_file=lead_store.STORE_DIR):
+    """Load daily lead rows from the lead store directory or a CSV file"""
+    if os.path.isdir(input_file):
+        return lead_store.read_leads(input_file)
+    return pd.read_csv(input_file)
+
+def load_monthly_data(input_file=lead_store.STORE_DIR):
+    """
+    Load monthly lead counts per location (the output of prepare_data)
+
+    For a lead store the totals are cached as Parquet alongside the
+    partitions, so only the first load after a sync reads and groups the
+    daily rows.
+    """
+    if not os.path.isdir(input_file):
+        with profiling.span('load_data'):
+            df = load_lead_data(input_file)
+        return prepare_data(df)
+
+    with profiling.span('load_data') as span:
+        df_monthly = lead_store.read_monthly(input_file)
+        span['cached'] = df_monthly is not None
+        if df_monthly is None:
+            df = lead_store.read_leads(input_file)
+    if df_monthly is None:
+        df_monthly = prepare_data(df)
+        lead_store.write_monthly(input_file, df_monthly)
+    return df_monthly
+
+def fallback_forecast(ts_log, steps):
+    """
+    Forecast a log-transformed monthly series with simple exponential smoothing
+
+    The cheap fallback for series ARIMA can't fit in its budget: the smoothing
+    weight is picked from FALLBACK_ALPHAS by one-step-ahead squared error (all
+    weights filtered at once) and the intervals use the closed-form variance
+    of the equivalent ARIMA(0,1,1) model, sigma2 * (1 + (h - 1) * alpha ** 2)
+    at horizon h. Nothing is iterated, so it can't fail to converge.
+
+    Returns:
+    - tuple: (forecast Series, 95% interval DataFrame, 50% interval DataFrame), log scale
+    """
+    from scipy.stats import norm
+
+    values = ts_log.to_numpy(dtype='float64')
+    levels = np.full(len(FALLBACK_ALPHAS), values[0])
+    sum_sq = np.zeros(len(FALLBACK_ALPHAS))
+    for value in values[1:]:
+        errors = value - levels
+        sum_sq += errors ** 2
+        levels = levels + FALLBACK_ALPHAS * errors
+    best = int(np.argmin(sum_sq))
+    alpha = FALLBACK_ALPHAS[best]
+    sigma2 = sum_sq[best] / max(len(values) - 1, 1)
+
+    forecast_index = pd.period_range(start=ts_log.index[-1] + 1, periods=steps, freq='M')
+    interval_columns = [f'lower {ts_log.name}', f'upper {ts_log.name}']
+    mean = np.full(steps, levels[best])
+    std = np.sqrt(sigma2 * (1 + np.arange(steps) * alpha ** 2))
+    intervals = []
+    for interval_alpha in (0.05, 0.50):
+        q = norm.ppf(1 - interval_alpha / 2)
+        intervals.append(pd.DataFrame(np.column_stack([mean - q * std, mean + q * std]),
+                                      index=forecast_index, columns=interval_columns))
+    return (pd.Series(mean, index=forecast_index, name='predicted_mean'), *intervals)
+
+def _fit_deadline(seconds):
+    """
+    Optimizer callback that stops a fit once it has run for seconds
+
+    The optimizer only calls it after each iteration, so the time is checked
+    between iterations: an iteration in progress always finishes, and a fit
+    can run past the deadline by up to one iteration's likelihood
+    evaluations (about a millisecond on a few years of months).
+    """
+    deadline = time.perf_counter() + seconds
+    def check(params):
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"fit took longer than {seconds:g}s")
+    return check
+
+def fit_within_budget(model, start_params=None):
+    """
+    Fit a statsmodels ARIMA model within FIT_MAXITER iterations and FIT_TIME_BUDGET_SECONDS
+
+    Raises TimeoutError once the time budget runs out. A fit that used up
+    its iterations is returned with mle_retvals['converged'] False.
+    """
+    return model.fit(start_params=start_params,
+                     method_kwargs={'maxiter': FIT_MAXITER, 'callback': _fit_deadline(FIT_TIME_BUDGET_SECONDS)})
+
+def fit_and_forecast(ts_log, steps, location=None, cache_dir=model_cache.CACHE_DIR):
+    """
+    Fit ARIMA to a log-transformed monthly series and forecast steps months ahead
+
+    A fit is limited to FIT_MAXITER optimizer iterations and
+    FIT_TIME_BUDGET_SECONDS (checked between iterations). When it runs out of budget, doesn't converge or
+    fails, the location is forecast with fallback_forecast instead, so one
+    badly conditioned series can't stall a run.
+
+    Fitted parameters and forecasts are kept in the model cache, keyed by
+    location, model order, last training month and a hash of the series. An
+    identical series is never refitted: cached forecasts are returned as is,
+    and a new horizon is computed from the cached parameters without fitting.
+    Fallbacks are cached too, except after a time-out (which depends on how
+    busy the machine was). Pass cache_dir=None to always fit.
+
+    Returns:
+    - tuple: (forecast Series, 95% interval DataFrame, 50% interval DataFrame, engine),
+      log scale; engine is 'statsmodels' or FALLBACK_ENGINE
+    """
+    cutoff_month = ts_log.index[-1]
+    forecast_index = pd.period_range(start=cutoff_month + 1, periods=steps, freq='M')
+    interval_columns = [f'lower {ts_log.name}', f'upper {ts_log.name}']
+
+    key = entry = None
+    if cache_dir:
+        key = model_cache.cache_key(location, MODEL_ORDER, cutoff_month, ts_log)
+        with profiling.span('model_cache.load', location=location):
+            entry = model_cache.load(key, cache_dir)
+        cached = entry['forecasts'].get(str(steps)) if entry else None
+        # A hit returns the cached forecast; with only the parameters cached the model is still smoothed
+        metrics.inc('terrece_cache_requests_total', cache='model', location=location,
+                    result='hit' if cached else 'params' if entry else 'miss')
+        if cached:
+            return (pd.Series(cached['mean'], index=forecast_index, name='predicted_mean'),
+                    pd.DataFrame(cached['conf_int_95'], index=forecast_index, columns=interval_columns),
+                    pd.DataFrame(cached['conf_int_50'], index=forecast_index, columns=interval_columns),
+                    entry.get('engine', 'statsmodels'))
+
+    engine = entry.get('engine', 'statsmodels') if entry else 'statsmodels'
+    params = entry['params'] if entry else None
+    remember = bool(cache_dir)
+    if engine == 'statsmodels':
+        # Imported on the first fit: statsmodels is the slowest import of the app
+        from statsmodels.tsa.arima.model import ARIMA
+        failure = 'error'
+        try:
+            with profiling.span('arima.fit', location=location, cached_params=bool(entry)), \
+                    metrics.timer('terrece_arima_fit_seconds', location=location, engine=engine,
+                                  kind='smooth' if entry else 'fit'):
+                model = ARIMA(ts_log, order=MODEL_ORDER, freq='M')
+                if entry:
+                    # Parameters are known, so only the Kalman filter/smoother runs
+                    model_fit = model.smooth(entry['params'])
+                else:
+                    model_fit = fit_within_budget(model)
+                    if not model_fit.mle_retvals.get('converged', True):
+                        failure = 'not_converged'
+                        raise ValueError(f"did not converge in {FIT_MAXITER} iterations")
+                params = [float(value) for value in model_fit.params]
+
+            with profiling.span('arima.forecast', location=location, steps=steps):
+                forecast_result = model_fit.get_forecast(steps=steps)
+                forecast_log = forecast_result.predicted_mean
+                conf_int_log_95 = forecast_result.conf_int(alpha=0.05)
+                conf_int_log_50 = forecast_result.conf_int(alpha=0.50)
+            if not (np.isfinite(forecast_log).all() and np.isfinite(conf_int_log_95.values).all()):
+                failure = 'not_finite'
+                raise ValueError("forecast is not finite")
+        except Exception as e:
+            print(f"ARIMA failed for {location} ({str(e)}), using {FALLBACK_ENGINE} instead")
+            metrics.inc('terrece_arima_fit_failures_total', location=location, engine=engine,
+                        reason='timeout' if isinstance(e, TimeoutError) else failure)
+            engine, params, entry = FALLBACK_ENGINE, None, None
+            remember = remember and not isinstance(e, TimeoutError)
+
+    if engine == FALLBACK_ENGINE:
+        with profiling.span('fallback.forecast', location=location, steps=steps):
+            forecast_log, conf_int_log_95, conf_int_log_50 = fallback_forecast(ts_log, steps)
+
+    if remember:
+        if entry is None:
+            entry = {
+                'location': location,
+                'order': list(MODEL_ORDER),
+                'cutoff_month': str(cutoff_month),
+                'engine': engine,
+                'params': params,
+                'forecasts': {}
+            }
+        entry['forecasts'][str(steps)] = {
+            'mean': forecast_log.tolist(),
+            'conf_int_95': conf_int_log_95.values.tolist(),
+            'conf_int_50': conf_int_log_50.values.tolist()
+        }
+        model_cache.store(key, entry, cache_dir)
+
+    return forecast_log, conf_int_log_95, conf_int_log_50, engine
+
+def forecast_location(location, ts, prediction_month, current_month, running_total=None,
+                      adjustment_factor: float = 1.0, forecast_start=None,
+                      cache_dir=model_cache.CACHE_DIR, fitted=None):
+    """
+    Fit and forecast a single location
+
+    Runs as an independent task so locations can be processed in worker
+    processes. Errors are caught here so one location can't fail the others.
+
+    The model is fitted once on the months before forecast_start and every
+    month from forecast_start through prediction_month is forecast from that
+    fit with a single get_forecast call, so intervals widen with the horizon.
+
+    Parameters:
+    - location: Location name
+    - ts: Monthly lead counts for the location (PeriodIndex), before prediction_month
+    - prediction_month: Last month to forecast (Period)
+    - current_month: Current calendar month (Period)
+    - running_total: Leads so far in the current month, if it is being forecast
+    - adjustment_factor: Multiplier applied to the forecast and intervals
+    - forecast_start: First month to forecast (Period), defaults to prediction_month
+    - cache_dir: Fitted model cache directory (None disables the cache)
+    - fitted: Forecasts already computed for the location, in the form fit_and_forecast returns
+
+    The Engine column of the results names the model that produced them.
+
+    Returns:
+    - List of result dicts (one per forecast month), empty if forecasting failed
+    """
+    if forecast_start is None:
+        forecast_start = prediction_month
+    is_future_month = prediction_month > current_month
+    forecast_months = list(pd.period_range(start=forecast_start, end=prediction_month))
+    steps = len(forecast_months)
+    results = []
     
-    # Ensure all values are positive integers
-    monthly_data['Leads'] = monthly_data['Leads'].clip(lower=0)
+    # Get last actual data point and determine forecast needs
+    last_actual_month = forecast_start - 1
     
-    # Sort by month
-    monthly_data.sort_values(['Media_Location_Text__c', 'month'], inplace=True)
+    # Get training data (all data up to but not including the first forecast month)
+    training_data = ts[ts.index <= last_actual_month]
     
-    return monthly_data
+    try:
+        # Log transform the data (adding 1 to handle zeros)
+        ts_log = np.log1p(training_data)
+    
+        # Fit ARIMA model on log-transformed data (or reuse a cached fit) and
+        # generate forecasts for every month in the horizon from the one fit
+        if fitted is None:
+            fitted = fit_and_forecast(ts_log, steps, location, cache_dir)
+        forecast_log, conf_int_log_95, conf_int_log_50, engine = fitted
+    
+        # Transform predictions back to original scale as integers
+        forecast = np.round(np.expm1(forecast_log)).astype(int)
+        conf_int_95 = np.round(np.expm1(conf_int_log_95)).astype(int)
+        conf_int_50 = np.round(np.expm1(conf_int_log_50)).astype(int)
+    
+        # Preserve original forecast before any adjustment
+        original_forecast_values = [int(value) for value in forecast]
+    
+        # Apply adjustment factor (floor to int)
+        if adjustment_factor != 1.0:
+            forecast = np.floor(forecast * adjustment_factor).astype(int)
+            conf_int_95 = np.floor(conf_int_95 * adjustment_factor).astype(int)
+            conf_int_50 = np.floor(conf_int_50 * adjustment_factor).astype(int)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s: forecast %s, adjusted by %s to %s", location, original_forecast_values,
+                         adjustment_factor, forecast.tolist())
+    
+        # Ensure predictions are non-negative integers
+        forecast = np.maximum(forecast, 0)
+        conf_int_95 = np.maximum(conf_int_95, 0)
+        conf_int_50 = np.maximum(conf_int_50, 0)
+    
+        for step, month in enumerate(forecast_months):
+            # Get previous month (only months in the training data have actual values)
+            previous_month = month - 1
+            previous_month_data = training_data[training_data.index == previous_month]
+    
+            # Only consider it actual data if it's in or before the current month
+            is_actual = previous_month <= current_month
+            previous_month_label = "Actual" if is_actual else "Predicted"
+    
+            # Only use previous month data if it's actual, otherwise use None
+            if is_actual and not previous_month_data.empty:
+                previous_month_value = int(previous_month_data.iloc[0])
+            else:
+                previous_month_value = None
+    
+            # Store results
+            result_dict = {
+                'Location': location,
+                'Month': month.strftime('%Y-%m'),
+                'Original_Predicted_Monthly_Leads': original_forecast_values[step],
+                'Predicted_Monthly_Leads': int(forecast.iloc[step]),
+                'Lower_Bound_95': int(conf_int_95.iloc[step, 0]),
+                'Upper_Bound_95': int(conf_int_95.iloc[step, 1]),
+                'Lower_Bound_50': int(conf_int_50.iloc[step, 0]),
+                'Upper_Bound_50': int(conf_int_50.iloc[step, 1]),
+                'Engine': engine
+            }
+    
+            # Only add previous month data if we have an actual value
+            if previous_month_value is not None:
+                result_dict[f'{previous_month.strftime("%B %Y")}_{previous_month_label}'] = previous_month_value
+    
+            # Only add running total if we're forecasting the current month
+            if running_total is not None and month == current_month:
+                result_dict[f'{month.strftime("%B %Y")}_Running_Total'] = running_total
+    
+            results.append(result_dict)
+    
+        return results
+    
+    except Exception as e:
+        print(f"Error forecasting for {location}: {str(e)}")
+        return results
+    
+
+def get_process_pool(workers):
+    """Return a process pool with the given number of workers, reused across calls"""
+    global _process_pool, _process_pool_workers
+    # Forecasts may run on several background job threads at once
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool_workers != workers:
+            if _process_pool is not None:
+                # Tasks already submitted to the old pool still complete
+                _process_pool.shutdown(wait=False)
+            # Fresh worker processes rather than forks of a multi-threaded server
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+            _process_pool_workers = workers
+        return _process_pool
+
+def _pooled_forecast_location(trace_memory, *task):
+    """
+    Run forecast_location in a worker process
+
+    Returns the results along with the metrics recorded while computing them
+    and, when trace_memory is not None (the parent is tracing), the spans.
+    """
+    if trace_memory is not None:
+        profiling.start_trace(memory=trace_memory)
+    try:
+        with metrics.timer('terrece_location_forecast_seconds', location=task[0]):
+            results = forecast_location(*task)
+    finally:
+        trace = profiling.stop_trace() if trace_memory is not None else None
+    return results, trace, metrics.drain()
+
+def run_forecast_tasks(tasks, workers=1, progress=None):
+    """
+    Run forecast_location over a list of argument tuples
+
+    Returns the result lists in task order. With workers > 1 the tasks run on
+    a process pool; a task whose worker fails is reported and yields an empty
+    list, the same as a location that fails to fit. The workers' metrics are
+    merged into this process's, and while a profiling trace is running their
+    spans are merged into it.
+
+    progress, if given, is called as each task finishes with its result list,
+    the number of tasks finished so far and the number of tasks (with a pool,
+    in the order the tasks finish).
+    """
+    if workers is None or workers <= 1 or len(tasks) <= 1:
+        results = []
+        for task in tasks:
+            with metrics.timer('terrece_location_forecast_seconds', location=task[0]):
+                results.append(forecast_location(*task))
+            if progress is not None:
+                progress(results[-1], len(results), len(tasks))
+        return results
+
+    global _process_pool
+    pool = get_process_pool(workers)
+    results = [[] for _ in tasks]
+    trace = profiling.current_trace()
+    try:
+        trace_memory = None if trace is None else trace['memory']
+        futures = [pool.submit(_pooled_forecast_location, trace_memory, *task) for task in tasks]
+    except BrokenProcessPool:
+        futures = []
+    positions = {future: position for position, future in enumerate(futures)}
+    for finished, future in enumerate(as_completed(futures), 1):
+        position = positions[future]
+        try:
+            result, child_trace, child_metrics = future.result()
+            profiling.add_spans(child_trace)
+            metrics.merge(child_metrics)
+            results[position] = result
+        except Exception as e:
+            print(f"Error forecasting for {tasks[position][0]}: {str(e)}")
+        if progress is not None:
+            progress(results[position], finished, len(tasks))
+
+    # A worker that died takes the pool with it; start a fresh one next time
+    if futures == [] or any(isinstance(future.exception(), BrokenProcessPool) for future in futures):
+        with _process_pool_lock:
+            if _process_pool is pool:
+                _process_pool = None
+        pool.shutdown(wait=False)
+    return results
+
+def forecast_leads(input_file=lead_store.STORE_DIR, prediction_month=None, selected_location=None, adjustment_factor: float = 1.0,
+                   workers=1, forecast_start=None, cache_dir=model_cache.CACHE_DIR, monthly_data=None, engine='statsmodels',
+                   output_dir="forecast_results", visuals_dir=None, progress=None):
+    """
+    Main forecasting function
+
+    Each location is fitted and forecast by forecast_location. With
+    workers > 1 the locations run as separate tasks on a process pool; results
+    are identical and in the same order as a serial run.
 
-def forecast_leads(input_file="leads_by_location_date.csv", prediction_month=None, selected_location=None, adjustment_factor: float = 1.0):
-    """Main forecasting function"""
-    output_dir = "forecast_results"
-    visuals_dir = "forecast_visuals"
-    os.makedirs(output_dir, exist_ok=True)
-    os.makedirs(visuals_dir, exist_ok=True)
+    With forecast_start set, every month from forecast_start through
+    prediction_month is forecast directly from one fit per location, trained
+    on the months before forecast_start. The results then have one row per
+    location and month.
+
+    Fits are cached in cache_dir (see fit_and_forecast); None disables it.
+
+    monthly_data takes an already prepared monthly frame (see
+    load_monthly_data), in which case input_file is not read.
+
+    engine='batch' fits every location at once with batch_arima instead of
+    statsmodels; the model cache is not used then.
+
+    The results file is written to output_dir. The results carry what their
+    charts need (see charts.chart_specs), so charts are only drawn when asked
+    for: with visuals_dir set they are drawn into it once forecasting is done.
+    progress is called as each location finishes (see run_forecast_tasks).
+    """
+    # Read and prepare monthly data unless the caller already has it
+    df_monthly = load_monthly_data(input_file) if monthly_data is None else monthly_data
     
-    # Read and prepare monthly data
-    df = pd.read_csv(input_file)
-    df_monthly = prepare_data(df)
+    return forecast_monthly_data(df_monthly, prediction_month, selected_location, adjustment_factor=adjustment_factor,
+                                 workers=workers, forecast_start=forecast_start, cache_dir=cache_dir, engine=engine,
+                                 output_dir=output_dir, visuals_dir=visuals_dir, progress=progress)
+
+def forecast_monthly_data(df_monthly, prediction_month=None, selected_location=None, adjustment_factor: float = 1.0,
+                          workers=1, forecast_start=None, cache_dir=model_cache.CACHE_DIR, render=True, engine='statsmodels',
+                          output_dir="forecast_results", visuals_dir=None, progress=None):
+    """
+    Forecast from monthly lead counts as produced by prepare_data
+
+    Takes the same options as forecast_leads. With render=False no charts or
+    results file are written, which suits intermediate steps whose output is
+    only fed back into the next forecast.
+    """
+    if render:
+        os.makedirs(output_dir, exist_ok=True)
     
     # Get prediction month or default to current month
     if prediction_month is None:
-        prediction_month = pd.Timestamp.now().to_period('ME')
+        prediction_month = pd.Timestamp.now().to_period('M')
     else:
         prediction_month = pd.Period(prediction_month)
     
     # Get current month to determine if we're forecasting future months
-    current_month = pd.Timestamp.now().to_period('ME')
-    is_future_month = prediction_month > current_month
+    current_month = pd.Timestamp.now().to_period('M')
+    
+    # First month to forecast; earlier months are training data
+    forecast_start = prediction_month if forecast_start is None else min(pd.Period(forecast_start), prediction_month)
     
-    forecast_results = []
+    forecast_tasks = []
     
     # Filter locations based on selection
     if selected_location and selected_location != 'All Locations':
@@ -57,10 +563,10 @@ def forecast_leads(input_file="leads_by_location_date.csv", prediction_month=Non
             
         print(f"\nForecasting for location: {location}")
         
-        # Filter data for this location up to but NOT including prediction month
+        # Filter data for this location up to but NOT including the first forecast month
         location_data = df_monthly[
             (df_monthly['Media_Location_Text__c'] == location) &
-            (df_monthly['month'] < prediction_month)  # Changed from <= to <
+            (df_monthly['month'] < forecast_start)  # Changed from <= to <
         ].copy()
         
         if len(location_data) < 3:  # Need at least 3 months of historical data
@@ -71,188 +577,52 @@ def forecast_leads(input_file="leads_by_location_date.csv", prediction_month=Non
         location_data.set_index('month', inplace=True)
         ts = location_data['Leads']
         
-        # Get last actual data point and determine forecast needs
-        last_actual_month = prediction_month - 1
-        months_ahead = 1
-        
-        # Get training data (all data up to but not including prediction month)
-        training_data = ts[ts.index <= last_actual_month]
+        # Only add running total if we're forecasting the current month
+        running_total = None
+        if forecast_start <= current_month <= prediction_month:
+            current_month_data = df_monthly[
+                (df_monthly['Media_Location_Text__c'] == location) &
+                (df_monthly['month'] == current_month)
+            ]
+            running_total = int(current_month_data['Leads'].sum()) if not current_month_data.empty else 0
         
+        forecast_tasks.append((location, ts, prediction_month, current_month, running_total,
+                               adjustment_factor, forecast_start, cache_dir))
+    
+    if engine == 'batch' and forecast_tasks:
+        # Fit all locations together; each task then only builds results and charts
+        steps = len(pd.period_range(start=forecast_start, end=prediction_month))
         try:
-            # Log transform the data (adding 1 to handle zeros)
-            ts_log = np.log1p(training_data)
-            
-            # Fit ARIMA model on log-transformed data
-            model = ARIMA(ts_log, order=(1,1,1), freq='ME')
-            model_fit = model.fit()
-            
-            # Generate forecast for prediction month
-            forecast_log = model_fit.forecast(steps=1)
-            conf_int_log_95 = model_fit.get_forecast(steps=1).conf_int(alpha=0.05)
-            conf_int_log_50 = model_fit.get_forecast(steps=1).conf_int(alpha=0.50)
-            
-            # Transform predictions back to original scale as integers
-            forecast = np.round(np.expm1(forecast_log)).astype(int)
-            conf_int_95 = np.round(np.expm1(conf_int_log_95)).astype(int)
-            conf_int_50 = np.round(np.expm1(conf_int_log_50)).astype(int)
-            
-            # Preserve original forecast before any adjustment
-            original_forecast_value = int(forecast.iloc[0])
-            
-            # Apply adjustment factor (floor to int)
-            print(f"DEBUG: Original forecast: {original_forecast_value}, Adjustment factor: {adjustment_factor}")
-            if adjustment_factor != 1.0:
-                print(f"DEBUG: Applying adjustment factor {adjustment_factor} to forecast values")
-                print(f"DEBUG: Before adjustment - forecast: {forecast.iloc[0]}, conf_95: [{conf_int_95.iloc[0, 0]}, {conf_int_95.iloc[0, 1]}], conf_50: [{conf_int_50.iloc[0, 0]}, {conf_int_50.iloc[0, 1]}]")
-                forecast = np.floor(forecast * adjustment_factor).astype(int)
-                conf_int_95 = np.floor(conf_int_95 * adjustment_factor).astype(int)
-                conf_int_50 = np.floor(conf_int_50 * adjustment_factor).astype(int)
-                print(f"DEBUG: After adjustment - forecast: {forecast.iloc[0]}, conf_95: [{conf_int_95.iloc[0, 0]}, {conf_int_95.iloc[0, 1]}], conf_50: [{conf_int_50.iloc[0, 0]}, {conf_int_50.iloc[0, 1]}]")
-            else:
-                print(f"DEBUG: No adjustment applied (factor = 1.0)")
-            
-            # Ensure predictions are non-negative integers
-            forecast = np.maximum(forecast, 0)
-            conf_int_95 = np.maximum(conf_int_95, 0)
-            conf_int_50 = np.maximum(conf_int_50, 0)
-            
-            # Get previous month
-            previous_month = prediction_month - 1
-            previous_month_data = ts[ts.index == previous_month]
-            
-            # Only consider it actual data if it's in or before the current month
-            is_actual = previous_month <= current_month
-            previous_month_label = "Actual" if is_actual else "Predicted"
-            
-            # Only use previous month data if it's actual, otherwise use None
-            if is_actual and not previous_month_data.empty:
-                previous_month_value = int(previous_month_data.iloc[0])
-            else:
-                previous_month_value = None
-            
-            # Store results
-            result_dict = {
-                'Location': location,
-                'Month': prediction_month.strftime('%Y-%m'),
-                'Original_Predicted_Monthly_Leads': original_forecast_value,
-                'Predicted_Monthly_Leads': int(forecast.iloc[0]),
-                'Lower_Bound_95': int(conf_int_95.iloc[0, 0]),
-                'Upper_Bound_95': int(conf_int_95.iloc[0, 1]),
-                'Lower_Bound_50': int(conf_int_50.iloc[0, 0]),
-                'Upper_Bound_50': int(conf_int_50.iloc[0, 1])
-            }
-            
-            # Only add previous month data if we have an actual value
-            if previous_month_value is not None:
-                result_dict[f'{previous_month.strftime("%B %Y")}_{previous_month_label}'] = previous_month_value
-            
-            # Only add running total if we're forecasting the current month
-            if prediction_month == current_month:
-                current_month_data = df_monthly[
-                    (df_monthly['Media_Location_Text__c'] == location) &
-                    (df_monthly['month'] == prediction_month)
-                ]
-                running_total = int(current_month_data['Leads'].sum()) if not current_month_data.empty else 0
-                result_dict[f'{prediction_month.strftime("%B %Y")}_Running_Total'] = running_total
-            
-            forecast_results.append(result_dict)
-            
-            # Create visualization
-            plt.figure(figsize=(16, 6))
-            
-            # Get the full date range for proper x-axis labeling
-            all_dates = pd.period_range(start=ts.index.min(), end=prediction_month)
-            
-            # Create a mapping of dates to x-positions
-            date_to_position = {}
-            for i, date in enumerate(all_dates):
-                date_to_position[date] = i
-            
-            # Plot historical data with correct x-positions
-            historical_x = [date_to_position[date] for date in training_data.index]
-            plt.plot(historical_x, training_data.values, 'b-', label='Historical')
-            plt.plot(historical_x, training_data.values, 'bo')  # Add blue dots
-            
-            # Plot forecast point at the correct x-position
-            forecast_x = date_to_position[prediction_month]
-            plt.plot(forecast_x, forecast.iloc[0], 'ro',
-                    label=f'Forecast ({prediction_month.strftime("%B %Y")})')
-            
-            # Plot confidence intervals at the correct x-position
-            plt.fill_between([forecast_x-0.2, forecast_x+0.2], 
-                           [conf_int_95.iloc[0, 0], conf_int_95.iloc[0, 0]], 
-                           [conf_int_95.iloc[0, 1], conf_int_95.iloc[0, 1]], 
-                           color='#9932CC',
-                           alpha=0.3,
-                           label='95% Confidence Interval')
-            
-            # Add confidence interval values
-            plt.text(forecast_x, conf_int_95.iloc[0, 1], 
-                    f'{int(conf_int_95.iloc[0, 1])}', 
-                    horizontalalignment='center', 
-                    verticalalignment='bottom')
-            plt.text(forecast_x, conf_int_95.iloc[0, 0], 
-                    f'{int(conf_int_95.iloc[0, 0])}', 
-                    horizontalalignment='center', 
-                    verticalalignment='top')
-            
-            plt.fill_between([forecast_x-0.2, forecast_x+0.2], 
-                           [conf_int_50.iloc[0, 0], conf_int_50.iloc[0, 0]], 
-                           [conf_int_50.iloc[0, 1], conf_int_50.iloc[0, 1]], 
-                           color='red', 
-                           alpha=0.3,
-                           label='50% Confidence Interval')
-            
-            # Add forecast value directly above the dot
-            plt.text(forecast_x, forecast.iloc[0] + 0.5, 
-                    f'{int(forecast.iloc[0])}', 
-                    horizontalalignment='center', 
-                    verticalalignment='bottom')
-            
-            # Add values for last 3 months of historical data
-            for i in range(min(3, len(training_data))):
-                idx = len(training_data) - 3 + i
-                if idx >= 0:
-                    date = training_data.index[idx]
-                    value = training_data.values[idx]
-                    x_pos = date_to_position[date]
-                    plt.text(x_pos, value + 0.5, 
-                            f'{int(value)}',
-                            horizontalalignment='center', 
-                            verticalalignment='bottom')
-            
-            # Set x-axis labels for all months
-            x_ticks = list(range(len(all_dates)))
-            x_labels = [d.strftime('%b %y') for d in all_dates]
-            plt.xticks(x_ticks, x_labels, rotation=45, ha='right')
-            
-            # Remove grid
-            plt.grid(False)
-            
-            # Add a note if we're using predicted data for forecasting
-            title_text = f'Monthly Lead Forecast for {location}\nPrediction for {prediction_month.strftime("%B %Y")}'
-            if is_future_month:
-                title_text += f'\n(Using predicted data for months after {current_month.strftime("%B %Y")})'
-            
-            plt.title(title_text)
-            plt.xlabel('Month')
-            plt.ylabel('Number of Leads')
-            
-            # Adjust layout to prevent label cutoff
-            plt.tight_layout(rect=[0, 0.03, 1, 0.95])
-            plt.legend(loc='upper left')
-            plt.savefig(f'{visuals_dir}/{location}_forecast.png', bbox_inches='tight')
-            plt.close()
-            
+            with profiling.span('arima.batch_fit', locations=len(forecast_tasks), steps=steps), \
+                    metrics.timer('terrece_arima_fit_seconds', location='All Locations', engine='batch', kind='fit'):
+                fitted = batch_arima.fit_and_forecast_batch([np.log1p(task[1]) for task in forecast_tasks], steps)
+            # Series the batched fit couldn't converge on get the cheap fallback model
+            for position, fit in enumerate(fitted):
+                if fit is None:
+                    print(f"Batched ARIMA did not converge for {forecast_tasks[position][0]}, using {FALLBACK_ENGINE} instead")
+                    metrics.inc('terrece_arima_fit_failures_total', location=forecast_tasks[position][0],
+                                engine='batch', reason='not_converged')
+                    fitted[position] = fallback_forecast(np.log1p(forecast_tasks[position][1]), steps) + (FALLBACK_ENGINE,)
         except Exception as e:
-            print(f"Error forecasting for {location}: {str(e)}")
+            print(f"Batched ARIMA engine failed, fitting locations separately: {str(e)}")
+            fitted = [None] * len(forecast_tasks)
+        forecast_tasks = [task + (fit,) for task, fit in zip(forecast_tasks, fitted)]
     
+    with profiling.span('forecast_locations', locations=len(forecast_tasks), workers=workers):
+        forecast_results = [result for results in run_forecast_tasks(forecast_tasks, workers, progress) for result in results]
+
     if forecast_results:
         results_df = pd.DataFrame(forecast_results)
+        charts.attach_chart_data(results_df, {task[0]: task[1] for task in forecast_tasks},
+                                 prediction_month, forecast_start, current_month)
+        if render and visuals_dir is not None:
+            charts.render_charts(charts.chart_specs(results_df), visuals_dir,
+                                 pool=get_process_pool(workers) if workers and workers > 1 else None)
         
         # Only save results file if we processed all Locations
-        if selected_location is None or selected_location == 'All Locations':
-            results_df.to_csv(f'{output_dir}/forecast_results.csv', index=False)
+        if render and (selected_location is None or selected_location == 'All Locations'):
+            with profiling.span('write_results'):
+                results_df.to_csv(f'{output_dir}/forecast_results.csv', index=False)
             print(f"\nForecast results saved to {output_dir}/forecast_results.csv")
         return results_df
     else:
@@ -260,4 +630,4 @@ def forecast_leads(input_file="leads_by_location_date.csv", prediction_month=Non
         return None
 
 if __name__ == "__main__":
-    forecast_leads() 
\ No newline at end of file
+    forecast_leads(visuals_dir="forecast_visuals") 
\ No newline at end of file
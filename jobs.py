@@ -0,0 +1,146 @@
+import contextvars
+import threading
+import time
+import types
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import workspace
+
+# Background jobs run on a few threads shared by every browser session
+JOB_WORKERS = 2
+
+# Jobs kept for reuse and display; the oldest finished ones are dropped beyond this
+MAX_JOBS = 50
+
+# Message kinds a job can report, matching the Streamlit calls that show them
+MESSAGE_KINDS = ['write', 'info', 'success', 'warning', 'error']
+
+_jobs = {}
+_job_ids_by_key = {}
+_executor = None
+_lock = threading.Lock()
+
+def _get_executor():
+    """Return the shared job thread pool (called with the lock held)"""
+    global _executor
+    if _executor is None:
+        # Workspaces of jobs from earlier runs of the app are no longer reachable
+        workspace.remove_stale()
+        _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="terrece-job")
+    return _executor
+
+def is_active(job):
+    """Whether a job is still waiting or running"""
+    return job['status'] in ('queued', 'running')
+
+def submit(key, function, *args, details=None, reuse_for=None, **kwargs):
+    """
+    Run function(job, *args, **kwargs) on a background thread
+
+    The function reports progress through the job dict (see add_results and
+    message_log) and its return value becomes job['result']. An exception
+    marks the job failed with the message in job['error'].
+
+    Every job gets its own workspace directory (job['workspace'], see
+    workspace.py) for the files it writes, removed when the job is dropped.
+
+    A job submitted earlier with the same key is returned instead of running
+    the work again, if it is still running or finished successfully less than
+    reuse_for seconds ago (None: at any age).
+
+    Parameters:
+    - key: Hashable description of the work, e.g. a tuple of its inputs
+    - details: Dict stored on the job for display, e.g. the inputs shown to the user
+
+    Returns:
+    - The job ID
+    """
+    with _lock:
+        job_id = _job_ids_by_key.get(key)
+        job = _jobs.get(job_id)
+        if job is not None and job['status'] != 'failed':
+            if is_active(job) or reuse_for is None or time.time() - job['finished'] < reuse_for:
+                return job_id
+
+        job_id = uuid.uuid4().hex
+        _jobs[job_id] = {
+            'id': job_id,
+            'key': key,
+            'details': details or {},
+            'status': 'queued',
+            'submitted': time.time(),
+            'started': None,
+            'finished': None,
+            'progress': (0, 0),
+            'partial': [],
+            'messages': [],
+            'result': None,
+            'error': None,
+            'workspace': workspace.create()
+        }
+        _job_ids_by_key[key] = job_id
+        _evict()
+        _get_executor().submit(_run, _jobs[job_id], function, args, kwargs)
+    return job_id
+
+def _run(job, function, args, kwargs):
+    job['started'] = time.time()
+    job['status'] = 'running'
+    try:
+        # A fresh context per job, so context-scoped state (the profiling trace)
+        # never leaks between jobs that share a worker thread or run at once
+        result = contextvars.Context().run(function, job, *args, **kwargs)
+    except Exception as e:
+        print(f"Job {job['id']} failed: {str(e)}")
+        with _lock:
+            # finished is set before status, so a finished job always has its time (see submit)
+            job['error'] = str(e)
+            job['finished'] = time.time()
+            job['status'] = 'failed'
+    else:
+        with _lock:
+            job['result'] = result
+            job['finished'] = time.time()
+            job['status'] = 'done'
+
+def _evict():
+    """Drop the oldest finished jobs beyond MAX_JOBS (called with the lock held)"""
+    finished = sorted((job['submitted'], job_id) for job_id, job in _jobs.items() if not is_active(job))
+    for _, job_id in finished[:max(0, len(_jobs) - MAX_JOBS)]:
+        job = _jobs.pop(job_id)
+        if _job_ids_by_key.get(job['key']) == job_id:
+            del _job_ids_by_key[job['key']]
+        workspace.remove(job['workspace'])
+
+def get(job_id):
+    """
+    Return a consistent copy of a job (lists copied), or None if it is unknown
+
+    Safe to call while the job is running.
+    """
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        return dict(job, partial=list(job['partial']), messages=list(job['messages']))
+
+def add_results(job, results, done, total):
+    """Record results finished by a running job and its progress as (done, total)"""
+    with _lock:
+        job['partial'].extend(results)
+        job['progress'] = (done, total)
+
+def add_message(job, kind, text):
+    """Record a message for the page to show with the job"""
+    with _lock:
+        job['messages'].append((kind, str(text)))
+
+def message_log(job):
+    """
+    Object with write/info/success/warning/error methods that record messages on a job
+
+    Lets code written against the Streamlit API report from a background thread.
+    """
+    return types.SimpleNamespace(**{
+        kind: (lambda text, kind=kind: add_message(job, kind, text)) for kind in MESSAGE_KINDS
+    })
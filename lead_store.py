@@ -0,0 +1,198 @@
+import json
+import os
+import threading
+import pandas as pd
+
+# Default locations of the local lead stores (individual records / daily counts)
+STORE_DIR = "lead_store"
+COUNTS_STORE_DIR = "lead_store_counts"
+MANIFEST_FILE = "manifest.json"
+
+# Monthly totals per location derived from the partitions (see read_monthly)
+MONTHLY_FILE = "monthly.parquet"
+
+# Statuses that count as a lead for forecasting
+COUNTED_STATUSES = ['Future Prospect', 'Converted', 'Client Registration', 'TOF Waitlist']
+
+# Columns kept for every stored lead record
+LEAD_COLUMNS = ['Id', 'CreatedDate', 'SystemModstamp', 'Media_Location_Text__c', 'Status']
+
+# Columns of a partition holding server-side aggregated daily counts
+COUNT_COLUMNS = ['day_created', 'Media_Location_Text__c', 'Leads']
+
+def month_key(month):
+    """Return the partition key (YYYY-MM) for a month"""
+    return pd.Period(month, freq='M').strftime('%Y-%m')
+
+def partition_path(store_dir, month):
+    """Return the file path of a month partition"""
+    return os.path.join(store_dir, f"{month_key(month)}.parquet")
+
+def legacy_partition_path(store_dir, month):
+    """Return the file path of a month partition written as CSV by older versions"""
+    return os.path.join(store_dir, f"{month_key(month)}.csv")
+
+def _typed_records(df):
+    """Give lead records their stored dtypes: UTC datetimes and categorical location/status"""
+    df = df.reindex(columns=LEAD_COLUMNS)
+    return df.assign(
+        Id=df['Id'].astype('string'),
+        CreatedDate=pd.to_datetime(df['CreatedDate'], utc=True),
+        SystemModstamp=pd.to_datetime(df['SystemModstamp'], utc=True),
+        Media_Location_Text__c=df['Media_Location_Text__c'].astype('category'),
+        Status=df['Status'].astype('category')
+    )
+
+def _typed_counts(df):
+    """Give daily count rows their stored dtypes: dates, categorical location and integer counts"""
+    df = df.reindex(columns=COUNT_COLUMNS)
+    return df.assign(
+        day_created=pd.to_datetime(df['day_created']),
+        Media_Location_Text__c=df['Media_Location_Text__c'].astype('category'),
+        Leads=df['Leads'].astype('int64')
+    )
+
+def _write_atomic(path, write):
+    """Write a file through a temporary path so readers never see a partial file"""
+    # Unique per thread: several forecast jobs may write in one process
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def load_manifest(store_dir=STORE_DIR):
+    """Load the store manifest describing which months are synced and frozen"""
+    manifest_path = os.path.join(store_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {"months": {}}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def save_manifest(manifest, store_dir=STORE_DIR):
+    """Persist the store manifest"""
+    os.makedirs(store_dir, exist_ok=True)
+
+    def write(path):
+        with open(path, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+    _write_atomic(os.path.join(store_dir, MANIFEST_FILE), write)
+
+def read_partition(store_dir, month):
+    """Read the stored lead records for a month (empty frame if none)"""
+    path = partition_path(store_dir, month)
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+
+    # Stores synced before partitions were Parquet still hold CSV files
+    legacy_path = legacy_partition_path(store_dir, month)
+    if os.path.exists(legacy_path):
+        df = pd.read_csv(legacy_path)
+        return _typed_records(df) if 'Id' in df.columns else _typed_counts(df)
+    return _typed_records(pd.DataFrame(columns=LEAD_COLUMNS))
+
+def _replace_partition(store_dir, month, df):
+    """Write a typed partition and drop files derived from the old one"""
+    os.makedirs(store_dir, exist_ok=True)
+    _write_atomic(partition_path(store_dir, month), lambda path: df.to_parquet(path, index=False))
+    for stale_path in (legacy_partition_path(store_dir, month), os.path.join(store_dir, MONTHLY_FILE)):
+        if os.path.exists(stale_path):
+            os.remove(stale_path)
+    return df
+
+def write_partition(store_dir, month, df):
+    """Replace the stored lead records for a month"""
+    df = _typed_records(df).sort_values(['CreatedDate', 'Id']).reset_index(drop=True)
+    return _replace_partition(store_dir, month, df)
+
+def write_count_partition(store_dir, month, df):
+    """Replace the stored daily lead counts for a month"""
+    df = _typed_counts(df).sort_values(['day_created', 'Media_Location_Text__c']).reset_index(drop=True)
+    return _replace_partition(store_dir, month, df)
+
+def upsert_partition(store_dir, month, changes, deleted_ids=()):
+    """
+    Merge changed lead records into a month partition
+
+    Parameters:
+    - store_dir: Lead store directory
+    - month: Month of the partition
+    - changes: DataFrame of new or modified lead records (latest version wins)
+    - deleted_ids: Ids of leads deleted in Salesforce since the last sync
+
+    Returns:
+    - The updated partition DataFrame
+    """
+    existing = read_partition(store_dir, month)
+    merged = pd.concat([existing, _typed_records(changes)], ignore_index=True)
+    merged = merged.drop_duplicates(subset='Id', keep='last')
+    if len(deleted_ids):
+        merged = merged[~merged['Id'].isin(deleted_ids)]
+    return write_partition(store_dir, month, merged)
+
+def get_watermark(df):
+    """Return the SystemModstamp watermark of a partition as a SOQL datetime literal"""
+    if df.empty or df['SystemModstamp'].isna().all():
+        return None
+    latest = pd.to_datetime(df['SystemModstamp'], utc=True).max()
+    return latest.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def read_leads(store_dir=STORE_DIR):
+    """
+    Read the lead store as daily lead rows
+
+    Returns a DataFrame with the columns day_created, Media_Location_Text__c,
+    Id and Leads, which is what prepare_data expects. Record partitions give
+    one row per counted lead; count partitions give one row per location and
+    day with no Id.
+    """
+    columns = ['day_created', 'Media_Location_Text__c', 'Id', 'Leads']
+    manifest = load_manifest(store_dir)
+    daily = []
+    for month in sorted(manifest['months']):
+        df = read_partition(store_dir, month)
+        if df.empty:
+            continue
+
+        if 'Id' in df.columns:
+            # Only count leads in forecastable statuses
+            df = df[df['Status'].isin(COUNTED_STATUSES)].copy()
+            df['day_created'] = df['CreatedDate'].dt.tz_convert(None).dt.normalize()
+            df['Leads'] = 1
+        df['Media_Location_Text__c'] = df['Media_Location_Text__c'].astype(object)
+        daily.append(df.reindex(columns=columns))
+
+    if not daily:
+        return pd.DataFrame(columns=columns)
+
+    result_df = pd.concat(daily, ignore_index=True)
+    return result_df.sort_values(['day_created', 'Media_Location_Text__c', 'Id']).reset_index(drop=True)
+
+def read_monthly(store_dir=STORE_DIR):
+    """
+    Read the cached monthly totals of a store
+
+    The file is written by write_monthly and removed whenever a partition
+    changes, so a hit always matches the partitions.
+
+    Returns:
+    - DataFrame with Media_Location_Text__c (categorical), month (Period)
+      and Leads, or None if the totals need rebuilding
+    """
+    path = os.path.join(store_dir, MONTHLY_FILE)
+    if not os.path.exists(path):
+        return None
+    monthly = pd.read_parquet(path)
+    # Months are stored as integer period codes
+    monthly['month'] = pd.PeriodIndex.from_ordinals(monthly['month'], freq='M')
+    return monthly
+
+def write_monthly(store_dir, monthly):
+    """Cache monthly totals (as produced by prepare_data) next to the partitions"""
+    stored = monthly.reindex(columns=['Media_Location_Text__c', 'month', 'Leads'])
+    stored = stored.assign(
+        Media_Location_Text__c=stored['Media_Location_Text__c'].astype('category'),
+        month=stored['month'].array.asi8.astype('int32'),
+        Leads=stored['Leads'].astype('int64')
+    )
+    os.makedirs(store_dir, exist_ok=True)
+    _write_atomic(os.path.join(store_dir, MONTHLY_FILE), lambda path: stored.to_parquet(path, index=False))
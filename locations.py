@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import numpy as np
+import pandas as pd
+
+# Local additions to the built-in registry, and the state of the last refresh from Salesforce
+REGISTRY_FILE = "locations.json"
+
+# Canonical location names, as shown in the app and used throughout the forecasts
+DEFAULT_LOCATIONS = [
+    'Ankeny', 'Bettendorf', 'Boise', 'Chesterfield', 'Chicago',
+    'Coeur d\'Alene', 'Crystal Lake', 'De Pere', 'Eau Claire', 'Elgin',
+    'Geneva', 'Iowa City', 'Janesville', 'LaCrosse', 'Lake Geneva',
+    'Mequon', 'Meridian', 'Nampa', 'Oakville', 'Pewaukee', 'Rolling Meadows',
+    'St. Cloud', 'Urbandale', 'Warrenville', 'Weldon Spring',
+    'West Madison'
+]
+
+# Other spellings used in Salesforce, mapped to their canonical name
+DEFAULT_ALIASES = {
+    'Geneva/St.Charles': 'Geneva',
+    'Warrenville/Naperville': 'Warrenville',
+    'Chicago/Irving Park': 'Chicago',
+    'Coeur dAlene': 'Coeur d\'Alene'
+}
+
+# The registry in use and what is derived from it, rebuilt when the registry file changes
+_registry = None
+_registry_source = None
+_mapping = {}
+_location_filter = ""
+_fingerprint = None
+_registry_lock = threading.Lock()
+
+def _read_file(path):
+    """Read the registry file, or an empty registry if there is none"""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def _install(additions, source):
+    """Merge registry additions with the built-in registry and cache everything derived from it"""
+    global _registry, _registry_source, _mapping, _location_filter, _fingerprint
+    locations = list(dict.fromkeys(DEFAULT_LOCATIONS + additions.get('locations', [])))
+    aliases = {**DEFAULT_ALIASES, **additions.get('aliases', {})}
+    _registry = {'locations': sorted(locations), 'aliases': aliases}
+    _mapping = {**{name: name for name in locations}, **aliases}
+    # Escape single quotes in location names
+    _location_filter = "', '".join(name.replace("'", "\\'") for name in _mapping)
+    _fingerprint = hashlib.sha256(json.dumps(sorted(_mapping.items())).encode('utf-8')).hexdigest()[:16]
+    _registry_source = source
+
+def get_registry(path=REGISTRY_FILE):
+    """
+    Return the location registry: {'locations': canonical names, 'aliases': {spelling: canonical name}}
+
+    The registry is loaded once and cached; it is only re-read when the
+    registry file changes (e.g. after check_locations.py --refresh).
+    """
+    try:
+        source = (path, os.stat(path).st_mtime_ns)
+    except OSError:
+        source = (path, None)
+    with _registry_lock:
+        if _registry is None or (_registry_source != source and _registry_source != 'override'):
+            try:
+                additions = _read_file(path)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable location registry {path}: {str(e)}")
+                additions = {}
+            _install(additions, source)
+        return _registry
+
+def set_registry(additions):
+    """
+    Use registry additions held in memory instead of the registry file, or go
+    back to the file with None (used by the benchmark's synthetic locations)
+    """
+    global _registry
+    with _registry_lock:
+        if additions is None:
+            _registry = None
+        else:
+            _install(additions, 'override')
+
+def canonical_locations():
+    """Sorted canonical location names"""
+    return list(get_registry()['locations'])
+
+def salesforce_names():
+    """Every spelling of the registered locations in Salesforce: canonical names and aliases"""
+    get_registry()
+    return list(_mapping)
+
+def location_filter():
+    """The SOQL IN (...) list of every location spelling, built once per registry"""
+    get_registry()
+    return _location_filter
+
+def fingerprint():
+    """
+    Hash of every spelling and the canonical name it maps to
+
+    The lead stores record it for each synced month (see
+    query.sync_lead_store): a month synced under another registry is fetched
+    again, so leads under a newly added alias reach frozen months too.
+    """
+    get_registry()
+    return _fingerprint
+
+def normalize(names):
+    """
+    Map a Series of Salesforce location spellings to canonical names
+
+    The mapping is applied once per distinct spelling rather than once per
+    row: the values are factorized, the few categories are mapped, and the
+    codes are carried over. Returns a categorical Series with the same index;
+    names the registry doesn't know are kept as they are.
+    """
+    get_registry()
+    codes, spellings = pd.factorize(names)
+    canonical = pd.Index([_mapping.get(spelling, spelling) for spelling in spellings], dtype=object)
+    categories = canonical.unique()
+    # One extra slot so missing values (code -1) stay missing
+    category_codes = np.append(categories.get_indexer(canonical), -1)
+    return pd.Series(pd.Categorical.from_codes(category_codes[codes], categories),
+                     index=names.index, name=names.name)
+
+def _match_key(name):
+    """Spelling with case, spacing and punctuation removed, to spot variants of a known location"""
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+def refresh_registry(sf, full=False, add_new=False, path=REGISTRY_FILE):
+    """
+    Update the registry file with the location spellings used in Salesforce
+
+    Only leads modified since the previous refresh are scanned (all leads the
+    first time, or with full=True). A new spelling that differs from a known
+    location only in case, spacing or punctuation becomes an alias of it.
+    Other new spellings are reported as unknown, or added as new locations
+    with add_new=True.
+
+    Returns:
+    - tuple: (dict with the 'seen', 'aliased', 'added' and 'unknown' spellings,
+      error message or None)
+    """
+    try:
+        additions = _read_file(path)
+    except (OSError, ValueError) as e:
+        return None, f"Could not read {path}: {str(e)}"
+    since = None if full else additions.get('checked_through')
+    started = pd.Timestamp.now(tz='UTC').strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    where = "Media_Location_Text__c != null"
+    if since:
+        where += f" AND SystemModstamp >= {since}"
+    query = f"""
+    SELECT Media_Location_Text__c, COUNT(Id) Leads
+    FROM Lead
+    WHERE {where}
+    GROUP BY Media_Location_Text__c
+    """
+    try:
+        records = sf.query_all(query)['records']
+    except Exception as e:
+        print(f"Query error: {str(e)}")
+        return None, str(e)
+    seen = sorted({record['Media_Location_Text__c'] for record in records})
+
+    registry = get_registry(path)
+    known = {**{name: name for name in registry['locations']}, **registry['aliases']}
+    by_key = {_match_key(name): canonical for name, canonical in known.items()}
+    aliased, added, unknown = {}, [], []
+    # Spellings left unknown by earlier refreshes are looked at again too
+    for name in sorted(set(seen) | set(additions.get('unknown', []))):
+        if name in known:
+            continue
+        if _match_key(name) in by_key:
+            aliased[name] = by_key[_match_key(name)]
+        elif add_new:
+            added.append(name)
+        else:
+            unknown.append(name)
+
+    additions['locations'] = sorted(set(additions.get('locations', [])) | set(added))
+    additions['aliases'] = {**additions.get('aliases', {}), **aliased}
+    additions['seen'] = sorted(set(additions.get('seen', [])) | set(seen))
+    additions['unknown'] = unknown
+    additions['checked_through'] = started
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(additions, f, indent=2)
+    os.replace(tmp_path, path)
+    return {'seen': seen, 'aliased': aliased, 'added': added, 'unknown': unknown}, None
@@ -0,0 +1,225 @@
+import contextlib
+import copy
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (seconds) of the latency histogram buckets, from a cached fit to a full chain forecast
+LATENCY_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+# Upper bounds of the pages-per-query histogram buckets (Salesforce pages hold up to 2,000 records)
+PAGE_BUCKETS = [1, 2, 3, 5, 10, 20, 50, 100]
+
+# Metrics exported, by name: (type, help text, histogram buckets)
+METRICS = {
+    'terrece_salesforce_query_seconds': ('histogram', "Salesforce query latency, all pages included", LATENCY_BUCKETS),
+    'terrece_salesforce_query_pages': ('histogram', "Result pages fetched per Salesforce query", PAGE_BUCKETS),
+    'terrece_salesforce_query_errors_total': ('counter', "Salesforce queries that failed", None),
+    'terrece_arima_fit_seconds': ('histogram', "Time to fit a model (kind=fit) or to filter with cached parameters "
+                                               "(kind=smooth)", LATENCY_BUCKETS),
+    'terrece_arima_fit_failures_total': ('counter', "Fits that did not converge, ran out of budget or failed, "
+                                                    "and fell back to exponential smoothing", None),
+    'terrece_chart_render_seconds': ('histogram', "Time to draw a forecast chart", LATENCY_BUCKETS),
+    'terrece_cache_requests_total': ('counter', "Cache lookups by cache and result (hit, miss, or params for a model "
+                                                "cache entry whose parameters were reused but forecast recomputed)", None),
+    'terrece_cache_hit_ratio': ('gauge', "Share of cache lookups that hit (result=hit only) since the process started", None),
+    'terrece_location_forecast_seconds': ('histogram', "Time to forecast one location, fit and results", LATENCY_BUCKETS),
+    'terrece_forecast_seconds': ('histogram', "End-to-end forecast latency of an app request or batch month, "
+                                              "data sync included", LATENCY_BUCKETS)
+}
+
+# Port of the /metrics endpoint (unset: no endpoint) and the address it binds to
+METRICS_PORT = os.getenv('TERRECE_METRICS_PORT')
+METRICS_HOST = os.getenv('TERRECE_METRICS_HOST', '127.0.0.1')
+
+# File rewritten for node_exporter's textfile collector (unset: none), and how often
+METRICS_TEXTFILE = os.getenv('TERRECE_METRICS_TEXTFILE')
+TEXTFILE_INTERVAL_SECONDS = float(os.getenv('TERRECE_METRICS_TEXTFILE_SECONDS', '15'))
+
+# Recorded values by (metric name, sorted label pairs); shared by every job thread
+_series = {}
+_lock = threading.Lock()
+
+# The exporter threads, started once per process
+_exporter_started = False
+_exporter_lock = threading.Lock()
+
+def _key(name, labels):
+    if name not in METRICS:
+        raise KeyError(f"Unknown metric {name}")
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+def inc(name, amount=1, **labels):
+    """Add to a counter"""
+    key = _key(name, labels)
+    with _lock:
+        _series[key] = _series.get(key, 0) + amount
+
+def observe(name, value, **labels):
+    """Record a value in a histogram"""
+    key = _key(name, labels)
+    buckets = METRICS[name][2]
+    with _lock:
+        state = _series.get(key)
+        if state is None:
+            state = _series[key] = {'buckets': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0}
+        # Counts per bucket; they are made cumulative when rendered
+        state['buckets'][bisect_left(buckets, value)] += 1
+        state['sum'] += value
+        state['count'] += 1
+
+@contextlib.contextmanager
+def timer(name, **labels):
+    """
+    Record how long a block takes in a histogram
+
+    Yields the labels dict, so the block can add labels only known at the
+    end (e.g. which engine served a forecast). Blocks that raise are
+    recorded too.
+    """
+    started = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+def drain():
+    """
+    Take everything recorded so far and start over
+
+    Worker processes return this with their results so the parent, which
+    serves the metrics, can merge it (see merge).
+    """
+    global _series
+    with _lock:
+        series, _series = _series, {}
+    return series
+
+def merge(series):
+    """Add metrics recorded in another process (see drain)"""
+    if not series:
+        return
+    with _lock:
+        for key, value in series.items():
+            state = _series.get(key)
+            if state is None:
+                _series[key] = copy.deepcopy(value)
+            elif isinstance(state, dict):
+                state['buckets'] = [a + b for a, b in zip(state['buckets'], value['buckets'])]
+                state['sum'] += value['sum']
+                state['count'] += value['count']
+            else:
+                _series[key] = state + value
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    escaped = (value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(pairs, escaped)) + "}"
+
+def _hit_ratios(series):
+    """Hit ratio per cache, summed over the other labels of terrece_cache_requests_total"""
+    totals = {}
+    for (name, pairs), value in series.items():
+        if name == 'terrece_cache_requests_total':
+            labels = dict(pairs)
+            hits, lookups = totals.get(labels.get('cache'), (0, 0))
+            totals[labels.get('cache')] = (hits + (value if labels.get('result') == 'hit' else 0), lookups + value)
+    return {('terrece_cache_hit_ratio', (('cache', cache),)): hits / lookups
+            for cache, (hits, lookups) in totals.items() if lookups}
+
+def render():
+    """Everything recorded, in the Prometheus text exposition format"""
+    with _lock:
+        series = copy.deepcopy(_series)
+    series.update(_hit_ratios(series))
+
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        keys = sorted(key for key in series if key[0] == name)
+        if not keys:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for key in keys:
+            pairs, value = key[1], series[key]
+            if kind != 'histogram':
+                lines.append(f"{name}{_format_labels(pairs)} {value:g}")
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ['+Inf'], value['buckets']):
+                cumulative += count
+                upper = bound if bound == '+Inf' else f"{bound:g}"
+                lines.append(f"{name}_bucket{_format_labels(pairs + (('le', upper),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(pairs)} {value['sum']:g}")
+            lines.append(f"{name}_count{_format_labels(pairs)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+def write_textfile(path=None):
+    """Write the metrics for node_exporter's textfile collector, replacing the file atomically"""
+    path = path or METRICS_TEXTFILE
+    if not path:
+        return
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(render())
+    os.replace(tmp_path, path)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves GET /metrics"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_exporter(port=None, textfile=None):
+    """
+    Start exporting metrics, once per process
+
+    With a port (default TERRECE_METRICS_PORT) /metrics is served on
+    METRICS_HOST from a background thread. With a textfile (default
+    TERRECE_METRICS_TEXTFILE) the file is rewritten every
+    TEXTFILE_INTERVAL_SECONDS. Neither is started when both are unset.
+
+    Returns:
+    - The HTTP server, or None if none was started by this call
+    """
+    global _exporter_started
+    port = port or METRICS_PORT
+    textfile = textfile or METRICS_TEXTFILE
+    with _exporter_lock:
+        if _exporter_started or not (port or textfile):
+            return None
+        _exporter_started = True
+
+    server = None
+    if port:
+        try:
+            server = ThreadingHTTPServer((METRICS_HOST, int(port)), MetricsHandler)
+        except OSError as e:
+            print(f"Could not serve metrics on {METRICS_HOST}:{port}: {str(e)}")
+        else:
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+            print(f"Serving metrics on http://{METRICS_HOST}:{server.server_address[1]}/metrics")
+    if textfile:
+        def write_periodically():
+            while True:
+                try:
+                    write_textfile(textfile)
+                except OSError as e:
+                    print(f"Could not write metrics to {textfile}: {str(e)}")
+                time.sleep(TEXTFILE_INTERVAL_SECONDS)
+        threading.Thread(target=write_periodically, name="metrics-textfile", daemon=True).start()
+    return server
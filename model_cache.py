@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+import threading
+
+# Default location and size limit of the fitted model cache
+CACHE_DIR = "model_cache"
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+
+def series_fingerprint(ts):
+    """Hash a monthly series (index and values) so identical training data gives the same key"""
+    digest = hashlib.sha256()
+    digest.update("|".join(str(month) for month in ts.index).encode('utf-8'))
+    digest.update(ts.to_numpy(dtype='float64').tobytes())
+    return digest.hexdigest()
+
+def cache_key(location, order, cutoff_month, ts):
+    """Build the cache key for a location, model order, last training month and training series"""
+    parts = [location, list(order), str(cutoff_month), series_fingerprint(ts)]
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+def _entry_path(cache_dir, key):
+    return os.path.join(cache_dir, f"{key}.json")
+
+def load(key, cache_dir=CACHE_DIR):
+    """
+    Look up a cached model entry
+
+    A hit refreshes the entry's modification time, which is what eviction
+    uses to find the least recently used entries.
+
+    Returns:
+    - The entry dict, or None on a miss
+    """
+    path = _entry_path(cache_dir, key)
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+        os.utime(path)
+        return entry
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def load_file(path):
+    """Read a cached file and refresh its modification time like load does; None if it is missing"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.utime(path)
+        return data
+    except FileNotFoundError:
+        return None
+
+def store(key, entry, cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    """Save a model entry and evict least recently used entries beyond max_bytes"""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _entry_path(cache_dir, key)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(entry, f)
+    os.replace(tmp_path, path)
+    evict(cache_dir, max_bytes)
+
+def evict(cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, suffix='.json'):
+    """Delete least recently used entries (files ending in suffix) until the cache fits in max_bytes"""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(suffix):
+            continue
+        try:
+            stat = os.stat(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+        total -= size
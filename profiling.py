@@ -0,0 +1,200 @@
+import contextlib
+import contextvars
+import cProfile
+import datetime
+import io
+import json
+import marshal
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import pandas as pd
+
+# The trace being collected in the current context, if any; spans are no-ops without one.
+# Each job runs in its own context (see jobs.py), so concurrent jobs never share a trace.
+_trace = contextvars.ContextVar('terrece_trace', default=None)
+_lock = threading.Lock()
+_local = threading.local()
+
+# tracemalloc is process-wide: it runs while any trace asks for memory
+_memory_traces = 0
+
+# Functions listed in a trace's profile summary
+PROFILE_TOP_FUNCTIONS = 40
+
+def start_trace(profile=False, memory=False):
+    """
+    Start collecting timed spans for a run, replacing any trace in progress
+
+    The trace belongs to the current context (thread or job, see jobs.py):
+    spans recorded elsewhere go to their own context's trace, if any.
+
+    Parameters:
+    - profile: Also run cProfile on the calling thread
+    - memory: Record peak memory per span with tracemalloc (slows Python code down)
+
+    Returns:
+    - The new trace dict
+    """
+    global _memory_traces
+    trace = {
+        'started': time.time(),
+        'spans': [],
+        'memory': memory,
+        'profile_text': None,
+        'profile_data': None
+    }
+    if memory:
+        with _lock:
+            if _memory_traces == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            _memory_traces += 1
+        trace['_memory'] = True
+    if profile:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            trace['_profiler'] = profiler
+        except ValueError as e:
+            # Only one profiler can run at a time on some Python versions
+            print(f"Not profiling this run: {str(e)}")
+    _trace.set(trace)
+    return trace
+
+def stop_trace():
+    """
+    Stop the current trace
+
+    Returns:
+    - The finished trace dict (None if no trace was running). With cProfile
+      enabled, profile_text holds a summary and profile_data the raw stats
+      in the format of pstats files.
+    """
+    global _memory_traces
+    trace = _trace.get()
+    _trace.set(None)
+    if trace is None:
+        return None
+
+    profiler = trace.pop('_profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        profiler.create_stats()
+        trace['profile_data'] = marshal.dumps(profiler.stats)
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+        trace['profile_text'] = text.getvalue()
+    if trace.pop('_memory', False):
+        with _lock:
+            _memory_traces -= 1
+            if _memory_traces == 0 and tracemalloc.is_tracing():
+                tracemalloc.stop()
+    trace['seconds'] = time.time() - trace['started']
+    return trace
+
+def current_trace():
+    """Return the trace being collected in the current context, or None"""
+    return _trace.get()
+
+def _fold_peak(stack):
+    """Credit the memory peak since the last reset to every open span, then reset it"""
+    current, peak = tracemalloc.get_traced_memory()
+    for record in stack:
+        record['_peak'] = max(record['_peak'], peak)
+    tracemalloc.reset_peak()
+    return current
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """
+    Time a block of work as a named span of the current trace
+
+    Yields a dict that the block can add attributes to (e.g. row counts).
+    Without a trace this costs next to nothing. With memory tracing, the
+    span records the peak memory reached above the level at its start;
+    spans overlapping on other threads make that figure approximate.
+    """
+    trace = _trace.get()
+    if trace is None:
+        yield {}
+        return
+
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    record = {
+        'name': name,
+        'start': time.time() - trace['started'],
+        'depth': len(stack),
+        'thread': threading.current_thread().name,
+        'process': os.getpid(),
+        'attributes': attributes
+    }
+    memory = trace['memory'] and tracemalloc.is_tracing()
+    if memory:
+        record['_memory_start'] = _fold_peak(stack)
+        record['_peak'] = 0
+
+    stack.append(record)
+    started = time.perf_counter()
+    try:
+        yield record['attributes']
+    except BaseException as e:
+        record['error'] = type(e).__name__
+        raise
+    finally:
+        record['seconds'] = time.perf_counter() - started
+        if memory:
+            _fold_peak(stack)
+            record['peak_mb'] = (record.pop('_peak') - record.pop('_memory_start')) / 1024 ** 2
+        stack.pop()
+        with _lock:
+            trace['spans'].append(record)
+
+def add_spans(child_trace):
+    """Merge the spans of a trace collected in another process into the current trace"""
+    trace = _trace.get()
+    if trace is None or child_trace is None:
+        return
+    offset = child_trace['started'] - trace['started']
+    with _lock:
+        for record in child_trace['spans']:
+            trace['spans'].append(dict(record, start=record['start'] + offset))
+
+def summarize(trace):
+    """
+    Per-stage breakdown of a trace
+
+    Returns:
+    - DataFrame with one row per span name, in order of first appearance:
+      calls, total/mean/max seconds and (with memory tracing) peak MB
+    """
+    columns = ['stage', 'calls', 'total_seconds', 'mean_seconds', 'max_seconds']
+    spans = pd.DataFrame(trace['spans'])
+    if spans.empty:
+        return pd.DataFrame(columns=columns)
+
+    grouped = spans.groupby('name', sort=False)
+    summary = pd.DataFrame({
+        'calls': grouped.size(),
+        'total_seconds': grouped['seconds'].sum(),
+        'mean_seconds': grouped['seconds'].mean(),
+        'max_seconds': grouped['seconds'].max(),
+        'first_start': grouped['start'].min()
+    })
+    if 'peak_mb' in spans.columns:
+        summary['peak_mb'] = grouped['peak_mb'].max()
+    summary = summary.sort_values('first_start').drop(columns='first_start')
+    return summary.rename_axis('stage').reset_index()
+
+def trace_json(trace):
+    """Serialize a trace (spans and profile summary) as JSON for download"""
+    payload = {
+        'started': datetime.datetime.fromtimestamp(trace['started']).isoformat(timespec='seconds'),
+        'seconds': trace.get('seconds'),
+        'spans': sorted(trace['spans'], key=lambda record: record['start']),
+        'profile': trace['profile_text']
+    }
+    return json.dumps(payload, indent=2, default=str)
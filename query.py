@@ -1,15 +1,43 @@
-from simple_salesforce import Salesforce
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+import requests
+import os
+import threading
 import pandas as pd
+import lead_store
+import locations
+import metrics
+import profiling
 
-def get_salesforce_auth(username, password, security_token):
+# Maximum number of Salesforce queries in flight at once
+DEFAULT_FETCH_WORKERS = 8
+
+# One lock per lead store so concurrent jobs sync the same store one at a time
+_store_locks = {}
+_store_locks_lock = threading.Lock()
+
+def create_pooled_session(max_connections=DEFAULT_FETCH_WORKERS):
+    """Create an HTTP session whose connection pool can serve concurrent queries"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, max_connections or 1))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_salesforce_auth(username, password, security_token, session=None):
     """Authenticate to Salesforce with provided credentials"""
+    # simple_salesforce (and zeep under it) load only when a connection is made
+    from simple_salesforce import Salesforce
     try:
-        sf = Salesforce(
-            username=username,
-            password=password,
-            security_token=security_token,
-            domain='login'
-        )
+        with profiling.span('salesforce.auth'):
+            sf = Salesforce(
+                username=username,
+                password=password,
+                security_token=security_token,
+                domain='login',
+                session=session or create_pooled_session()
+            )
         print(f"Authenticated as user: {sf.user_id}")
         return sf, None
     except Exception as e:
@@ -17,88 +45,137 @@ def get_salesforce_auth(username, password, security_token):
         print(f"Authentication error: {error_message}")
         return None, error_message
 
-def get_valid_locations():
-    return [
-        'Ankeny',
-        'Bettendorf',
-        'Boise',
-        'Chesterfield',
-        'Chicago',
-        'Coeur d\'Alene',
-        'Coeur dAlene',
-        'Crystal Lake',
-        'De Pere',
-        'Eau Claire',
-        'Elgin',
-        'Geneva',
-        'Iowa City',
-        'Janesville',
-        'LaCrosse',
-        'Lake Geneva',
-        'Mequon',
-        'Meridian',
-        'Nampa',
-        'Oakville',
-        'Pewaukee',
-        'Rolling Meadows',
-        'St. Cloud',
-        'Urbandale',
-        'Warrenville',
-        'Weldon Spring',
-        'West Madison',
-        'Geneva/St.Charles',
-        'Warrenville/Naperville',
-        'Chicago/Irving Park'
-    ]
-
-def map_location_name(location):
-    """Map location names to their standardized forms"""
-    location_mapping = {
-        'Geneva/St.Charles': 'Geneva',
-        'Warrenville/Naperville': 'Warrenville',
-        'Chicago/Irving Park': 'Chicago',
-        'Coeur dAlene': 'Coeur d\'Alene'
-    }
-    return location_mapping.get(location, location)
-
-def get_leads_for_month(sf, start_date, end_date):
-    valid_locations = get_valid_locations()
-    # Escape single quotes in location names
-    escaped_locations = [loc.replace("'", "\\'") for loc in valid_locations]
-    location_filter = "', '".join(escaped_locations)
-    
+def run_query(sf, query, kind, include_deleted=False):
+    """
+    Run a SOQL query and return all its records, fetching the result pages in turn
+
+    The same as sf.query_all, but the query's latency and number of pages
+    are recorded in the metrics (see metrics.py), labeled by kind.
+    """
+    with metrics.timer('terrece_salesforce_query_seconds', kind=kind):
+        try:
+            result = sf.query(query, include_deleted=include_deleted)
+            records, pages = list(result['records']), 1
+            while not result['done']:
+                result = sf.query_more(result['nextRecordsUrl'], identifier_is_url=True)
+                records += result['records']
+                pages += 1
+        except Exception:
+            metrics.inc('terrece_salesforce_query_errors_total', kind=kind)
+            raise
+    metrics.observe('terrece_salesforce_query_pages', pages, kind=kind)
+    return records
+
+def get_status_filter():
+    """Build the SOQL IN (...) list of statuses that count as leads"""
+    return "', '".join(lead_store.COUNTED_STATUSES)
+
+def get_leads_for_month(sf, start_date, end_date, modified_since=None):
+    """
+    Get lead records created in a date range
+
+    Parameters:
+    - sf: Salesforce connection object
+    - start_date: Range start (inclusive, format: YYYY-MM-DDT00:00:00Z)
+    - end_date: Range end (exclusive, format: YYYY-MM-DDT00:00:00Z)
+    - modified_since: Optional SystemModstamp watermark. When given, only leads
+      modified since then are returned, in any status and including deleted
+      leads, so status changes and deletions can be applied to the store.
+
+    Returns:
+    - DataFrame of lead records, or None if the query failed
+    """
+    if modified_since:
+        status_filter = f"SystemModstamp >= {modified_since}"
+    else:
+        # Leads that later move into a counted status are picked up by the
+        # SystemModstamp delta, so only counted statuses are fetched up front
+        status_filter = f"Status IN ('{get_status_filter()}')"
+
     # Update query to include Status field and filter by correct API names
     query = f"""
     SELECT 
         Id,
         CreatedDate, 
+        SystemModstamp,
+        IsDeleted,
         Media_Location_Text__c,
         Status
     FROM Lead
     WHERE 
         CreatedDate >= {start_date} AND 
-        CreatedDate <= {end_date} AND
-        Media_Location_Text__c IN ('{location_filter}') AND
-        Status IN ('Unqualified Lead', 'Converted', 'Client Registration', 'TOF Waitlist', 'Future Prospect', 'Prospect Connect')
+        CreatedDate < {end_date} AND
+        Media_Location_Text__c IN ('{locations.location_filter()}') AND
+        {status_filter}
     ORDER BY 
         CreatedDate ASC
     """
     
     try:
-        result = sf.query_all(query)
-        df = pd.DataFrame(result['records'])
+        with profiling.span('salesforce.query', month=start_date[:7], delta=bool(modified_since)) as span:
+            records = run_query(sf, query, 'lead_changes' if modified_since else 'leads',
+                                include_deleted=bool(modified_since))
+            span['records'] = len(records)
+        df = pd.DataFrame(records)
         if not df.empty:
             # Add a count column for aggregation
             df['Leads'] = 1
             # Map location names to standardized forms
-            df['Media_Location_Text__c'] = df['Media_Location_Text__c'].apply(map_location_name)
+            df['Media_Location_Text__c'] = locations.normalize(df['Media_Location_Text__c'])
             # Ensure Id is preserved
             if 'Id' in df.columns:
-                df = df[['Id', 'CreatedDate', 'Media_Location_Text__c', 'Status', 'Leads']]
+                df = df[['Id', 'CreatedDate', 'SystemModstamp', 'IsDeleted', 'Media_Location_Text__c', 'Status', 'Leads']]
+        return df
+    except Exception as e:
+        print(f"Query error: {str(e)}")
+        return None
+
+def get_lead_counts_for_month(sf, start_date, end_date):
+    """
+    Get daily lead counts per location for a date range, aggregated by Salesforce
+
+    Only a few thousand grouped rows come back instead of one row per lead.
+    Aggregate queries do not support queryMore, so ranges should stay at
+    about a month (days x locations must stay under 2,000 groups).
+
+    Parameters:
+    - sf: Salesforce connection object
+    - start_date: Range start (inclusive, format: YYYY-MM-DDT00:00:00Z)
+    - end_date: Range end (exclusive, format: YYYY-MM-DDT00:00:00Z)
+
+    Returns:
+    - DataFrame with day_created, Media_Location_Text__c and Leads columns,
+      or None if the query failed
+    """
+    query = f"""
+    SELECT 
+        DAY_ONLY(CreatedDate) day_created,
+        Media_Location_Text__c,
+        COUNT(Id) Leads
+    FROM Lead
+    WHERE 
+        CreatedDate >= {start_date} AND 
+        CreatedDate < {end_date} AND
+        Media_Location_Text__c IN ('{locations.location_filter()}') AND
+        Status IN ('{get_status_filter()}')
+    GROUP BY 
+        DAY_ONLY(CreatedDate), 
+        Media_Location_Text__c
+    """
+
+    try:
+        with profiling.span('salesforce.query', month=start_date[:7], aggregate=True) as span:
+            records = run_query(sf, query, 'counts')
+            span['records'] = len(records)
+        df = pd.DataFrame(records, columns=['day_created', 'Media_Location_Text__c', 'Leads'])
+        if not df.empty:
+            # Map location names to standardized forms and merge the aliases' groups
+            df['Media_Location_Text__c'] = locations.normalize(df['Media_Location_Text__c'])
+            df = df.groupby(['day_created', 'Media_Location_Text__c'], as_index=False, observed=True)['Leads'].sum()
         return df
     except Exception as e:
         print(f"Query error: {str(e)}")
-        return pd.DataFrame()
+        return None
 
 def get_date_ranges(prediction_month=None):
     # Get target month for prediction
@@ -124,48 +201,172 @@ def get_date_ranges(prediction_month=None):
     
     return ranges
 
-def get_salesforce_data(username, password, security_token, prediction_month=None):
-    # Get Salesforce connection
-    sf, error = get_salesforce_auth(username, password, security_token)
-    
+def fetch_ranges(fetch, ranges, max_workers=DEFAULT_FETCH_WORKERS):
+    """
+    Run a fetch function over a list of date ranges
+
+    With max_workers > 1 the ranges are fetched concurrently on a thread pool
+    (the Salesforce session's connection pool is shared between them).
+    Results are returned in the same order as ranges either way. Each fetch
+    runs in a copy of the caller's context, so its spans reach the caller's
+    profiling trace.
+
+    Parameters:
+    - fetch: Function called as fetch(*range) for each range
+    - ranges: List of argument tuples, e.g. (start_date, end_date)
+    - max_workers: Maximum number of fetches in flight at once
+
+    Returns:
+    - List of fetch results, in range order
+    """
+    if max_workers is None or max_workers <= 1 or len(ranges) <= 1:
+        return [fetch(*args) for args in ranges]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(ranges))) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, fetch, *args) for args in ranges]
+        return [future.result() for future in futures]
+
+def store_lock(store_dir):
+    """Return the lock that serializes syncs of a lead store within this process"""
+    with _store_locks_lock:
+        return _store_locks.setdefault(os.path.abspath(store_dir), threading.Lock())
+
+def sync_lead_store(sf, store_dir=lead_store.STORE_DIR, aggregate=False, max_workers=DEFAULT_FETCH_WORKERS):
+    """
+    Bring the local lead store up to date with Salesforce
+
+    Closed months are fetched once and then frozen. The open (current) month
+    is re-synced on every call, but only leads modified since the stored
+    SystemModstamp watermark are fetched and merged into it.
+
+    Every month records the location registry it was synced under
+    (locations.fingerprint). Once the registry changes (e.g. a new alias from
+    check_locations.py --refresh), months synced under the old one are
+    fetched again in full, frozen or not, so their leads are filtered and
+    normalized with the new registry.
+
+    With aggregate=True, months are stored as daily counts per location
+    computed by Salesforce. Counts can't be merged incrementally, so the open
+    month's counts are re-fetched in full, which is only a few hundred rows.
+
+    Months still to sync are fetched concurrently (see fetch_ranges) and then
+    written to the store in month order.
+
+    Returns:
+    - tuple: (number of months fetched, error message or None)
+    """
+    manifest = lead_store.load_manifest(store_dir)
+    open_month = pd.Timestamp.now().to_period('M')
+    registry = locations.fingerprint()
+
+    # Work out which months need fetching; closed months never change once synced,
+    # unless they were synced under another location registry
+    pending = []
+    resynced = []
+    for start_date, end_date in get_date_ranges():
+        key = start_date[:7]
+        entry = manifest['months'].get(key, {})
+        stale = bool(entry) and entry.get('locations') != registry
+        if stale:
+            resynced.append(key)
+        if stale or not entry.get('frozen'):
+            watermark = None if aggregate or stale else entry.get('watermark')
+            pending.append((start_date, end_date, watermark))
+    if resynced:
+        print(f"Location registry changed, fetching {len(resynced)} synced month(s) again")
+
+    def fetch(start_date, end_date, watermark):
+        if aggregate:
+            print(f"Fetching {start_date[:7]} counts")
+            return get_lead_counts_for_month(sf, start_date, end_date)
+        if watermark:
+            print(f"Syncing {start_date[:7]} changes since {watermark}")
+            return get_leads_for_month(sf, start_date, end_date, modified_since=watermark)
+        print(f"Fetching {start_date[:7]}")
+        return get_leads_for_month(sf, start_date, end_date)
+
+    with profiling.span('salesforce.fetch', months=len(pending), workers=max_workers):
+        results = fetch_ranges(fetch, pending, max_workers)
+
+    months_fetched = 0
+    with profiling.span('store.write', months=len(pending)):
+        for (start_date, end_date, watermark), changes in zip(pending, results):
+            month = pd.Period(start_date[:7], freq='M')
+            key = lead_store.month_key(month)
+
+            if changes is None:
+                return months_fetched, f"Failed to fetch leads for {key}"
+
+            if aggregate:
+                partition = lead_store.write_count_partition(store_dir, month, changes)
+                entry = {'kind': 'counts', 'leads': int(partition['Leads'].sum())}
+            else:
+                if watermark and not changes.empty:
+                    deleted = changes[changes['IsDeleted'] == True]
+                    changes = changes[changes['IsDeleted'] != True]
+                    partition = lead_store.upsert_partition(store_dir, month, changes, deleted['Id'])
+                elif watermark:
+                    partition = lead_store.read_partition(store_dir, month)
+                else:
+                    partition = lead_store.write_partition(store_dir, month, changes)
+                entry = {
+                    'kind': 'leads',
+                    'watermark': lead_store.get_watermark(partition) or watermark,
+                    'records': int(len(partition))
+                }
+
+            entry['frozen'] = bool(month < open_month)
+            entry['locations'] = registry
+            entry['synced_at'] = pd.Timestamp.now(tz='UTC').strftime('%Y-%m-%dT%H:%M:%SZ')
+            manifest['months'][key] = entry
+            # Save progress after every month so an interrupted sync resumes here
+            lead_store.save_manifest(manifest, store_dir)
+            months_fetched += 1
+
+    return months_fetched, None
+
+def get_salesforce_data(username, password, security_token, prediction_month=None, store_dir=None, aggregate=False,
+                        max_workers=DEFAULT_FETCH_WORKERS, sf=None):
+    """
+    Sync lead data from Salesforce into the local lead store
+
+    prediction_month is accepted for compatibility; the store is always synced
+    through the current month so every prediction month can be served from it.
+    With aggregate=True only daily counts per location are fetched (see
+    get_lead_counts_for_month) and kept in a separate counts store.
+    max_workers limits how many month queries run concurrently.
+    An already authenticated sf connection can be passed to skip logging in;
+    the credentials are then not used.
+
+    Returns:
+    - tuple: (lead store directory, error message or None)
+    """
     if sf is None:
-        return None, error
+        # Get Salesforce connection with a connection pool sized for the fetch workers
+        sf, error = get_salesforce_auth(username, password, security_token,
+                                        session=create_pooled_session(max_workers))
+        
+        if sf is None:
+            return None, error
     
-    # Initialize empty list to store all DataFrames
-    all_dfs = []
+    if store_dir is None:
+        store_dir = lead_store.COUNTS_STORE_DIR if aggregate else lead_store.STORE_DIR
     
-    # Query each month and combine results
-    for start_date, end_date in get_date_ranges(prediction_month):
-        query_results = get_leads_for_month(sf, start_date, end_date)
-        if not query_results.empty:
-            all_dfs.append(query_results)
+    # A job that waited for another job's sync finds little left to fetch
+    with profiling.span('salesforce.sync', aggregate=aggregate), store_lock(store_dir):
+        months_fetched, error = sync_lead_store(sf, store_dir, aggregate=aggregate, max_workers=max_workers)
+    if error:
+        return None, error
+    print(f"\nSynced {months_fetched} month(s) into {store_dir}")
     
-    if not all_dfs:
+    with profiling.span('store.read') as span:
+        result_df = lead_store.read_leads(store_dir)
+        span['rows'] = len(result_df)
+    if result_df.empty:
         print("No data retrieved from Salesforce")
         return None, "No data retrieved from Salesforce"
     
-    # Combine all DataFrames
-    df = pd.concat(all_dfs, ignore_index=True)
-    
-    # Remove the extra 'attributes' column if present
-    if 'attributes' in df.columns:
-        df = df.drop(columns='attributes')
-    
-    # Filter for only Leads (Future Prospect, Converted, Client Registration, TOF Waitlist)
-    df = df[df['Status'].isin(['Future Prospect', 'Converted', 'Client Registration', 'TOF Waitlist'])]
-    
-    # Group by date and location
-    df['day_created'] = pd.to_datetime(df['CreatedDate']).dt.date
-    
-    # Aggregate counts by date and location while preserving Id
-    result_df = df.groupby(['day_created', 'Media_Location_Text__c', 'Id'])['Leads'].sum().reset_index()
-    
     print("\nGrouped lead counts by location & date:")
     print(result_df)
     
-    # Save Results to CSV
-    output_file = "leads_by_location_date.csv"
-    result_df.to_csv(output_file, index=False)
-    print(f"\nSaved results to {output_file}")
-    
-    return output_file, None
\ No newline at end of file
+    return store_dir, None
@@ -0,0 +1,131 @@
+import json
+import os
+import sqlite3
+import time
+import pandas as pd
+
+# Default location of the precomputed forecast store written by batch_forecast.py
+RESULTS_DB = "forecast_store.db"
+
+# Stored forecasts older than this are ignored (the batch job is meant to run nightly)
+DEFAULT_MAX_AGE_HOURS = float(os.getenv('TERRECE_RESULTS_MAX_AGE_HOURS', '26'))
+
+# Bumped when the table layout changes; stores of another version are recreated
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS forecasts (
+    prediction_month TEXT NOT NULL,
+    engine TEXT NOT NULL,
+    location TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    as_of_month TEXT NOT NULL,
+    computed_at REAL NOT NULL,
+    results TEXT NOT NULL,
+    chart_data TEXT,
+    PRIMARY KEY (prediction_month, engine, location)
+)
+"""
+
+def connect(db_path=RESULTS_DB):
+    """Open the results store, creating its table if needed"""
+    connection = sqlite3.connect(db_path, timeout=30)
+    if connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        # Stored forecasts are a cache of the batch job, so an old layout is simply dropped
+        with connection:
+            connection.execute("DROP TABLE IF EXISTS forecasts")
+            connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    connection.execute(SCHEMA)
+    return connection
+
+def _row_records(rows):
+    """Result rows as dicts without the columns other locations' rows added"""
+    return [{column: value for column, value in row.items() if not pd.isna(value)}
+            for row in rows.to_dict('records')]
+
+def save_forecasts(results_df, prediction_month, engine, as_of_month, db_path=RESULTS_DB):
+    """
+    Store the unadjusted forecast results of one prediction month
+
+    Replaces everything stored for the month and engine in one transaction,
+    so readers see either the previous run or this one.
+
+    Parameters:
+    - results_df: Results of forecast_leads for all locations (adjustment 1.0)
+    - prediction_month: The month the results were forecast for
+    - engine: Model engine the results came from
+    - as_of_month: Current month when the forecast ran (decides actual vs predicted months)
+
+    Charts are not stored as images: the chart data the results carry (see
+    charts.attach_chart_data) is stored instead, so charts are drawn from the
+    adjusted numbers the app shows.
+    """
+    prediction_month = str(pd.Period(prediction_month, freq='M'))
+    as_of_month = str(pd.Period(as_of_month, freq='M'))
+    computed_at = time.time()
+    chart_context = results_df.attrs.get('charts')
+    entries = []
+    for position, (location, rows) in enumerate(results_df.groupby('Location', sort=False)):
+        chart_data = None
+        if chart_context and location in chart_context['history']:
+            chart_data = json.dumps(dict(chart_context, history=chart_context['history'][location]))
+        entries.append((prediction_month, engine, location, position, as_of_month, computed_at,
+                        json.dumps(_row_records(rows), default=int), chart_data))
+
+    connection = connect(db_path)
+    try:
+        with connection:
+            connection.execute("DELETE FROM forecasts WHERE prediction_month = ? AND engine = ?",
+                               (prediction_month, engine))
+            connection.executemany("INSERT INTO forecasts VALUES (?, ?, ?, ?, ?, ?, ?, ?)", entries)
+    finally:
+        connection.close()
+    return len(entries)
+
+def load_forecasts(prediction_month, engine, selected_location=None, as_of_month=None,
+                   max_age_hours=DEFAULT_MAX_AGE_HOURS, db_path=RESULTS_DB):
+    """
+    Look up stored forecasts for a prediction month
+
+    Entries computed in another month than as_of_month (default: the current
+    month) or more than max_age_hours ago don't count.
+
+    Returns:
+    - Unadjusted results DataFrame, with the chart data of the locations that
+      have it in its attrs (see charts.chart_specs), or None when the store has
+      nothing usable
+    """
+    if not os.path.exists(db_path):
+        return None
+    if as_of_month is None:
+        as_of_month = pd.Timestamp.now().to_period('M')
+    query = ("SELECT location, results, chart_data FROM forecasts "
+             "WHERE prediction_month = ? AND engine = ? AND as_of_month = ? AND computed_at >= ?")
+    parameters = [str(pd.Period(prediction_month, freq='M')), engine, str(pd.Period(as_of_month, freq='M')),
+                  time.time() - max_age_hours * 3600]
+    if selected_location and selected_location != 'All Locations':
+        query += " AND location = ?"
+        parameters.append(selected_location)
+
+    try:
+        connection = connect(db_path)
+        try:
+            entries = connection.execute(query + " ORDER BY position", parameters).fetchall()
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        print(f"Could not read stored forecasts: {str(e)}")
+        return None
+    if not entries:
+        return None
+
+    records = [record for _, results, _ in entries for record in json.loads(results)]
+    results_df = pd.DataFrame(records)
+    histories = {}
+    for location, _, chart_data in entries:
+        if chart_data:
+            chart_context = json.loads(chart_data)
+            histories[location] = chart_context.pop('history')
+    if histories:
+        results_df.attrs['charts'] = dict(chart_context, history=histories)
+    return results_df
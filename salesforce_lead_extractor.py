@@ -1,8 +1,54 @@
 from simple_salesforce import Salesforce
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import os
+import sys
+import json
+import shutil
+import argparse
+import threading
 import configparser
+import time
 from dotenv import load_dotenv
+from query import create_pooled_session, fetch_ranges
+import locations
+
+# Lead fields exported, in column order
+LEAD_FIELDS = [
+    'Id', 'LastName', 'FirstName', 'Name', 'Email', 'Phone', 'MobilePhone', 'Company', 'Status',
+    'CreatedDate', 'LeadSource', 'Media_Location_Text__c', 'Title', 'Street', 'City', 'State',
+    'PostalCode', 'Country', 'Industry', 'Rating', 'IsConverted', 'ConvertedDate',
+    'UTM_Source__c', 'UTM_Medium__c', 'UTM_Campaign__c', 'UTM_Content__c', 'UTM_Term__c',
+    'Client_Age__c', 'Child_DOB__c', 'Child_Name__c', 'Preferred_Location__c', 'Primary_Clinic__c',
+    'Lead_Source_Type__c', 'Lead_Origin__c', 'Referred_By__c', 'Insurance__c', 'Secondary_Insurance__c',
+    'Primary_Language__c', 'Interpreter_Needed__c', 'Preferred_Method_of_Contact__c'
+]
+
+# Column types of streamed exports (see normalize_page); fields not listed are strings
+LEAD_FIELD_TYPES = {
+    'CreatedDate': 'datetime',
+    'ConvertedDate': 'date',
+    'IsConverted': 'boolean'
+}
+
+# Output formats of export_leads, by file extension
+EXPORT_FORMATS = {'.csv': 'csv', '.parquet': 'parquet'}
+
+# Shard lengths of sharded extraction, as pandas date frequencies
+SHARD_FREQUENCIES = {'day': 'D', 'week': 'W-MON', 'month': 'MS'}
+
+# Shards fetched concurrently by default (override with --workers)
+DEFAULT_SHARD_WORKERS = int(os.getenv('TERRECE_EXTRACT_WORKERS', '4'))
+
+# Times a failing shard is fetched before the extraction gives up on it
+SHARD_ATTEMPTS = int(os.getenv('TERRECE_EXTRACT_ATTEMPTS', '3'))
+
+# First day exported in non-interactive mode when --start is not given
+DEFAULT_START_DATE = '2023-01-01'
+
+# Checkpoint of finished shards, kept in the shard directory
+SHARD_MANIFEST = 'manifest.json'
 
 def get_credentials_from_ini():
     """
@@ -36,14 +82,15 @@ def get_credentials_from_ini():
     
     return None, None, None
 
-def get_salesforce_auth(username, password, security_token):
+def get_salesforce_auth(username, password, security_token, session=None):
     """Authenticate to Salesforce with provided credentials"""
     try:
         sf = Salesforce(
             username=username,
             password=password,
             security_token=security_token,
-            domain='login'
+            domain='login',
+            session=session
         )
         print(f"Authenticated as user: {sf.user_id}")
         return sf, None
@@ -52,63 +99,21 @@ def get_salesforce_auth(username, password, security_token):
         print(f"Authentication error: {error_message}")
         return None, error_message
 
-def get_valid_locations():
-    """Return the list of valid locations for filtering"""
-    return [
-        'Ankeny',
-        'Bettendorf',
-        'Boise',
-        'Chesterfield',
-        'Chicago',
-        'Coeur d\'Alene',
-        'Crystal Lake',
-        'De Pere',
-        'Eau Claire',
-        'Elgin',
-        'Geneva',
-        'Iowa City',
-        'Janesville',
-        'LaCrosse',
-        'Lake Geneva',
-        'Mequon',
-        'Meridian',
-        'Nampa',
-        'Oakville',
-        'Pewaukee',
-        'Rolling Meadows',
-        'St. Cloud',
-        'Urbandale',
-        'Warrenville',
-        'Weldon Spring',
-        'West Madison'
-    ]
-
-def get_leads(sf, start_date=None, end_date=None, limit=None):
+def build_leads_query(start_date=None, end_date=None, limit=None, inclusive_end=True):
     """
-    Get individual lead records from Salesforce
-    
-    Parameters:
-    - sf: Salesforce connection object
-    - start_date: Optional start date for filtering (format: YYYY-MM-DDT00:00:00Z)
-    - end_date: Optional end date for filtering (format: YYYY-MM-DDT00:00:00Z)
-    - limit: Optional limit on number of records to return
-    
-    Returns:
-    - List of lead records
+    Build the SOQL query for individual lead records (see get_leads for the parameters)
+
+    With inclusive_end=False leads created exactly at end_date are left out,
+    so consecutive ranges sharing a boundary do not overlap.
     """
-    valid_locations = get_valid_locations()
-    # Escape single quotes in location names
-    escaped_locations = [loc.replace("'", "\\'") for loc in valid_locations]
-    location_filter = "', '".join(escaped_locations)
-    
     # Build WHERE clause based on provided parameters
-    where_clauses = [f"Media_Location_Text__c IN ('{location_filter}')"]
+    where_clauses = [f"Media_Location_Text__c IN ('{locations.location_filter()}')"]
     
     if start_date:
         where_clauses.append(f"CreatedDate >= {start_date}")
     
     if end_date:
-        where_clauses.append(f"CreatedDate <= {end_date}")
+        where_clauses.append(f"CreatedDate {'<=' if inclusive_end else '<'} {end_date}")
     
     where_clause = " AND ".join(where_clauses)
     
@@ -116,53 +121,32 @@ def get_leads(sf, start_date=None, end_date=None, limit=None):
     limit_clause = f" LIMIT {limit}" if limit else ""
     
     # Query for individual leads with important fields
-    query = f"""
+    fields = ",\n        ".join(LEAD_FIELDS)
+    return f"""
     SELECT 
-        Id,
-        LastName,
-        FirstName,
-        Name,
-        Email,
-        Phone,
-        MobilePhone,
-        Company,
-        Status,
-        CreatedDate,
-        LeadSource,
-        Media_Location_Text__c,
-        Title,
-        Street,
-        City,
-        State,
-        PostalCode,
-        Country,
-        Industry,
-        Rating,
-        IsConverted,
-        ConvertedDate,
-        UTM_Source__c,
-        UTM_Medium__c, 
-        UTM_Campaign__c,
-        UTM_Content__c,
-        UTM_Term__c,
-        Client_Age__c,
-        Child_DOB__c,
-        Child_Name__c,
-        Preferred_Location__c,
-        Primary_Clinic__c,
-        Lead_Source_Type__c,
-        Lead_Origin__c,
-        Referred_By__c,
-        Insurance__c,
-        Secondary_Insurance__c,
-        Primary_Language__c,
-        Interpreter_Needed__c,
-        Preferred_Method_of_Contact__c
+        {fields}
     FROM Lead
     WHERE {where_clause}
     ORDER BY CreatedDate ASC
     {limit_clause}
     """
+
+def get_leads(sf, start_date=None, end_date=None, limit=None):
+    """
+    Get individual lead records from Salesforce
+    
+    Holds every record in memory; export_leads streams them to a file instead.
+    
+    Parameters:
+    - sf: Salesforce connection object
+    - start_date: Optional start date for filtering (format: YYYY-MM-DDT00:00:00Z)
+    - end_date: Optional end date for filtering (format: YYYY-MM-DDT00:00:00Z)
+    - limit: Optional limit on number of records to return
+    
+    Returns:
+    - List of lead records
+    """
+    query = build_leads_query(start_date, end_date, limit)
     
     try:
         result = sf.query_all(query)
@@ -195,8 +179,314 @@ def clean_salesforce_records(records):
     
     return cleaned_records
 
-def main():
-    """Main function to execute when run as a script"""
+def iter_lead_pages(sf, query):
+    """
+    Run a query and yield its result pages one at a time
+
+    Each page is fetched only when the previous one has been consumed, so
+    at most one page of records is held in memory.
+
+    Yields:
+    - tuple: (list of raw records on the page, total number of records of the query)
+    """
+    result = sf.query(query)
+    yield result['records'], result['totalSize']
+    while not result['done']:
+        result = sf.query_more(result['nextRecordsUrl'], identifier_is_url=True)
+        yield result['records'], result['totalSize']
+
+def normalize_page(records):
+    """
+    Turn a page of raw lead records into a DataFrame with the export columns and types
+
+    Every page gets the same columns (LEAD_FIELDS) and dtypes (LEAD_FIELD_TYPES,
+    strings otherwise), so pages written one after another form one
+    consistent file even when a page has a field empty throughout.
+    """
+    df = pd.DataFrame.from_records(clean_salesforce_records(records), columns=LEAD_FIELDS)
+    for field in LEAD_FIELDS:
+        field_type = LEAD_FIELD_TYPES.get(field, 'string')
+        if field_type == 'datetime':
+            df[field] = pd.to_datetime(df[field], utc=True, format='ISO8601')
+        elif field_type == 'date':
+            df[field] = pd.to_datetime(df[field], format='ISO8601')
+        elif field_type == 'boolean':
+            df[field] = df[field].astype('boolean')
+        else:
+            df[field] = df[field].astype('string')
+    return df
+
+def export_leads(sf, output_file, start_date=None, end_date=None, limit=None, progress=None,
+                 inclusive_end=True):
+    """
+    Stream lead records from Salesforce into a CSV or Parquet file page by page
+
+    Pages are fetched, normalized (see normalize_page) and appended to the file
+    one at a time, so memory use is bounded by the query page size rather than
+    by the number of leads. The file is written under a temporary name and
+    only appears once the export is complete.
+
+    Parameters:
+    - output_file: Path ending in .csv or .parquet
+    - start_date, end_date, limit: As for get_leads
+    - inclusive_end: As for build_leads_query
+    - progress: Called after each page with (pages written, records written,
+      total records); defaults to printing a progress line
+
+    Returns:
+    - tuple: (number of records written, error message or None)
+    """
+    export_format = EXPORT_FORMATS.get(os.path.splitext(output_file)[1].lower())
+    if export_format is None:
+        return 0, f"Unsupported output format for {output_file} (use .csv or .parquet)"
+    if progress is None:
+        def progress(pages, written, total):
+            print(f"Page {pages}: {written} of {total} leads written")
+
+    tmp_file = f"{output_file}.{os.getpid()}.tmp"
+    written = 0
+    pages = 0
+    writer = None
+    try:
+        for records, total in iter_lead_pages(sf, build_leads_query(start_date, end_date, limit, inclusive_end)):
+            df = normalize_page(records)
+            if export_format == 'parquet':
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_file, table.schema)
+                writer.write_table(table)
+            else:
+                df.to_csv(tmp_file, mode='w' if pages == 0 else 'a', header=pages == 0, index=False)
+            pages += 1
+            written += len(df)
+            progress(pages, written, total)
+        if writer is not None:
+            writer.close()
+            writer = None
+        os.replace(tmp_file, output_file)
+        return written, None
+    except Exception as e:
+        print(f"Export error: {str(e)}")
+        return written, str(e)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+def shard_ranges(start_date, end_date, shard='week'):
+    """
+    Split the date range [start_date, end_date) into consecutive shards
+
+    Day shards are calendar days, week shards start on Mondays and month
+    shards on the first of the month; the first and last shard are cut
+    short to fit the range.
+
+    Returns:
+    - List of (start, end) Salesforce datetime strings, end exclusive
+    """
+    start = pd.Timestamp(start_date).normalize()
+    end = pd.Timestamp(end_date).normalize()
+    if start >= end:
+        return []
+    boundaries = pd.date_range(start, end, freq=SHARD_FREQUENCIES[shard])
+    edges = [start] + [b for b in boundaries if start < b < end] + [end]
+    return [
+        (a.strftime('%Y-%m-%dT%H:%M:%SZ'), b.strftime('%Y-%m-%dT%H:%M:%SZ'))
+        for a, b in zip(edges[:-1], edges[1:])
+    ]
+
+def shard_file_name(start):
+    """Name of the file holding the shard that starts at start"""
+    return f"{start[:10]}.parquet"
+
+def load_checkpoint(shard_dir, settings, restart=False):
+    """
+    Read the checkpoint manifest of a sharded extraction
+
+    A checkpoint written for different settings (date range, shard length,
+    fields or locations) does not describe the shards on disk for this run.
+    Its finished shards are never thrown away silently: the checkpoint is
+    refused with an error. restart=True clears any checkpoint and starts over.
+
+    Returns:
+    - tuple: ({'settings': settings, 'shards': {file name: {start, end, records}}},
+      error message or None)
+    """
+    path = os.path.join(shard_dir, SHARD_MANIFEST)
+    if restart and os.path.exists(shard_dir):
+        print(f"Discarding the checkpoint in {shard_dir}, starting over")
+        shutil.rmtree(shard_dir)
+    elif os.path.exists(path):
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+            if manifest.get('settings') == settings:
+                return manifest, None
+            problem = "was written for a different extraction (date range, shard length, fields or locations)"
+        except (OSError, ValueError) as e:
+            problem = f"is unreadable ({str(e)})"
+        return None, (f"The checkpoint in {shard_dir} {problem}; rerun with the original options to resume, "
+                      f"or with --restart to discard its shards and start over")
+    return {'settings': settings, 'shards': {}}, None
+
+def checkpoint_end_date(output_file):
+    """End date saved in the checkpoint of an unfinished extraction into output_file, or None"""
+    try:
+        with open(os.path.join(f"{output_file}.shards", SHARD_MANIFEST)) as f:
+            return json.load(f).get('end_date')
+    except (OSError, ValueError):
+        return None
+
+def save_checkpoint(shard_dir, manifest):
+    """Write the checkpoint manifest, replacing the previous one atomically"""
+    path = os.path.join(shard_dir, SHARD_MANIFEST)
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_file, path)
+
+def merge_shards(shard_files, output_file):
+    """
+    Concatenate shard files, in order, into one CSV or Parquet file
+
+    Shards cover consecutive date ranges, so sorting each one by CreatedDate
+    (and Id, for leads created in the same second) sorts the whole output
+    without ever holding more than one shard in memory. The file is written
+    under a temporary name and only appears once complete.
+
+    Returns:
+    - int: Number of records written
+    """
+    export_format = EXPORT_FORMATS[os.path.splitext(output_file)[1].lower()]
+    tmp_file = f"{output_file}.{os.getpid()}.tmp"
+    written = 0
+    writer = None
+    try:
+        for position, shard_file in enumerate(shard_files):
+            table = pq.read_table(shard_file).sort_by([('CreatedDate', 'ascending'), ('Id', 'ascending')])
+            if export_format == 'parquet':
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_file, table.schema)
+                writer.write_table(table)
+            else:
+                table.to_pandas().to_csv(tmp_file, mode='w' if position == 0 else 'a',
+                                         header=position == 0, index=False)
+            written += table.num_rows
+        if writer is not None:
+            writer.close()
+            writer = None
+        os.replace(tmp_file, output_file)
+        return written
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+def extract_leads_sharded(sf, output_file, start_date, end_date, shard='week',
+                          max_workers=DEFAULT_SHARD_WORKERS, restart=False):
+    """
+    Export the leads created in [start_date, end_date) as date shards fetched concurrently
+
+    Each shard is streamed into its own Parquet file (see export_leads) in the
+    {output_file}.shards directory and recorded in the checkpoint manifest
+    there once complete. Rerunning the same extraction skips the recorded
+    shards, so an interrupted run resumes where it stopped. A checkpoint for
+    other settings is refused; restart=True discards it (see load_checkpoint). The
+    manifest also keeps end_date, so a rerun can resume without repeating it
+    (see checkpoint_end_date). When every shard
+    is done they are merged into output_file (see merge_shards) and the shard
+    directory is removed.
+
+    Parameters:
+    - sf: Salesforce connection; give it a pooled session (see
+      query.create_pooled_session) large enough for max_workers
+    - output_file: Path ending in .csv or .parquet
+    - start_date, end_date: Range of creation dates, end exclusive (YYYY-MM-DD)
+    - shard: Shard length, a key of SHARD_FREQUENCIES
+    - max_workers: Maximum number of shards fetched at once
+    - restart: Discard any checkpoint and fetch every shard again
+
+    Returns:
+    - tuple: (number of records written, error message or None)
+    """
+    if os.path.splitext(output_file)[1].lower() not in EXPORT_FORMATS:
+        return 0, f"Unsupported output format for {output_file} (use .csv or .parquet)"
+    if shard not in SHARD_FREQUENCIES:
+        return 0, f"Unknown shard length {shard} (use {', '.join(SHARD_FREQUENCIES)})"
+    try:
+        ranges = shard_ranges(start_date, end_date, shard)
+    except ValueError as e:
+        return 0, f"Invalid date range: {str(e)}"
+    if not ranges:
+        return 0, f"Empty date range {start_date} to {end_date}"
+
+    shard_dir = f"{output_file}.shards"
+    settings = {
+        'query': build_leads_query(ranges[0][0], ranges[-1][1], inclusive_end=False),
+        'shard': shard
+    }
+    manifest, error = load_checkpoint(shard_dir, settings, restart)
+    if error:
+        return 0, error
+    manifest['end_date'] = end_date
+    os.makedirs(shard_dir, exist_ok=True)
+    save_checkpoint(shard_dir, manifest)
+    manifest_lock = threading.Lock()
+
+    pending = [r for r in ranges if shard_file_name(r[0]) not in manifest['shards']]
+    print(f"{len(ranges) - len(pending)} of {len(ranges)} shards already extracted, "
+          f"fetching {len(pending)} with up to {max_workers} workers")
+
+    def fetch_shard(start, end):
+        name = shard_file_name(start)
+        for attempt in range(1, SHARD_ATTEMPTS + 1):
+            records, error = export_leads(sf, os.path.join(shard_dir, name), start, end,
+                                          progress=lambda *args: None, inclusive_end=False)
+            if error is None:
+                break
+            print(f"Shard {start[:10]} failed (attempt {attempt} of {SHARD_ATTEMPTS}): {error}")
+        else:
+            return error
+        with manifest_lock:
+            manifest['shards'][name] = {'start': start, 'end': end, 'records': records}
+            save_checkpoint(shard_dir, manifest)
+            print(f"Shard {start[:10]}: {records} leads "
+                  f"({len(manifest['shards'])} of {len(ranges)} shards done)")
+        return None
+
+    errors = [e for e in fetch_ranges(fetch_shard, pending, max_workers) if e]
+    if errors:
+        extracted = sum(s['records'] for s in manifest['shards'].values())
+        return extracted, (f"{len(errors)} of {len(ranges)} shards failed (first error: {errors[0]}); "
+                           f"rerun the same command to resume from {shard_dir}")
+
+    try:
+        written = merge_shards([os.path.join(shard_dir, shard_file_name(s)) for s, _ in ranges], output_file)
+    except Exception as e:
+        print(f"Merge error: {str(e)}")
+        return 0, f"Could not merge shards from {shard_dir}: {str(e)}"
+    shutil.rmtree(shard_dir)
+    return written, None
+
+def preview_export(output_file, rows=5):
+    """Read the first rows of an exported CSV or Parquet file"""
+    if output_file.lower().endswith('.parquet'):
+        batch = next(pq.ParquetFile(output_file).iter_batches(batch_size=rows), None)
+        return batch.to_pandas() if batch is not None else pd.DataFrame(columns=LEAD_FIELDS)
+    return pd.read_csv(output_file, nrows=rows)
+
+def load_credentials(prompt=True):
+    """
+    Find Salesforce credentials in credentials.ini, then the environment (.env)
+
+    Parameters:
+    - prompt: Ask for the credentials on the terminal if neither has them
+
+    Returns:
+    - tuple: (username, password, security_token), None for any not found
+    """
     # First try to get credentials from credentials.ini
     username, password, security_token = get_credentials_from_ini()
     
@@ -210,12 +500,69 @@ def main():
         security_token = os.getenv('SF_SECURITY_TOKEN')
         
         # If still not found, prompt user
-        if not all([username, password, security_token]):
+        if not all([username, password, security_token]) and prompt:
             print("Salesforce credentials not found in credentials.ini or environment variables.")
             username = input("Enter Salesforce username: ")
             password = input("Enter Salesforce password: ")
             security_token = input("Enter Salesforce security token: ")
     
+    return username, password, security_token
+
+def run_sharded(args):
+    """Run a non-interactive sharded extraction from parsed command line arguments"""
+    username, password, security_token = load_credentials(prompt=False)
+    if not all([username, password, security_token]):
+        print("Salesforce credentials not found in credentials.ini or environment variables")
+        return 1
+    
+    sf, error = get_salesforce_auth(username, password, security_token,
+                                    session=create_pooled_session(args.workers))
+    if error:
+        print(f"Error authenticating with Salesforce: {error}")
+        return 1
+    
+    end_date = args.end
+    if end_date is None and not args.restart:
+        # Resume an unfinished extraction up to the end it started with, not a new "tomorrow"
+        end_date = checkpoint_end_date(args.output)
+        if end_date:
+            print(f"Resuming the unfinished extraction into {args.output}")
+    if end_date is None:
+        end_date = (pd.Timestamp.now().normalize() + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+    print(f"Extracting leads created from {args.start} up to {end_date} in {args.shard} shards...")
+    started = time.perf_counter()
+    written, error = extract_leads_sharded(sf, args.output, args.start, end_date, args.shard, args.workers,
+                                           restart=args.restart)
+    if error:
+        print(f"Error exporting leads: {error}")
+        return 1
+    
+    print(f"Saved {written} lead records to {args.output} in {time.perf_counter() - started:.1f}s")
+    return 0
+
+def main():
+    """Main function to execute when run as a script"""
+    parser = argparse.ArgumentParser(
+        description="Export Salesforce leads. Without --output the options are asked for interactively."
+    )
+    parser.add_argument('--output', help="Output file (.csv or .parquet); runs a non-interactive, "
+                                         "resumable sharded extraction")
+    parser.add_argument('--start', default=DEFAULT_START_DATE,
+                        help=f"First creation day to export, YYYY-MM-DD (default: {DEFAULT_START_DATE})")
+    parser.add_argument('--end', help="Creation day to stop before, YYYY-MM-DD (default: tomorrow, or the end "
+                                      "an unfinished extraction into --output started with)")
+    parser.add_argument('--shard', choices=list(SHARD_FREQUENCIES), default='week',
+                        help="Length of the date shards (default: week)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_SHARD_WORKERS,
+                        help=f"Shards fetched at once (default: {DEFAULT_SHARD_WORKERS})")
+    parser.add_argument('--restart', action='store_true',
+                        help="Discard the checkpoint of an unfinished extraction into --output and start over")
+    args = parser.parse_args()
+    if args.output:
+        return run_sharded(args)
+    
+    username, password, security_token = load_credentials()
+    
     # Authenticate with Salesforce
     sf, error = get_salesforce_auth(username, password, security_token)
     
@@ -249,42 +596,36 @@ def main():
     limit_str = input("Enter maximum number of records to retrieve (leave blank for all): ")
     limit = int(limit_str) if limit_str.strip() else None
     
-    # Get the leads
-    print(f"Retrieving leads from Salesforce...")
-    leads = get_leads(sf, start_date, end_date, limit)
-    
-    if not leads:
-        print("No leads found or error occurred.")
-        return
-    
-    # Clean the records
-    cleaned_leads = clean_salesforce_records(leads)
-    
-    # Convert to DataFrame
-    df = pd.DataFrame(cleaned_leads)
-    
-    # Display some information about the data
-    print(f"\nRetrieved a total of {len(df)} individual leads")
-    if not df.empty:
-        print("\nColumns in the dataset:")
-        print(df.columns.tolist())
-        
-        print("\nSample of the data (first 5 rows):")
-        print(df.head(5))
-    
     # Ask for output filename
     default_filename = "salesforce_leads.csv"
-    output_file = input(f"Enter output filename (default: {default_filename}): ")
+    output_file = input(f"Enter output filename, .csv or .parquet (default: {default_filename}): ")
     if not output_file:
         output_file = default_filename
     
-    # Ensure it has .csv extension
-    if not output_file.endswith('.csv'):
+    # Ensure it has a supported extension
+    if os.path.splitext(output_file)[1].lower() not in EXPORT_FORMATS:
         output_file += '.csv'
     
-    # Save Results to CSV
-    df.to_csv(output_file, index=False)
-    print(f"\nSaved {len(df)} lead records to {output_file}")
+    # Stream the leads into the file page by page
+    print(f"Retrieving leads from Salesforce...")
+    started = time.perf_counter()
+    written, error = export_leads(sf, output_file, start_date, end_date, limit)
+    
+    if error:
+        print(f"Error exporting leads: {error}")
+        return
+    if not written:
+        print("No leads found matching the criteria")
+        return
+    
+    # Display some information about the data
+    print(f"\nSaved {written} lead records to {output_file} in {time.perf_counter() - started:.1f}s")
+    sample = preview_export(output_file)
+    print("\nColumns in the dataset:")
+    print(sample.columns.tolist())
+    
+    print("\nSample of the data (first 5 rows):")
+    print(sample)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    sys.exit(main()) 
\ No newline at end of file
@@ -7,6 +7,7 @@ import subprocess
 import sys
 import os
 import argparse
+import importlib.util
 
 # Import version info
 try:
@@ -19,21 +20,23 @@ except ImportError:
         "build_time": "unknown"
     }
 
+# Packages the app needs, checked by name before the Streamlit process starts
+REQUIRED_PACKAGES = ['streamlit', 'pandas', 'numpy', 'matplotlib', 'statsmodels', 'simple_salesforce']
+
 def check_requirements():
-    """Check if all required packages are installed"""
-    try:
-        import streamlit
-        import pandas
-        import numpy
-        import matplotlib
-        import statsmodels
-        import simple_salesforce
-        print("✅ All required packages are available")
-        return True
-    except ImportError as e:
-        print(f"❌ Missing required package: {e}")
+    """
+    Check if all required packages are installed
+
+    Only the import system's metadata is consulted (importlib.util.find_spec),
+    nothing is imported: the Streamlit process imports what it needs itself.
+    """
+    missing = [name for name in REQUIRED_PACKAGES if importlib.util.find_spec(name) is None]
+    if missing:
+        print(f"❌ Missing required package: {', '.join(missing)}")
         print("Please install requirements with: pip install -r requirements.txt")
         return False
+    print("✅ All required packages are available")
+    return True
 
 def start_streamlit_app(port=8503, host="0.0.0.0"):
     """Start the Streamlit application"""
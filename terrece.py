@@ -1,64 +1,223 @@
 import streamlit as st
 import pandas as pd
-from query import get_salesforce_data
-from forecast import forecast_leads
+from query import DEFAULT_FETCH_WORKERS, create_pooled_session, get_salesforce_auth, get_salesforce_data
+from forecast import ENGINES, FALLBACK_ENGINE, adjustment_sweep, apply_adjustment, get_process_pool, forecast_leads, forecast_monthly_data, load_lead_data, load_monthly_data
+from batch_forecast import prediction_months
+import results_store
 import zipfile
 import os
 from datetime import datetime
 import io
 import configparser
+import hashlib
+import json
 import os.path
+import threading
+import time
+import profiling
+import jobs
+import workspace
+import charts
+import locations
+import metrics
 
-def create_download_zip(forecast_results, visuals_dir):
-    """Create a ZIP file containing forecast results and visualizations"""
-    with io.BytesIO() as zip_buffer:
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+# How long a Salesforce login and the synced lead data are reused across reruns
+SESSION_TTL_MINUTES = float(os.getenv('TERRECE_SESSION_TTL_MINUTES', '90'))
+DATA_TTL_MINUTES = float(os.getenv('TERRECE_DATA_TTL_MINUTES', '60'))
+
+# How often a running forecast job's progress is refreshed on the page
+JOB_POLL_SECONDS = 1
+
+# Adjustment factors offered in the side-by-side comparison of results
+SWEEP_FACTORS = [0.5, 0.6, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95, 1.0]
+DEFAULT_SWEEP_FACTORS = [0.8, 0.9, 1.0]
+
+@st.cache_resource(ttl=SESSION_TTL_MINUTES * 60, show_spinner=False)
+def get_salesforce_session(username, password, security_token):
+    """Log in to Salesforce once per set of credentials and share the connection across reruns"""
+    sf, error = get_salesforce_auth(username, password, security_token,
+                                    session=create_pooled_session(DEFAULT_FETCH_WORKERS))
+    if sf is None:
+        # Raising keeps failed logins out of the cache
+        raise ConnectionError(error)
+    return sf
+
+@st.cache_data(ttl=DATA_TTL_MINUTES * 60, show_spinner=False)
+def fetch_lead_data(username, aggregate, refresh_token, _sf):
+    """
+    Sync the lead store and load its monthly totals, cached per user
+
+    refresh_token is only part of the cache key; bumping it forces a new sync.
+
+    Returns:
+    - tuple: (lead store directory, monthly data, time of the sync)
+    """
+    output_file, error = get_salesforce_data(username, None, None, aggregate=aggregate, sf=_sf)
+    if error:
+        raise RuntimeError(error)
+    return output_file, load_monthly_data(output_file), time.time()
+
+def get_lead_data(username, password, security_token, aggregate, refresh_token=0):
+    """
+    Lead data for the current user, from the cache while it is fresh
+
+    Safe to call from a background job (it does not touch session state).
+
+    Returns:
+    - tuple: ((lead store directory, monthly data, time of the sync), error message or None)
+    """
+    error = None
+    for attempt in range(2):
+        try:
+            sf = get_salesforce_session(username, password, security_token)
+        except ConnectionError as e:
+            return None, str(e)
+        try:
+            lead_data = fetch_lead_data(username, aggregate, refresh_token, _sf=sf)
+        except RuntimeError as e:
+            # The cached session may have expired on the Salesforce side; log in again once
+            get_salesforce_session.clear(username, password, security_token)
+            error = str(e)
+            continue
+        return lead_data, None
+    return None, error
+
+def show_data_status(username):
+    """Sidebar note on how old the cached lead data is, with a button to refetch it"""
+    if st.sidebar.button("Refresh data", help="Fetch lead data from Salesforce again on the next forecast"):
+        st.session_state['refresh_token'] = st.session_state.get('refresh_token', 0) + 1
+        st.session_state.pop('lead_data_status', None)
+        st.sidebar.info("Lead data will be refetched on the next forecast")
+    
+    status = st.session_state.get('lead_data_status')
+    if status and status[0] == username:
+        age_minutes = (time.time() - status[1]) / 60
+        message = f"Lead data synced {age_minutes:.0f} min ago (kept for {DATA_TTL_MINUTES:.0f} min)"
+        if age_minutes > DATA_TTL_MINUTES / 2:
+            st.sidebar.warning(message)
+        else:
+            st.sidebar.caption(message)
+
+def is_future_month(selected_date):
+    """Whether a YYYY-MM month is after the current month"""
+    return pd.Period(selected_date, freq='M') > pd.Timestamp.now().to_period('M')
+
+def load_stored_forecast(selected_date, selected_location, engine):
+    """
+    Serve a forecast from the nightly results store, if it has a fresh one
+
+    The results carry their chart data, so their charts are drawn (or taken
+    from the chart cache) like those of live results.
+
+    Returns:
+    - Unadjusted results DataFrame, or None when the forecast must be computed live
+    """
+    results = results_store.load_forecasts(selected_date, engine, selected_location)
+    metrics.inc('terrece_cache_requests_total', cache='results', location=selected_location,
+                result='miss' if results is None else 'hit')
+    return results
+
+def download_zip_path(forecast_results, download_dir):
+    """Path of the download ZIP of a result set, named by a hash of the results and their charts"""
+    digest = hashlib.sha256(pd.util.hash_pandas_object(forecast_results, index=False).values.tobytes())
+    digest.update(json.dumps([list(forecast_results.columns), forecast_results.attrs.get('charts')],
+                             sort_keys=True).encode('utf-8'))
+    return os.path.join(download_dir, f"terrece_analysis_{digest.hexdigest()[:16]}.zip")
+
+def create_download_zip(forecast_results, download_dir, pool=None):
+    """
+    Create a ZIP file containing forecast results and visualizations
+
+    The archive is streamed to a file in download_dir one member at a time
+    and reused while the same result set is shown. The PNG charts are
+    already compressed, so they are stored rather than deflated again.
+    Charts come from the chart cache (drawn in pool if missing, see charts.py).
+
+    Returns:
+    - Path of the ZIP file
+    """
+    zip_path = download_zip_path(forecast_results, download_dir)
+    if os.path.exists(zip_path):
+        return zip_path
+    
+    images = charts.chart_images(charts.chart_specs(forecast_results), pool=pool)
+    os.makedirs(download_dir, exist_ok=True)
+    tmp_path = f"{zip_path}.{threading.get_ident()}.tmp"
+    with profiling.span('zip', locations=forecast_results['Location'].nunique()):
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
             # Add forecast results CSV
-            results_csv = forecast_results.to_csv(index=False)
-            zip_file.writestr('forecast_results.csv', results_csv)
+            with io.TextIOWrapper(zip_file.open('forecast_results.csv', 'w'), encoding='utf-8', newline='') as csv_file:
+                forecast_results.to_csv(csv_file, index=False)
             
             # Add visualizations only for the locations in forecast_results
-            for location in forecast_results['Location'].unique():
-                image_path = f"{visuals_dir}/{location}_forecast.png"
-                if os.path.exists(image_path):
-                    zip_file.write(image_path, os.path.basename(image_path))
-        
-        return zip_buffer.getvalue()
+            for location, image in images.items():
+                zip_file.writestr(f"{location}_forecast.png", image, compress_type=zipfile.ZIP_STORED)
+        # Readers only ever see a complete archive
+        os.replace(tmp_path, zip_path)
+    return zip_path
 
-def generate_chain_forecast(output_file, selected_date, selected_location, adjustment_factor: float = 1.0):
-    """Generate forecasts for future months by creating a chain of predictions"""
+def generate_chain_forecast(output_file, selected_date, selected_location, adjustment_factor: float = 1.0, workers=1,
+                            method='direct', monthly_data=None, engine='statsmodels', progress=None, ui=st,
+                            output_dir="forecast_results"):
+    """
+    Generate forecasts for future months
+
+    method='direct' fits each location once and forecasts every month from
+    the current month through the selected month in one multi-step forecast.
+    method='recursive' creates a chain of one-month predictions, feeding each
+    predicted month back in as data for the next.
+
+    monthly_data is the prepared monthly frame of output_file, if the caller
+    has already loaded it. engine selects the model fitting engine (see
+    forecast_leads). progress is called as each location of the selected
+    month finishes (see forecast.run_forecast_tasks), and progress messages
+    go to ui (anything with Streamlit's write/info/warning/error/success).
+    The results file is written to output_dir; charts are drawn separately
+    from the results (see charts.py).
+    """
+    if monthly_data is None:
+        monthly_data = load_monthly_data(output_file)
+    
     # Convert selected date to datetime
     target_date = pd.to_datetime(selected_date)
     current_date = pd.Timestamp.now()
     
     # If target date is current month or past, just do a regular forecast
     if target_date.year < current_date.year or (target_date.year == current_date.year and target_date.month <= current_date.month):
-        return forecast_leads(output_file, selected_date, selected_location, adjustment_factor=adjustment_factor)
+        return forecast_leads(output_file, selected_date, selected_location, adjustment_factor=adjustment_factor, workers=workers,
+                              monthly_data=monthly_data, engine=engine, progress=progress,
+                              output_dir=output_dir)
+    
+    if method == 'direct':
+        ui.info(f"Forecasting {current_date.strftime('%B %Y')} through {target_date.strftime('%B %Y')} from a single fit per location")
+        return forecast_leads(output_file, selected_date, selected_location, adjustment_factor=adjustment_factor, workers=workers,
+                              forecast_start=pd.Period(current_date, freq='M'), monthly_data=monthly_data,
+                              engine=engine, progress=progress,
+                              output_dir=output_dir)
     
     # We need to forecast intermediate months
-    st.info(f"Generating predicted intermediary forecasts from {current_date.strftime('%B %Y')} to {target_date.strftime('%B %Y')}")
+    ui.info(f"Generating predicted intermediary forecasts from {current_date.strftime('%B %Y')} to {target_date.strftime('%B %Y')}")
     
     # Start with current month's data
-    current_month = pd.Period(current_date, freq='ME')
+    current_month = pd.Period(current_date, freq='M')
     
-    # Create a temporary dataframe to store our data
-    temp_df = pd.read_csv(output_file)
+    # Monthly totals per location; predictions are fed back in memory
+    monthly_df = monthly_data
     
     # Add debug information about initial data
-    st.write(f"Initial data contains {len(temp_df)} records")
-    if 'Bettendorf' in temp_df['Media_Location_Text__c'].values:
-        bettendorf_data = temp_df[temp_df['Media_Location_Text__c'] == 'Bettendorf']
-        st.write(f"Initial Bettendorf data: {len(bettendorf_data)} records")
+    ui.write(f"Initial data contains {len(monthly_df)} location-months")
+    if 'Bettendorf' in monthly_df['Media_Location_Text__c'].values:
+        bettendorf_data = monthly_df[monthly_df['Media_Location_Text__c'] == 'Bettendorf']
+        ui.write(f"Initial Bettendorf data: {len(bettendorf_data)} months")
         if not bettendorf_data.empty:
-            latest_date = pd.to_datetime(bettendorf_data['day_created']).max()
-            st.write(f"Latest Bettendorf data date: {latest_date.strftime('%Y-%m-%d')}")
+            ui.write(f"Latest Bettendorf data month: {bettendorf_data['month'].max().strftime('%Y-%m')}")
     
     # Generate forecasts for each month between current and target
     months_to_forecast = []
     month_iter = current_month
-    target_month = pd.Period(target_date, freq='ME')
+    target_month = pd.Period(target_date, freq='M')
     
-    st.write(f"Will forecast from {current_month} to {target_month}")
+    ui.write(f"Will forecast from {current_month} to {target_month}")
     
     while month_iter <= target_month:
         months_to_forecast.append(month_iter)
@@ -67,88 +226,332 @@ def generate_chain_forecast(output_file, selected_date, selected_location, adjus
     # For each month, generate forecast and add to our dataset
     final_results = None
     
-    # Create a copy of the original dataset to preserve it
-    original_df = temp_df.copy()
-    
     for i, month in enumerate(months_to_forecast):
         month_str = month.strftime('%Y-%m')
-        st.write(f"Generating predicted forecast for {month.strftime('%B %Y')}...")
+        ui.write(f"Generating predicted forecast for {month.strftime('%B %Y')}...")
         
-        # Generate forecast for this month
-        forecast_results = forecast_leads(output_file, month_str, selected_location, adjustment_factor=adjustment_factor)
+        # Only the target month writes the results file
+        forecast_results = forecast_monthly_data(monthly_df, month_str, selected_location, adjustment_factor=adjustment_factor,
+                                                 workers=workers, render=(month == target_month), engine=engine,
+                                                 progress=progress if month == target_month else None,
+                                                 output_dir=output_dir)
         
         # Debug information for Bettendorf
         if forecast_results is not None and 'Bettendorf' in forecast_results['Location'].values:
             bettendorf_forecast = forecast_results[forecast_results['Location'] == 'Bettendorf']
-            st.write(f"Bettendorf forecast for {month_str}: {bettendorf_forecast['Predicted_Monthly_Leads'].values[0]} leads")
+            ui.write(f"Bettendorf forecast for {month_str}: {bettendorf_forecast['Predicted_Monthly_Leads'].values[0]} leads")
         elif selected_location == 'Bettendorf' or selected_location == 'All Locations':
-            st.warning(f"No Bettendorf forecast generated for {month_str}. This may cause issues with the visualization.")
+            ui.warning(f"No Bettendorf forecast generated for {month_str}. This may cause issues with the visualization.")
         
         # Save the final month's results
         if month == target_month:
             final_results = forecast_results
         
-        # If not the last month, add forecasted data to our dataset for next iteration
+        # If not the last month, use the predicted totals as this month's data for the next iteration
         if i < len(months_to_forecast) - 1:
-            # For each location in the forecast, add a new row to our temp dataset
             if forecast_results is not None:
-                # Reset temp_df to original data plus any previously added forecasts
-                # This prevents duplicate data from being added
-                if i == 0:
-                    temp_df = original_df.copy()
-                
-                # Filter out any existing data for the month we're about to add
-                next_month = months_to_forecast[i+1]
-                next_month_str = next_month.strftime('%Y-%m')
-                temp_df = temp_df[~(pd.to_datetime(temp_df['day_created']).dt.strftime('%Y-%m') == next_month_str)]
-                
-                for _, row in forecast_results.iterrows():
-                    location = row['Location']
-                    predicted_leads = row['Predicted_Monthly_Leads']
-                    
-                    # Create a new row for each day in the month (distribute leads evenly)
-                    days_in_month = pd.Period(month_str).days_in_month
-                    leads_per_day = predicted_leads / days_in_month
-                    
-                    for day in range(1, days_in_month + 1):
-                        day_date = f"{month_str}-{day:02d}"
-                        new_row = {
-                            'Media_Location_Text__c': location,
-                            'day_created': day_date,
-                            'Leads': leads_per_day
-                        }
-                        temp_df = pd.concat([temp_df, pd.DataFrame([new_row])], ignore_index=True)
-                
-                # Save updated dataset for next iteration
-                temp_df.to_csv(output_file, index=False)
+                # The prediction replaces (rather than adds to) any partial actuals for the month
+                predicted = pd.DataFrame({
+                    'Media_Location_Text__c': forecast_results['Location'].values,
+                    'month': month,
+                    'Leads': forecast_results['Predicted_Monthly_Leads'].round().astype(int).clip(lower=0).values
+                })
+                replaced = (monthly_df['month'] == month) & monthly_df['Media_Location_Text__c'].isin(predicted['Media_Location_Text__c'])
+                monthly_df = pd.concat([monthly_df[~replaced], predicted], ignore_index=True)
+                monthly_df = monthly_df.sort_values(['Media_Location_Text__c', 'month']).reset_index(drop=True)
                 
                 # Debug information after adding new data
-                if 'Bettendorf' in temp_df['Media_Location_Text__c'].values:
-                    bettendorf_data = temp_df[temp_df['Media_Location_Text__c'] == 'Bettendorf']
-                    latest_date = pd.to_datetime(bettendorf_data['day_created']).max()
-                    st.write(f"After adding {month_str} data, latest Bettendorf date: {latest_date.strftime('%Y-%m-%d')}")
+                if 'Bettendorf' in predicted['Media_Location_Text__c'].values:
+                    bettendorf_data = monthly_df[monthly_df['Media_Location_Text__c'] == 'Bettendorf']
+                    ui.write(f"After adding {month_str} data, latest Bettendorf month: {bettendorf_data['month'].max().strftime('%Y-%m')}")
                 
-                st.info(f"Added predicted data for {month.strftime('%B %Y')} to use as input for next month's forecast")
+                ui.info(f"Added predicted data for {month.strftime('%B %Y')} to use as input for next month's forecast")
             else:
-                st.error(f"No forecast results generated for {month_str}. Cannot continue chain forecasting.")
+                ui.error(f"No forecast results generated for {month_str}. Cannot continue chain forecasting.")
                 break
     
     # Final check to ensure we have data for the target month
     if final_results is not None and selected_location != 'All Locations':
         if selected_location not in final_results['Location'].values:
-            st.error(f"No forecast generated for {selected_location} in {target_date.strftime('%B %Y')}.")
+            ui.error(f"No forecast generated for {selected_location} in {target_date.strftime('%B %Y')}.")
             # Try to generate a direct forecast for the location
-            st.write(f"Attempting direct forecast for {selected_location}...")
-            direct_forecast = forecast_leads(output_file, selected_date, selected_location, adjustment_factor=adjustment_factor)
+            ui.write(f"Attempting direct forecast for {selected_location}...")
+            direct_forecast = forecast_leads(output_file, selected_date, selected_location, adjustment_factor=adjustment_factor, workers=workers,
+                                             monthly_data=monthly_data, engine=engine, output_dir=output_dir)
             if direct_forecast is not None and selected_location in direct_forecast['Location'].values:
-                st.success(f"Direct forecast for {selected_location} successful!")
+                ui.success(f"Direct forecast for {selected_location} successful!")
                 final_results = direct_forecast
     
-    # Restore original data to prevent contamination of future runs
-    original_df.to_csv(output_file, index=False)
-    
     return final_results
 
+def show_lead_data(output_file):
+    """Show the detailed lead data of each location (Debug Mode)"""
+    st.header("Debug Information")
+    st.subheader("Detailed Lead Data")
+
+    # Sort data by location and date
+    debug_df = load_lead_data(output_file).copy()
+    debug_df['day_created'] = pd.to_datetime(debug_df['day_created'])
+    debug_df = debug_df.sort_values(['Media_Location_Text__c', 'day_created'])
+
+    # Display data for each location
+    for location in debug_df['Media_Location_Text__c'].unique():
+        with st.expander(f"Lead data for {location}"):
+            location_data = debug_df[debug_df['Media_Location_Text__c'] == location]
+
+            # Show summary statistics
+            st.write(f"Total leads: {int(location_data['Leads'].sum())}")
+            st.write(f"Date range: {location_data['day_created'].min().strftime('%Y-%m-%d')} to {location_data['day_created'].max().strftime('%Y-%m-%d')}")
+
+            # Display each lead as its own row with Lead ID
+            # Ensure the table includes all available columns
+            # Format the DataFrame to show necessary columns first
+
+            # Reorder columns to put important ones first
+            columns_to_show = ['Id', 'day_created', 'Leads', 'Media_Location_Text__c']
+
+            # Add any other columns that exist in the DataFrame
+            other_columns = [col for col in location_data.columns if col not in columns_to_show]
+            display_columns = columns_to_show + other_columns
+
+            # Filter to only include columns that actually exist
+            display_columns = [col for col in display_columns if col in location_data.columns]
+
+            # Format date for better readability
+            if 'day_created' in location_data.columns:
+                location_data['day_created'] = location_data['day_created'].dt.strftime('%Y-%m-%d')
+
+            # Display the detailed data
+            st.dataframe(location_data[display_columns])
+
+            # Add download button for this location's data
+            csv = location_data.to_csv(index=False).encode('utf-8')
+            st.download_button(
+                label=f"Download {location} leads CSV",
+                data=csv,
+                file_name=f"{location}_leads.csv",
+                mime="text/csv"
+            )
+
+def show_adjustment_sweep(results_df, adjustment_factor):
+    """Show the predicted leads of unadjusted results under several adjustment factors side by side"""
+    with st.expander("Compare adjustment factors"):
+        options = sorted(set(SWEEP_FACTORS) | {adjustment_factor})
+        factors = st.multiselect("Adjustment factors", options,
+                                 default=sorted(set(DEFAULT_SWEEP_FACTORS) | {adjustment_factor}),
+                                 format_func=lambda factor: f"{factor:.0%}")
+        if factors:
+            st.dataframe(adjustment_sweep(results_df, sorted(factors)), hide_index=True)
+
+def show_forecast_results(raw_results, adjustment_factor, download_dir, debug_mode, selected_date, selected_location,
+                          workers=1, compare_factors=True):
+    """
+    Show forecast results with an adjustment applied, their charts and the download of the analysis
+
+    The adjustment is applied here rather than while forecasting, so changing
+    it only re-renders the page. The charts are drawn by the browser (see
+    charts.interactive_chart); PNGs are only drawn, at the factor shown, if
+    the download is asked for. compare_factors adds the side-by-side table of
+    other factors.
+    """
+    forecast_results = apply_adjustment(raw_results, adjustment_factor)
+    
+    # Display results
+    st.subheader("Forecast Results")
+    st.dataframe(forecast_results)
+    
+    # Locations whose ARIMA fit ran out of budget or failed (see forecast.fit_and_forecast)
+    if 'Engine' in forecast_results.columns:
+        fallback_locations = forecast_results.loc[forecast_results['Engine'] == FALLBACK_ENGINE, 'Location'].unique()
+        if len(fallback_locations):
+            st.info(f"ARIMA could not be fitted in time for {', '.join(fallback_locations)}; "
+                    f"these were forecast with {FALLBACK_ENGINE}")
+
+    # Debug comparison of original vs adjusted
+    if debug_mode and 'Original_Predicted_Monthly_Leads' in forecast_results.columns:
+        st.subheader("Forecast Adjustment Debug")
+        debug_df = forecast_results[[
+            'Location', 'Month', 'Original_Predicted_Monthly_Leads', 'Predicted_Monthly_Leads'
+        ]].rename(columns={
+            'Original_Predicted_Monthly_Leads': 'Original_Predicted_Leads',
+            'Predicted_Monthly_Leads': 'Adjusted_Predicted_Leads'
+        })
+        st.dataframe(debug_df)
+
+    if compare_factors:
+        show_adjustment_sweep(raw_results, adjustment_factor)
+
+    # Display visualizations
+    st.subheader("Forecast Visualizations")
+    cols = st.columns(2)
+    for col_idx, spec in enumerate(charts.chart_specs(forecast_results).values()):
+        cols[col_idx % 2].altair_chart(charts.interactive_chart(spec), use_container_width=True)
+
+    # Download button - only include selected location data. The archive is
+    # built when first asked for and then reused on every rerun.
+    zip_path = download_zip_path(forecast_results, download_dir)
+    if not os.path.exists(zip_path):
+        if not st.button("📦 Prepare Download"):
+            return
+        with st.spinner("Preparing download..."):
+            create_download_zip(forecast_results, download_dir, get_process_pool(workers) if workers > 1 else None)
+    with open(zip_path, 'rb') as zip_file:
+        st.download_button(
+            label="📥 Download Analysis",
+            data=zip_file,
+            file_name=f"terrece_analysis_{selected_date}_{selected_location}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+            mime="application/zip"
+        )
+
+def run_forecast_job(job, username, password, security_token, refresh_token, selected_date, selected_location,
+                     adjustment_factor, workers, method, engine, debug_mode, profile_run=False, trace_memory=False):
+    """
+    Fetch data and forecast in a background job (see jobs.submit)
+
+    Each location's results are added to the job as they finish and progress
+    messages are recorded on it. Pass adjustment_factor=1.0 for results the
+    page adjusts when showing them (see show_forecast_results).
+
+    Returns:
+    - dict with forecast_results, download_dir, output_file and fetched_at
+      (the last two are None when served from the results store)
+    """
+    ui = jobs.message_log(job)
+    # Files go to the job's own workspace so concurrent jobs never share them
+    output_dir = workspace.results_dir(job['workspace'])
+    if debug_mode:
+        profiling.start_trace(profile=profile_run, memory=trace_memory)
+    started = time.perf_counter()
+    source = 'live'
+    try:
+        # Nightly precomputed forecasts (batch_forecast.py) are served as is;
+        # debug runs and recursive chains are always computed live.
+        output_file, fetched_at = None, None
+        forecast_results = None
+        if not debug_mode and adjustment_factor == 1.0 and (method == 'direct' or not is_future_month(selected_date)):
+            forecast_results = load_stored_forecast(selected_date, selected_location, engine)
+            if forecast_results is not None:
+                source = 'store'
+                ui.info("Served from the nightly forecast store")
+        
+        if forecast_results is None:
+            # Reuses the cached session and data unless they have expired or a
+            # refresh was requested
+            lead_data, error = get_lead_data(username, password, security_token, aggregate=not debug_mode,
+                                             refresh_token=refresh_token)
+            if error:
+                raise RuntimeError(f"Authentication failed: {error}")
+            
+            # The monthly totals come with the data; every forecast below reuses them
+            output_file, monthly_data, fetched_at = lead_data
+            job['fetched_at'] = fetched_at
+            
+            def progress(results, done, total):
+                jobs.add_results(job, results, done, total)
+            
+            # Use chain forecasting for future months
+            with profiling.span('chain_forecast', method=method, engine=engine, adjustment_factor=adjustment_factor):
+                forecast_results = generate_chain_forecast(output_file, selected_date, selected_location, adjustment_factor=adjustment_factor,
+                                                           workers=workers, method=method, monthly_data=monthly_data,
+                                                           engine=engine, progress=progress, ui=ui,
+                                                           output_dir=output_dir)
+        
+        # Charts are drawn by the browser; the download and its PNGs are only built if the
+        # user asks for it, at the adjustment then selected (see show_forecast_results)
+        return {
+            'forecast_results': forecast_results,
+            'download_dir': job['workspace'],
+            'output_file': output_file,
+            'fetched_at': fetched_at
+        }
+    finally:
+        metrics.observe('terrece_forecast_seconds', time.perf_counter() - started,
+                        location=selected_location, engine=engine, source=source)
+        if debug_mode:
+            job['trace'] = profiling.stop_trace()
+
+def show_job_messages(job):
+    """Show the progress messages a job recorded, with the matching Streamlit calls"""
+    for kind, text in job['messages']:
+        getattr(st, kind)(text)
+
+def display_factor(job, adjustment_factor):
+    """Adjustment still to apply to a job's results (recursive chains are adjusted while forecasting)"""
+    return 1.0 if job['details']['adjusted_in_job'] else adjustment_factor
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_running_job(job_id, adjustment_factor):
+    """Show a running job's progress and finished locations, refreshing until it is done"""
+    job = jobs.get(job_id)
+    if job is None or not jobs.is_active(job):
+        # Render the finished job with the full page
+        st.rerun()
+    
+    done, total = job['progress']
+    if total:
+        st.progress(done / total, text=f"Forecasting... {done} of {total} locations done")
+    else:
+        st.progress(0.0, text="Authenticating with Salesforce and fetching data...")
+    show_job_messages(job)
+    
+    if job['partial']:
+        partial_df = apply_adjustment(pd.DataFrame(job['partial']), display_factor(job, adjustment_factor))
+        # Charts are drawn once every location is done
+        st.dataframe(partial_df)
+
+def show_finished_job(job, adjustment_factor):
+    """Show the outcome of a finished job, with the adjustment currently selected"""
+    details = job['details']
+    if job['status'] == 'failed':
+        st.error(job['error'])
+        return
+    
+    result = job['result']
+    if result['fetched_at'] is not None:
+        st.session_state['lead_data_status'] = (details['username'], result['fetched_at'])
+    if details['debug_mode']:
+        st.session_state['performance_trace'] = job.get('trace')
+    
+    show_job_messages(job)
+    if details['debug_mode'] and result['output_file']:
+        show_lead_data(result['output_file'])
+    
+    if result['forecast_results'] is not None:
+        if details['adjusted_in_job'] and adjustment_factor != details['adjustment_factor']:
+            st.info(f"Recursive chains feed each adjusted month into the next, so this forecast keeps the "
+                    f"{details['adjustment_factor']:g} adjustment it was generated with. Generate again to use {adjustment_factor:g}.")
+        show_forecast_results(result['forecast_results'], display_factor(job, adjustment_factor), result['download_dir'],
+                              details['debug_mode'], details['selected_date'], details['selected_location'],
+                              workers=details['workers'], compare_factors=not details['adjusted_in_job'])
+    else:
+        st.error("No forecast results were generated. Please check the logs for details.")
+
+def show_performance_panel(trace):
+    """Show the per-stage timings of the last traced run in Debug Mode"""
+    st.header("Performance")
+    st.write(f"Last run took {trace['seconds']:.2f}s")
+    summary = profiling.summarize(trace)
+    st.dataframe(summary.round(3), hide_index=True)
+    
+    if trace['profile_text']:
+        with st.expander("cProfile summary"):
+            st.code(trace['profile_text'])
+    
+    stamp = datetime.fromtimestamp(trace['started']).strftime('%Y%m%d_%H%M%S')
+    st.download_button(
+        label="Download trace (JSON)",
+        data=profiling.trace_json(trace),
+        file_name=f"terrece_trace_{stamp}.json",
+        mime="application/json"
+    )
+    if trace['profile_data']:
+        st.download_button(
+            label="Download profile (.prof)",
+            data=trace['profile_data'],
+            file_name=f"terrece_profile_{stamp}.prof",
+            mime="application/octet-stream"
+        )
+
 # Function to load credentials from file
 def load_credentials():
     creds = {
@@ -175,6 +578,8 @@ credentials = load_credentials()
 
 def main():
     st.set_page_config(page_title="Terrece - Orchard's Lead Forecasting Agent", layout="wide")
+    # Serve /metrics (TERRECE_METRICS_PORT) or write the textfile; only the first run starts it
+    metrics.start_exporter()
     
     # Add logo and title in a container
     header_container = st.container()
@@ -198,6 +603,8 @@ def main():
     if credentials["username"] and credentials["password"] and credentials["security_token"]:
         st.sidebar.success("Test credentials loaded from credentials.ini")
     
+    show_data_status(username)
+    
     # Forecast Adjustment input
     forecast_adjustment = st.sidebar.number_input(
         label="Forecast Adjustment (0-1)",
@@ -213,28 +620,42 @@ def main():
         st.title("Settings")
         debug_mode = st.toggle("Debug Mode", value=False, help="Enable to see detailed lead data")
         st.session_state['debug_mode'] = debug_mode
+        profile_run = False
+        trace_memory = False
+        if debug_mode:
+            profile_run = st.checkbox("Profile with cProfile", value=False,
+                                      help="Record a function-level profile of the next forecast run")
+            trace_memory = st.checkbox("Trace memory", value=False,
+                                       help="Record peak memory per stage (makes the run slower)")
+        forecast_workers = st.number_input(
+            "Forecast workers",
+            min_value=1,
+            max_value=os.cpu_count() or 1,
+            value=min(4, os.cpu_count() or 1),
+            help="Number of processes used to fit locations in parallel"
+        )
+        future_method = st.radio(
+            "Future month forecasting",
+            ["direct", "recursive"],
+            format_func=lambda x: {"direct": "Direct (one fit, all months)", "recursive": "Recursive chain"}[x],
+            help="Direct forecasts every month up to the selected one from a single model fit"
+        )
+        model_engine = st.radio(
+            "Model engine",
+            ENGINES,
+            format_func=lambda x: {"statsmodels": "statsmodels (per location)", "batch": "Batched (all locations at once)"}[x],
+            help="The batched engine fits every location together in NumPy and is much faster"
+        )
     
-    # Date selection
-    available_dates = pd.date_range(
-        start='2025-01',
-        periods=12,
-        freq='ME'
-    )
+    # Date selection (the same months batch_forecast.py precomputes)
     selected_date = st.selectbox(
         "Select prediction month",
-        available_dates.strftime('%Y-%m'),
+        prediction_months(),
         format_func=lambda x: pd.to_datetime(x).strftime('%B %Y')
     )
     
     # Location selection
-    location_options = ['All Locations'] + [
-        'Ankeny', 'Bettendorf', 'Boise', 'Chesterfield', 'Chicago',
-        'Coeur d\'Alene', 'Crystal Lake', 'De Pere', 'Eau Claire', 'Elgin',
-        'Geneva', 'Iowa City', 'Janesville', 'LaCrosse', 'Lake Geneva',
-        'Mequon', 'Meridian', 'Nampa', 'Oakville', 'Pewaukee', 'Rolling Meadows',
-        'St. Cloud', 'Urbandale', 'Warrenville', 'Weldon Spring',
-        'West Madison'
-    ]
+    location_options = ['All Locations'] + locations.canonical_locations()
     selected_location = st.selectbox("Select location", location_options)
     
     if st.button("Generate Forecast"):
@@ -243,108 +664,36 @@ def main():
             st.error("Please provide your Salesforce credentials in the sidebar before generating a forecast.")
             return
         
-        with st.spinner("Authenticating with Salesforce and fetching data..."):
-            # Get data from Salesforce with provided credentials
-            output_file, error = get_salesforce_data(username, password, security_token, selected_date)
-            
-            if error:
-                st.error(f"Authentication failed: {error}")
-                return
-            
-            if not output_file:
-                st.error("Failed to retrieve data from Salesforce.")
-                return
-            
-            # Display debug information if debug mode is enabled
-            if debug_mode:
-                st.header("Debug Information")
-                st.subheader("Detailed Lead Data")
-                
-                # Sort data by location and date
-                debug_df = pd.read_csv(output_file).copy()
-                debug_df['day_created'] = pd.to_datetime(debug_df['day_created'])
-                debug_df = debug_df.sort_values(['Media_Location_Text__c', 'day_created'])
-                
-                # Display data for each location
-                for location in debug_df['Media_Location_Text__c'].unique():
-                    with st.expander(f"Lead data for {location}"):
-                        location_data = debug_df[debug_df['Media_Location_Text__c'] == location]
-                        
-                        # Show summary statistics
-                        st.write(f"Total leads: {len(location_data)}")
-                        st.write(f"Date range: {location_data['day_created'].min().strftime('%Y-%m-%d')} to {location_data['day_created'].max().strftime('%Y-%m-%d')}")
-                        
-                        # Display each lead as its own row with Lead ID
-                        # Ensure the table includes all available columns
-                        # Format the DataFrame to show necessary columns first
-                        
-                        # Reorder columns to put important ones first
-                        columns_to_show = ['Id', 'day_created', 'Leads', 'Media_Location_Text__c']
-                        
-                        # Add any other columns that exist in the DataFrame
-                        other_columns = [col for col in location_data.columns if col not in columns_to_show]
-                        display_columns = columns_to_show + other_columns
-                        
-                        # Filter to only include columns that actually exist
-                        display_columns = [col for col in display_columns if col in location_data.columns]
-                        
-                        # Format date for better readability
-                        if 'day_created' in location_data.columns:
-                            location_data['day_created'] = location_data['day_created'].dt.strftime('%Y-%m-%d')
-                        
-                        # Display the detailed data
-                        st.dataframe(location_data[display_columns])
-                        
-                        # Add download button for this location's data
-                        csv = location_data.to_csv(index=False).encode('utf-8')
-                        st.download_button(
-                            label=f"Download {location} leads CSV",
-                            data=csv,
-                            file_name=f"{location}_leads.csv",
-                            mime="text/csv"
-                        )
-            
-            # Use chain forecasting for future months
-            print(f"DEBUG: Passing forecast_adjustment value: {forecast_adjustment}")
-            forecast_results = generate_chain_forecast(output_file, selected_date, selected_location, adjustment_factor=forecast_adjustment)
-            
-            if forecast_results is not None:
-                # Display results
-                st.subheader("Forecast Results")
-                st.dataframe(forecast_results)
-
-                # Debug comparison of original vs adjusted
-                if debug_mode and 'Original_Predicted_Monthly_Leads' in forecast_results.columns:
-                    st.subheader("Forecast Adjustment Debug")
-                    debug_df = forecast_results[[
-                        'Location', 'Month', 'Original_Predicted_Monthly_Leads', 'Predicted_Monthly_Leads'
-                    ]].rename(columns={
-                        'Original_Predicted_Monthly_Leads': 'Original_Predicted_Leads',
-                        'Predicted_Monthly_Leads': 'Adjusted_Predicted_Leads'
-                    })
-                    st.dataframe(debug_df)
-                
-                # Display visualizations
-                st.subheader("Forecast Visualizations")
-                cols = st.columns(2)
-                col_idx = 0
-                
-                for location in forecast_results['Location'].unique():
-                    image_path = f"forecast_visuals/{location}_forecast.png"
-                    if os.path.exists(image_path):
-                        cols[col_idx].image(image_path)
-                        col_idx = (col_idx + 1) % 2
-            
-                # Download button - only include selected location data
-                zip_data = create_download_zip(forecast_results, "forecast_visuals")
-                st.download_button(
-                    label="📥 Download Analysis",
-                    data=zip_data,
-                    file_name=f"terrece_analysis_{selected_date}_{selected_location}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
-                    mime="application/zip"
-                )
-            else:
-                st.error("No forecast results were generated. Please check the logs for details.")
+        # Identical requests share one job, so a finished forecast is never recomputed
+        credentials_hash = hashlib.sha256(f"{password}|{security_token}".encode('utf-8')).hexdigest()
+        refresh_token = st.session_state.get('refresh_token', 0)
+        # Results are forecast unadjusted and adjusted on display, so trying
+        # another factor needs no new job. Recursive chains are the exception:
+        # each adjusted month is fed into the next.
+        adjusted_in_job = future_method == 'recursive' and is_future_month(selected_date)
+        job_inputs = (selected_date, selected_location, forecast_adjustment if adjusted_in_job else 1.0,
+                      forecast_workers, future_method, model_engine, debug_mode, profile_run, trace_memory)
+        st.session_state['forecast_job'] = jobs.submit(
+            (username, credentials_hash, refresh_token) + job_inputs,
+            run_forecast_job, username, password, security_token, refresh_token, *job_inputs,
+            details={'username': username, 'selected_date': selected_date, 'selected_location': selected_location,
+                     'debug_mode': debug_mode, 'workers': forecast_workers, 'adjusted_in_job': adjusted_in_job,
+                     'adjustment_factor': job_inputs[2]},
+            reuse_for=DATA_TTL_MINUTES * 60
+        )
+    
+    # The last job keeps showing (and updating) across reruns until another is started
+    job_id = st.session_state.get('forecast_job')
+    if job_id:
+        job = jobs.get(job_id)
+        if job is not None and jobs.is_active(job):
+            show_running_job(job_id, forecast_adjustment)
+        elif job is not None:
+            show_finished_job(job, forecast_adjustment)
+    
+    # The last traced run stays visible across reruns while debugging
+    if debug_mode and st.session_state.get('performance_trace'):
+        show_performance_panel(st.session_state['performance_trace'])
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
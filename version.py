@@ -1,43 +1,54 @@
 #!/usr/bin/env python3
 """
 Version information for Terrece application
+
+The version is resolved from git once, at build time, and written to
+version.json (`python version.py --write`, run by deploy_azure.sh), so
+starting the app never runs git. Without the file the manual fallback
+version is used.
 """
 
 import subprocess
+import argparse
 import datetime
+import json
 import os
 
+# Written at build time by `python version.py --write`
+VERSION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "version.json")
+
+# Fallback to manual version if git is not available
+MANUAL_VERSION = "2025.06.18.001"  # Update this manually when needed
+
 def get_git_version():
     """Get version from git commit info"""
     try:
         # Get the latest commit hash and timestamp
         commit_hash = subprocess.check_output(
-            ["git", "rev-parse", "--short", "HEAD"], 
-            cwd=os.path.dirname(__file__),
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
             stderr=subprocess.DEVNULL
         ).decode().strip()
-        
+
         commit_date = subprocess.check_output(
             ["git", "show", "-s", "--format=%ci", "HEAD"],
-            cwd=os.path.dirname(__file__),
+            cwd=os.path.dirname(os.path.abspath(__file__)),
             stderr=subprocess.DEVNULL
         ).decode().strip()
-        
+
         # Format: YYYY-MM-DD-HHMMSS-hash
         date_part = datetime.datetime.strptime(commit_date[:19], "%Y-%m-%d %H:%M:%S")
         version = f"{date_part.strftime('%Y.%m.%d.%H%M%S')}-{commit_hash}"
-        
+
         return version, commit_date, commit_hash
-        
+
     except (subprocess.CalledProcessError, FileNotFoundError, Exception):
-        # Fallback to manual version if git is not available
-        manual_version = "2025.06.18.001"  # Update this manually when needed
-        return manual_version, "Manual version", "no-git"
+        return MANUAL_VERSION, "Manual version", "no-git"
 
 def get_version_info():
-    """Get complete version information"""
+    """Get complete version information from git"""
     version, commit_date, commit_hash = get_git_version()
-    
+
     return {
         "version": version,
         "commit_date": commit_date,
@@ -45,13 +56,41 @@ def get_version_info():
         "build_time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     }
 
-# Get version at module import
-VERSION_INFO = get_version_info()
+def write_version_file(path=VERSION_FILE):
+    """Resolve the version from git and save it for load_version_info"""
+    info = get_version_info()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(info, f, indent=2)
+    os.replace(tmp_path, path)
+    return info
+
+def load_version_info(path=VERSION_FILE):
+    """Read the version written at build time, or the manual version if there is none"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {
+            "version": MANUAL_VERSION,
+            "commit_date": "Manual version",
+            "commit_hash": "no-git",
+            "build_time": "unknown"
+        }
+
+# Read the build-time version at module import
+VERSION_INFO = load_version_info()
 VERSION = VERSION_INFO["version"]
 
 if __name__ == "__main__":
-    info = get_version_info()
+    parser = argparse.ArgumentParser(description="Show the Terrece version")
+    parser.add_argument("--write", action="store_true", help=f"Resolve the version from git and save it to {os.path.basename(VERSION_FILE)}")
+    args = parser.parse_args()
+
+    info = write_version_file() if args.write else get_version_info()
     print(f"Terrece Version: {info['version']}")
     print(f"Commit Date: {info['commit_date']}")
     print(f"Commit Hash: {info['commit_hash']}")
-    print(f"Build Time: {info['build_time']}") 
\ No newline at end of file
+    print(f"Build Time: {info['build_time']}")
+    if args.write:
+        print(f"Saved to {VERSION_FILE}")
@@ -0,0 +1,54 @@
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+
+# Private directories for each forecast job's results file and downloads
+WORKSPACE_ROOT = os.path.join(tempfile.gettempdir(), "terrece_workspaces")
+
+# Workspaces left behind by earlier processes are removed after this long
+STALE_WORKSPACE_HOURS = 24
+
+def create(root=WORKSPACE_ROOT):
+    """Create a new, empty workspace directory and return its path"""
+    os.makedirs(root, exist_ok=True)
+    return tempfile.mkdtemp(prefix="job_", dir=root)
+
+def results_dir(workspace):
+    """Directory a workspace's forecast results file is written to"""
+    return os.path.join(workspace, "forecast_results")
+
+def remove(workspace):
+    """Delete a workspace and everything in it"""
+    shutil.rmtree(workspace, ignore_errors=True)
+
+def remove_stale(max_age_hours=STALE_WORKSPACE_HOURS, root=WORKSPACE_ROOT):
+    """
+    Delete workspaces not modified for max_age_hours, e.g. left by a crashed process
+
+    Returns:
+    - Number of workspaces removed
+    """
+    if not os.path.isdir(root):
+        return 0
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+                remove(path)
+                removed += 1
+        except FileNotFoundError:
+            continue
+    return removed
+
+@contextlib.contextmanager
+def temporary(root=WORKSPACE_ROOT):
+    """Workspace that is removed when the block exits"""
+    workspace = create(root)
+    try:
+        yield workspace
+    finally:
+        remove(workspace)